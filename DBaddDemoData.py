@@ -1,9 +1,13 @@
-import psycopg2
-from psycopg2 import sql
 from dotenv import load_dotenv
+import argparse
+import asyncio
 import os
 import random
 import json
+import time
+from decimal import Decimal
+
+import DBbulk
 
 # Load environment variables from .env file
 load_dotenv()
@@ -17,140 +21,195 @@ db_config = {
     'port': 5432
 }
 
-def generate_random_demo_data():
-    """Generate random demo data for the tables."""
-    # Randomly generate users
-    users_data = [
-        (
-            random.randint(1e15, 1e16 - 1),               # token
-            random.randint(0, 1),                        # isCreator
-            random.randint(0, 1),                        # hasDomain
-            f"domain{random.randint(1, 100)}.com" if random.randint(0, 1) else None,  # domain
-            random.randint(0, 10),                       # domainID
-            round(random.uniform(0, 500), 2),            # balance
-            f"4{random.randint(1000, 9999)}{random.randint(1000, 9999)}{random.randint(1000, 9999)}{random.randint(1000, 9999)}",  # ccNumber
-            f"{random.randint(1, 12):02d}/{random.randint(23, 30)}",  # ccValid
-            random.randint(0, 1),                        # ccState
-            f"Bank {random.choice(['A', 'B', 'C'])}",    # bankName
-            f"CY17{random.randint(1000000000000000, 9999999999999999)}",  # bankIban
-            json.dumps({"likes": [random.randint(1, 10) for _ in range(random.randint(1, 5))]})  # likes
-        ) for _ in range(5)
-    ]
-
-    # Randomly generate helpitems
-    helpitems_data = [
-        (
-            random.randint(1, 5),                        # creatorID
-            random.randint(1, 5),                        # ownerID
-            random.randint(1, 5),                        # chapterID
-            random.randint(1, 3),                        # kind
-            random.randint(0, 2),                        # state
-            random.randint(0, 100),                      # voteup
-            random.randint(0, 50),                       # votedown
-            random.randint(0, 1),                        # uploadstate
-            f"QR{random.randint(1, 1000):03d}",          # QR
-            f"Demo Title {random.randint(1, 100)}",      # title
-            f"Description {random.randint(1, 100)}",     # description
-            random.choice(['English', 'French', 'Spanish']),  # language
-            f"image{random.randint(1, 100)}.jpg",        # imagefn
-            f"img{random.randint(1, 100)}",              # imageid
-            f"video{random.randint(1, 100)}.mp4",        # videofn
-            f"vid{random.randint(1, 100)}",              # videoid
-            f"s{random.randint(1, 10):03d}.helpthing.com",  # host
-            "Sample content",                            # content
-            round(random.uniform(0, 100), 2),            # price
-            round(random.uniform(0, 100), 2)             # budget
-        ) for _ in range(5)
-    ]
-
-    # Randomly generate chapters
-    chapters_data = [
-        (
-            random.randint(1, 5),                        # domainID
-            random.choice([None, random.randint(1, 5)]), # parentID
-            f"Chapter {random.randint(1, 100)}",         # title
-            random.randint(0, 1),                        # enableVideo
-            random.randint(0, 1),                        # enableImage
-            random.randint(0, 1),                        # enableWiki
-            random.randint(0, 1),                        # enableChat
-            random.randint(0, 1),                        # enableExpert
-            random.randint(0, 1),                        # enableAdd
-            f"Playlist {random.randint(1, 100)}",        # playlist
-            round(random.uniform(0, 500), 2)             # budget
-        ) for _ in range(5)
-    ]
-
-    # Randomly generate experts
-    experts_data = [
-        (
-            random.randint(1, 5),                        # chapterID
-            random.randint(1, 5),                        # userID
-            f"Expert {random.randint(1, 100)}",          # name
-            f"Expert in field {random.randint(1, 100)}", # description
-            f"Mon-Fri {random.randint(8, 12)}-{random.randint(1, 5)}",  # schedule
-            random.choice(['English', 'French, Spanish', 'English, Italian']),  # languages
-            random.choice(['online', 'offline']),        # online
-            round(random.uniform(10, 100), 2),           # price
-            round(random.uniform(0, 5), 1),              # ranking
-            random.randint(0, 100),                      # jobs
-            random.choice(['real', 'bot', 'AI']),        # type
-            f"expert{random.randint(1, 100)}.jpg",       # url_image
-            f"expert{random.randint(1, 100)}.mp4",       # url_video
-            random.choice([True, False])                 # _active
-        ) for _ in range(5)
-    ]
-
-    return users_data, helpitems_data, chapters_data, experts_data
-
-def insert_demo_data():
-    users_data, helpitems_data, chapters_data, experts_data = generate_random_demo_data()
+# Default sizes keep the old 5-rows-per-table demo; pass larger counts on the command line
+# (e.g. --experts 1000000) for production-size data. Rows are generated and COPYed in
+# chunks, so memory stays flat apart from the id lists used for references.
+CHUNK_SIZE = 10000
+CHAPTER_MAX_DEPTH = 6       # deepest level of the generated chapter tree
+CHAPTER_ROOT_SHARE = 0.02   # share of chapters that start a new tree
+
+LANGUAGES = ['English', 'French', 'Spanish', 'German', 'Italian', 'Greek']
+
+USERS_COLUMNS = ['token', 'isCreator', 'hasDomain', 'domain', 'domainID', 'balance', 'ccNumber', 'ccValid', 'ccState',
+                 'bankName', 'bankIban', 'likes']
+HELPITEMS_COLUMNS = ['creatorID', 'ownerID', 'chapterID', 'kind', 'state', 'voteup', 'votedown', 'uploadstate', 'QR',
+                     'title', 'description', 'language', 'imagefn', 'imageid', 'videofn', 'videoid', 'host', 'content',
+                     'price', 'budget']
+CHAPTERS_COLUMNS = ['domainID', 'parentID', 'title', 'enableVideo', 'enableImage', 'enableWiki', 'enableChat',
+                    'enableExpert', 'enableAdd', 'playlist', 'budget']
+EXPERTS_COLUMNS = ['chapterID', 'userID', 'name', 'description', 'schedule', 'languages', 'online', 'price', 'ranking',
+                   'jobs', 'type', 'url_image', 'url_video', '_active']
+
+# the expert change-notification trigger is switched off while loading, so a multi-million
+# row COPY does not queue one NOTIFY per row; foreign keys stay enforced. The chapter one
+# stays on: running servers build their chapter tree from those notifications.
+NOTIFY_TRIGGERS = [('tableExperts', 'papi2_expert_change')]
+
+
+def random_amount(low, high, places=2):
+    # a Decimal, so COPY stores it as written; a float would land in NUMERIC as its binary expansion
+    return Decimal(str(round(random.uniform(low, high), places)))
+
+
+def random_user():
+    return (
+        random.randint(10 ** 15, 10 ** 16 - 1),      # token
+        random.randint(0, 1),                        # isCreator
+        random.randint(0, 1),                        # hasDomain
+        f"domain{random.randint(1, 100)}.com" if random.randint(0, 1) else None,  # domain
+        random.randint(0, 10),                       # domainID
+        random_amount(0, 500),                       # balance
+        f"4{random.randint(1000, 9999)}{random.randint(1000, 9999)}{random.randint(1000, 9999)}{random.randint(1000, 9999)}",  # ccNumber
+        f"{random.randint(1, 12):02d}/{random.randint(23, 30)}",  # ccValid
+        random.randint(0, 1),                        # ccState
+        f"Bank {random.choice(['A', 'B', 'C'])}",    # bankName
+        f"CY17{random.randint(1000000000000000, 9999999999999999)}",  # bankIban
+        json.dumps({"likes": [random.randint(1, 10) for _ in range(random.randint(1, 5))]})  # likes
+    )
+
+
+def random_chapter(parent_id):
+    return (
+        random.randint(1, 5),                        # domainID
+        parent_id,                                   # parentID
+        f"Chapter {random.randint(1, 100)}",         # title
+        random.randint(0, 1),                        # enableVideo
+        random.randint(0, 1),                        # enableImage
+        random.randint(0, 1),                        # enableWiki
+        random.randint(0, 1),                        # enableChat
+        random.randint(0, 1),                        # enableExpert
+        random.randint(0, 1),                        # enableAdd
+        f"Playlist {random.randint(1, 100)}",        # playlist
+        random_amount(0, 500)                        # budget
+    )
+
+
+def random_helpitem(chapter_id, creator_id, owner_id):
+    return (
+        creator_id,                                  # creatorID
+        owner_id,                                    # ownerID
+        chapter_id,                                  # chapterID
+        random.randint(1, 3),                        # kind
+        random.randint(0, 2),                        # state
+        random.randint(0, 100),                      # voteup
+        random.randint(0, 50),                       # votedown
+        random.randint(0, 1),                        # uploadstate
+        f"QR{random.randint(1, 1000):03d}",          # QR
+        f"Demo Title {random.randint(1, 100)}",      # title
+        f"Description {random.randint(1, 100)}",     # description
+        random.choice(LANGUAGES),                    # language
+        f"image{random.randint(1, 100)}.jpg",        # imagefn
+        f"img{random.randint(1, 100)}",              # imageid
+        f"video{random.randint(1, 100)}.mp4",        # videofn
+        f"vid{random.randint(1, 100)}",              # videoid
+        f"s{random.randint(1, 10):03d}.helpthing.com",  # host
+        "Sample content",                            # content
+        random_amount(0, 100),                       # price
+        random_amount(0, 100)                        # budget
+    )
+
+
+def random_expert(chapter_id, user_id):
+    return (
+        chapter_id,                                  # chapterID
+        user_id,                                     # userID
+        f"Expert {random.randint(1, 100)}",          # name
+        f"Expert in field {random.randint(1, 100)}", # description
+        f"Mon-Fri {random.randint(8, 12)}-{random.randint(1, 5)}",  # schedule
+        ', '.join(random.sample(LANGUAGES, random.randint(1, 3))),  # languages
+        random.choice(['online', 'offline']),        # online
+        random_amount(10, 100),                      # price
+        random_amount(0, 5, 1),                      # ranking
+        random.randint(0, 100),                      # jobs
+        random.choice(['real', 'bot', 'AI']),        # type
+        f"expert{random.randint(1, 100)}.jpg",       # url_image
+        f"expert{random.randint(1, 100)}.mp4",       # url_video
+        random.choice([True, False])                 # _active
+    )
+
+
+def skewed_choice(ids):
+    # a few chapters/users get most of the rows, like real traffic (square bias toward the front)
+    return ids[int(len(ids) * random.random() ** 2)]
+
+
+def plan_chapter_parents(chapter_ids):
+    """parentID for each chapter: a forest of trees no deeper than CHAPTER_MAX_DEPTH."""
+    depth = bytearray(len(chapter_ids))
+    parents = []
+    for idx in range(len(chapter_ids)):
+        parent = None
+        if idx > 0 and random.random() >= CHAPTER_ROOT_SHARE:
+            candidate = random.randrange(idx)
+            if depth[candidate] < CHAPTER_MAX_DEPTH - 1:
+                parent = candidate
+        if parent is None:
+            parents.append(None)
+        else:
+            depth[idx] = depth[parent] + 1
+            parents.append(chapter_ids[parent])
+    return parents
+
+
+async def copy_in_chunks(connection, table, columns, count, make_row, id_column=None, ids=None):
+    start = time.perf_counter()
+    for offset in range(0, count, CHUNK_SIZE):
+        size = min(CHUNK_SIZE, count - offset)
+        records = [make_row(offset + idx) for idx in range(size)]
+        if ids is not None:
+            # ids reserved up front (chapters reference each other)
+            await DBbulk.copy_rows(connection, table, [id_column] + columns,
+                                   [(ids[offset + idx],) + record for idx, record in enumerate(records)])
+        else:
+            await DBbulk.copy_rows(connection, table, columns, records)
+    print(f"{count} rows of random demo data inserted into '{table}' ({time.perf_counter() - start:.1f}s).")
+
+
+async def insert_demo_data_async(users=5, chapters=5, experts=5, helpitems=5, seed=None):
+    random.seed(seed)
+    connection = await DBbulk.connect(db_config)
+    try:
+        async with connection.transaction():
+            for table, trigger in NOTIFY_TRIGGERS:
+                await connection.execute(f"ALTER TABLE {table} DISABLE TRIGGER {trigger}")
+
+            user_ids = await DBbulk.reserve_ids(connection, 'tableUsers', 'userID', users)
+            await copy_in_chunks(connection, 'tableUsers', USERS_COLUMNS, users, lambda idx: random_user(),
+                                 id_column='userID', ids=user_ids)
+
+            chapter_ids = await DBbulk.reserve_ids(connection, 'tableChapters', 'chapterID', chapters)
+            parents = plan_chapter_parents(chapter_ids)
+            await copy_in_chunks(connection, 'tableChapters', CHAPTERS_COLUMNS, chapters,
+                                 lambda idx: random_chapter(parents[idx]), id_column='chapterID', ids=chapter_ids)
+
+            await copy_in_chunks(connection, 'tableHelpitems', HELPITEMS_COLUMNS, helpitems,
+                                 lambda idx: random_helpitem(skewed_choice(chapter_ids), random.choice(user_ids),
+                                                             random.choice(user_ids)))
+            await copy_in_chunks(connection, 'tableExperts', EXPERTS_COLUMNS, experts,
+                                 lambda idx: random_expert(skewed_choice(chapter_ids), random.choice(user_ids)))
+
+            for table, trigger in NOTIFY_TRIGGERS:
+                await connection.execute(f"ALTER TABLE {table} ENABLE TRIGGER {trigger}")
+        for table in ('tableUsers', 'tableChapters', 'tableHelpitems', 'tableExperts'):
+            await connection.execute(f"ANALYZE {table}")
+    finally:
+        await connection.close()
 
+
+def insert_demo_data(**counts):
     try:
-        # Establish connection to the database
-        connection = psycopg2.connect(**db_config)
-        cursor = connection.cursor()
-
-        # Insert into tableUsers
-        cursor.executemany('''
-            INSERT INTO tableUsers (token, isCreator, hasDomain, domain, domainID, balance, ccNumber, ccValid, ccState, bankName, bankIban, likes)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ''', users_data)
-        connection.commit()
-        print("Random demo data inserted into 'tableUsers'.")
-
-        # Insert into tableHelpitems
-        cursor.executemany('''
-            INSERT INTO tableHelpitems (creatorID, ownerID, chapterID, kind, state, voteup, votedown, uploadstate, QR, title, description, language, imagefn, imageid, videofn, videoid, host, content, price, budget)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ''', helpitems_data)
-        connection.commit()
-        print("Random demo data inserted into 'tableHelpitems'.")
-
-        # Insert into tableChapters
-        cursor.executemany('''
-            INSERT INTO tableChapters (domainID, parentID, title, enableVideo, enableImage, enableWiki, enableChat, enableExpert, enableAdd, playlist, budget)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ''', chapters_data)
-        connection.commit()
-        print("Random demo data inserted into 'tableChapters'.")
-
-        # Insert into tableExperts
-        cursor.executemany('''
-            INSERT INTO tableExperts (chapterID, userID, name, description, schedule, languages, online, price, ranking, jobs, type, url_image, url_video, _active)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ''', experts_data)
-        connection.commit()
-        print("Random demo data inserted into 'tableExperts'.")
-
-    except (Exception, psycopg2.DatabaseError) as error:
+        asyncio.run(insert_demo_data_async(**counts))
+    except Exception as error:
         print(f"Error while inserting demo data: {error}")
 
-    finally:
-        # Close the cursor and the connection
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
 
 if __name__ == "__main__":
-    insert_demo_data()
+    parser = argparse.ArgumentParser(description="Insert referentially consistent random demo data.")
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--chapters", type=int, default=5)
+    parser.add_argument("--experts", type=int, default=5)
+    parser.add_argument("--helpitems", type=int, default=5)
+    parser.add_argument("--seed", type=int, help="make the generated data reproducible")
+    args = parser.parse_args()
+    insert_demo_data(users=args.users, chapters=args.chapters, experts=args.experts, helpitems=args.helpitems,
+                     seed=args.seed)
@@ -0,0 +1,113 @@
+import asyncpg
+
+# Set-based loaders shared by the papi2 bulk endpoints and DBaddDemoData.
+# Every function takes an open asyncpg connection; the caller owns the transaction.
+
+# Postgres types of the columns the bulk paths touch, used to cast unnest() arrays
+COLUMN_TYPES = {
+    'tableexperts': {
+        'id': 'int', 'chapterid': 'int', 'userid': 'int', 'name': 'text', 'description': 'text', 'schedule': 'text',
+        'languages': 'text', 'online': 'text', 'price': 'numeric', 'ranking': 'numeric', 'jobs': 'int',
+        'type': 'text', 'url_image': 'text', 'url_video': 'text', '_active': 'bool', 'enabled': 'bool',
+    },
+    'tablechapters': {
+        'chapterid': 'int', 'domainid': 'int', 'parentid': 'int', 'title': 'text', 'enablevideo': 'int',
+        'enableimage': 'int', 'enablewiki': 'int', 'enablechat': 'int', 'enableexpert': 'int', 'enableadd': 'int',
+        'playlist': 'text', 'budget': 'numeric',
+    },
+    'tablehelpitems': {
+        'itemid': 'int', 'creatorid': 'int', 'ownerid': 'int', 'chapterid': 'int', 'kind': 'int', 'state': 'int',
+        'voteup': 'int', 'votedown': 'int', 'uploadstate': 'int',
+    },
+}
+
+
+async def reserve_ids(conn, table: str, id_column: str, count: int) -> list:
+    """Draw count values from the SERIAL sequence behind table.id_column."""
+    if count == 0:
+        return []
+    rows = await conn.fetch(
+        "SELECT nextval(pg_get_serial_sequence($1, $2)) FROM generate_series(1, $3)",
+        table.lower(), id_column.lower(), count)
+    return [row[0] for row in rows]
+
+
+async def copy_rows(conn, table: str, columns: list, records: list, id_column: str = None) -> list:
+    """COPY records into table. With id_column, ids are reserved up front and returned in record order."""
+    table = table.lower()
+    columns = [column.lower() for column in columns]
+    if id_column is None:
+        await conn.copy_records_to_table(table, columns=columns, records=records)
+        return []
+    ids = await reserve_ids(conn, table, id_column, len(records))
+    await conn.copy_records_to_table(
+        table, columns=[id_column.lower()] + columns,
+        records=[(row_id,) + tuple(record) for row_id, record in zip(ids, records)])
+    return ids
+
+
+async def update_rows(conn, table: str, columns: list, key_columns: list, records: list, returning: list = None):
+    """Apply COALESCE-style updates for all records in one statement.
+
+    Each record is the column values followed by the key values; None leaves a column unchanged.
+    Returns the RETURNING rows (the keys, plus any extra returning columns) of the rows that matched.
+    """
+    table = table.lower()
+    columns = [column.lower() for column in columns]
+    key_columns = [column.lower() for column in key_columns]
+    types = COLUMN_TYPES[table]
+    names = columns + key_columns
+    arrays = ", ".join(f"${idx + 1}::{types[name]}[]" for idx, name in enumerate(names))
+    set_clause = ", ".join(f"{column} = COALESCE(v.{column}, t.{column})" for column in columns)
+    where_clause = " AND ".join(f"t.{column} = v.{column}" for column in key_columns)
+    returning = ", ".join(f"t.{column}" for column in key_columns + [c.lower() for c in returning or []])
+    query = f"""
+        UPDATE {table} t SET {set_clause}
+        FROM unnest({arrays}) AS v({', '.join(names)})
+        WHERE {where_clause}
+        RETURNING {returning}
+    """
+    return await conn.fetch(query, *[list(values) for values in zip(*records)] if records else [[]] * len(names))
+
+
+async def increment_rows(conn, table: str, columns: list, key_columns: list, records: list):
+    """Add deltas to counter columns (column = column + delta) for all records in one statement.
+
+    Each record is the column deltas followed by the key values; NULL counters count as 0.
+    Returns the keys of the rows that matched.
+    """
+    table = table.lower()
+    columns = [column.lower() for column in columns]
+    key_columns = [column.lower() for column in key_columns]
+    types = COLUMN_TYPES[table]
+    names = columns + key_columns
+    arrays = ", ".join(f"${idx + 1}::{types[name]}[]" for idx, name in enumerate(names))
+    set_clause = ", ".join(f"{column} = COALESCE(t.{column}, 0) + v.{column}" for column in columns)
+    query = f"""
+        UPDATE {table} t SET {set_clause}
+        FROM unnest({arrays}) AS v({', '.join(names)})
+        WHERE {' AND '.join(f't.{column} = v.{column}' for column in key_columns)}
+        RETURNING {', '.join(f't.{column}' for column in key_columns)}
+    """
+    return await conn.fetch(query, *[list(values) for values in zip(*records)] if records else [[]] * len(names))
+
+
+async def delete_rows(conn, table: str, key_columns: list, keys: list):
+    """Delete all rows whose key tuple is in keys; returns the keys that existed."""
+    table = table.lower()
+    key_columns = [column.lower() for column in key_columns]
+    types = COLUMN_TYPES[table]
+    arrays = ", ".join(f"${idx + 1}::{types[name]}[]" for idx, name in enumerate(key_columns))
+    query = f"""
+        DELETE FROM {table} t
+        USING unnest({arrays}) AS v({', '.join(key_columns)})
+        WHERE {' AND '.join(f't.{column} = v.{column}' for column in key_columns)}
+        RETURNING {', '.join(f't.{column}' for column in key_columns)}
+    """
+    return await conn.fetch(query, *[list(values) for values in zip(*keys)] if keys else [[]] * len(key_columns))
+
+
+async def connect(db_config: dict):
+    """asyncpg connection from the psycopg2-style db_config dicts used by the scripts."""
+    return await asyncpg.connect(user=db_config['user'], password=db_config['password'], host=db_config['host'],
+                                 port=db_config['port'], database=db_config['dbname'])
@@ -0,0 +1,133 @@
+"""Expert reads during a flood of bulk writes, with and without admission limits.
+
+Starts papi2 (python papi2.py) twice with the read cache off: once with limits so
+high that nothing is ever queued ("unlimited"), once with the default limits (or
+--limits). Each time --writers clients post --rows-row expert bulk creates into a
+scratch chapter back to back while --readers clients read random experts, for
+--duration seconds. Reports read latency and statuses next to the bulk request
+statuses (429/503 are the rejected ones) and the server's admission counters. The
+scratch chapter and its experts are removed afterwards.
+
+    python bench/admission.py --writers 32 --readers 32 --duration 15
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import asyncpg
+import httpx
+from dotenv import load_dotenv
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+load_dotenv(os.path.join(ROOT, ".env"))
+
+DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://user:pw@localhost/papi2")
+UNLIMITED = "read=100000:0,write=100000:0,bulk=100000:0,upload=100000:0"
+
+
+async def reader(client, experts, stop_at, latencies, statuses):
+    while time.perf_counter() < stop_at:
+        chapter_id, expert_id = random.choice(experts)
+        start = time.perf_counter()
+        try:
+            response = await client.get("/v1/experts/read", params={"chapterID": chapter_id, "recno": expert_id})
+            status = response.status_code
+        except httpx.TimeoutException:
+            status = "timeout"
+        latencies.append(time.perf_counter() - start)
+        statuses[status] = statuses.get(status, 0) + 1
+
+
+async def writer(client, chapter_id, rows, stop_at, statuses):
+    while time.perf_counter() < stop_at:
+        body = [{"chapterID": chapter_id, "name": f"Bulk {index}"} for index in range(rows)]
+        try:
+            response = await client.post("/v1/experts/bulk", json=body)
+            status = response.status_code
+            if status in (429, 503):
+                await asyncio.sleep(float(response.headers.get("retry-after", "1")))
+        except httpx.TimeoutException:
+            status = "timeout"
+        statuses[status] = statuses.get(status, 0) + 1
+
+
+async def wait_for_server(client, process):
+    for _ in range(300):
+        if process.poll() is not None:
+            raise RuntimeError("papi2 exited during startup")
+        try:
+            await client.get("/v1/admission/stats")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("papi2 did not start")
+
+
+async def run(mode: str, limits: str, args, experts, chapter_id) -> dict:
+    env = dict(os.environ, ADMISSION_LIMITS=limits, READ_CACHE_SIZE="0",
+               LOG_FILE=os.path.join(tempfile.gettempdir(), "papi2-admission.log"))
+    process = subprocess.Popen([sys.executable, "papi2.py", "--port", str(args.port)], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        limits_config = httpx.Limits(max_connections=args.readers + args.writers + 1)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=args.timeout,
+                                     limits=limits_config) as client:
+            await wait_for_server(client, process)
+            latencies, read_statuses, write_statuses = [], {}, {}
+            stop_at = time.perf_counter() + args.duration
+            await asyncio.gather(
+                *(reader(client, experts, stop_at, latencies, read_statuses) for _ in range(args.readers)),
+                *(writer(client, chapter_id, args.rows, stop_at, write_statuses) for _ in range(args.writers)))
+            admission = (await client.get("/v1/admission/stats")).json()
+    finally:
+        process.terminate()
+        process.wait()
+    latencies.sort()
+    return {
+        "mode": mode,
+        "reads": len(latencies),
+        "reads_per_sec": round(len(latencies) / args.duration, 1),
+        "read_p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "read_p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+        "read_statuses": read_statuses,
+        "bulk_statuses": write_statuses,
+        "admission": {name: {key: limit[key] for key in ("admitted", "rejected_queue_full", "rejected_queue_timeout")}
+                      for name, limit in admission["limits"].items() if limit["admitted"]},
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=32)
+    parser.add_argument("--readers", type=int, default=32)
+    parser.add_argument("--rows", type=int, default=1000, help="experts per bulk request")
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--timeout", type=float, default=30.0, help="client timeout per request")
+    parser.add_argument("--limits", default="", help="ADMISSION_LIMITS of the limited run (default: the built-in)")
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(DATABASE_URL)
+    experts = [tuple(row) for row in await conn.fetch(
+        "SELECT chapterID, id FROM tableExperts TABLESAMPLE SYSTEM (1) LIMIT 10000")]
+    chapter_id = await conn.fetchval("INSERT INTO tableChapters (title) VALUES ('admission benchmark') RETURNING chapterID")
+    try:
+        results = [await run("unlimited", UNLIMITED, args, experts, chapter_id),
+                   await run("limited", args.limits, args, experts, chapter_id)]
+    finally:
+        await conn.execute("DELETE FROM tableExperts WHERE chapterID = $1", chapter_id)
+        await conn.execute("DELETE FROM tableChapters WHERE chapterID = $1", chapter_id)
+        await conn.close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,84 @@
+"""Show that a slow chapter query no longer stalls concurrent expert reads.
+
+Runs a burst of expert reads against the pool while one "chapter query"
+(pg_sleep) is in flight, first the way the old execute_query() did it
+(blocking psycopg2 on the event loop thread), then through asyncpg.
+
+    python bench/chapterStall.py --readers 20 --sleep 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+import asyncpg
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://user:pw@localhost/papi2")
+
+
+def blocking_chapter_query(seconds: float):
+    # the pre-pool chapter path: psycopg2 connect + execute on the loop thread
+    connection = psycopg2.connect(DATABASE_URL)
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT pg_sleep(%s)", (seconds,))
+        cursor.fetchone()
+    finally:
+        connection.close()
+
+
+async def async_chapter_query(pool, seconds: float):
+    async with pool.acquire() as conn:
+        await conn.fetchval("SELECT pg_sleep($1)", seconds)
+
+
+async def expert_reader(pool, stop_at: float, latencies: list):
+    while time.perf_counter() < stop_at:
+        start = time.perf_counter()
+        async with pool.acquire() as conn:
+            await conn.fetchrow("SELECT * FROM tableExperts WHERE chapterID = $1 AND id = $2", 1, 1)
+        latencies.append(time.perf_counter() - start)
+
+
+async def run_scenario(pool, mode: str, readers: int, sleep: float) -> dict:
+    latencies = []
+    stop_at = time.perf_counter() + sleep + 1.0
+    tasks = [asyncio.create_task(expert_reader(pool, stop_at, latencies)) for _ in range(readers)]
+    await asyncio.sleep(0.5)
+    if mode == "blocking":
+        blocking_chapter_query(sleep)
+    else:
+        await async_chapter_query(pool, sleep)
+    await asyncio.gather(*tasks)
+    latencies.sort()
+    return {
+        "mode": mode,
+        "reads": len(latencies),
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--readers", type=int, default=20, help="concurrent expert readers")
+    parser.add_argument("--sleep", type=float, default=2.0, help="duration of the slow chapter query (s)")
+    args = parser.parse_args()
+
+    pool = await asyncpg.create_pool(DATABASE_URL, min_size=args.readers + 1, max_size=args.readers + 1)
+    try:
+        results = [await run_scenario(pool, mode, args.readers, args.sleep) for mode in ("blocking", "async")]
+    finally:
+        await pool.close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
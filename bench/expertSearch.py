@@ -0,0 +1,104 @@
+"""Latency of /v1/experts/search queries by sort order and filter mix.
+
+Runs random filter combinations through papi2.expert_search_query straight
+against the database (first page and a follow-up keyset page), and reports
+p50/p95/p99 per sort. Load production-size data first, e.g.
+
+    python DBaddDemoData.py --users 10000 --chapters 20000 --experts 1000000
+    python bench/expertSearch.py --queries 2000 --explain
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+import asyncpg
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from papi2 import EXPERT_SEARCH_SORTS, expert_search_query  # noqa: E402
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://user:pw@localhost/papi2")
+
+LANGUAGES = ['english', 'french', 'spanish', 'german', 'italian', 'greek']
+
+
+def random_filters() -> dict:
+    filters = {}
+    if random.random() < 0.7:
+        filters["languages"] = random.sample(LANGUAGES, random.choice([1, 1, 1, 2]))
+        filters["match_all"] = random.random() < 0.8
+    if random.random() < 0.5:
+        filters["online"] = "online"
+    if random.random() < 0.3:
+        filters["type"] = random.choice(['real', 'bot', 'AI'])
+    if random.random() < 0.3:
+        low = random.uniform(10, 80)
+        filters["min_price"], filters["max_price"] = round(low, 2), round(low + random.uniform(5, 40), 2)
+    if random.random() < 0.3:
+        filters["min_ranking"] = random.choice([3.0, 4.0, 4.5])
+    return filters
+
+
+async def timed_search(conn, sort: str, limit: int, filters: dict) -> list:
+    timings = []
+    after = None
+    for _ in range(2):  # first page, then the next page through the cursor
+        query, params = expert_search_query(sort, after, limit, **filters)
+        start = time.perf_counter()
+        rows = await conn.fetch(query, *params)
+        timings.append(time.perf_counter() - start)
+        if len(rows) <= limit:
+            break
+        column = EXPERT_SEARCH_SORTS[sort][0]
+        last = rows[limit - 1]
+        after = (last[column] if last[column] is not None else 0, last["id"])
+    return timings
+
+
+def summarize(values: list) -> dict:
+    values = sorted(values)
+    return {
+        "queries": len(values),
+        "p50_ms": round(statistics.median(values) * 1000, 3),
+        "p95_ms": round(values[int(len(values) * 0.95)] * 1000, 3),
+        "p99_ms": round(values[int(len(values) * 0.99)] * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queries", type=int, default=1000, help="searches per sort order")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--explain", action="store_true", help="print one EXPLAIN ANALYZE per sort")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    conn = await asyncpg.connect(DATABASE_URL)
+    try:
+        experts = await conn.fetchval("SELECT count(*) FROM tableExperts")
+        results = {}
+        for sort in EXPERT_SEARCH_SORTS:
+            samples = []
+            for _ in range(args.queries):
+                samples.extend(await timed_search(conn, sort, args.limit, random_filters()))
+            results[sort] = summarize(samples)
+            if args.explain:
+                query, params = expert_search_query(sort, None, args.limit, languages=['greek'], online='online')
+                plan = await conn.fetch("EXPLAIN (ANALYZE, BUFFERS) " + query, *params)
+                print(f"-- {sort}\n" + "\n".join(row[0] for row in plan), file=sys.stderr)
+    finally:
+        await conn.close()
+    print(json.dumps({"experts": experts, "sorts": results}, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,189 @@
+"""Latency of /v1/search queries over millions of helpitems.
+
+Loads --items helpitems (DBaddDemoData rows with generated text) under a scratch
+chapter tree: one root with --chapters children. Titles, descriptions and content
+are drawn from a --vocabulary word list with Zipf-like frequencies, so the first
+words are in most items and the last ones in a few. Then times the first page of
+--queries queries per mix (rare word, common word, two words, a phrase, an OR,
+scoped to one chapter, to the subtree, in one language), built by
+papi2.text_search_query and run by papi2.fetch_text_search, and pages deep into
+the results. Each mix reports how many items its queries matched on average. The
+scratch chapters and items are removed again unless --keep is given; --root
+reuses a kept tree.
+
+    python bench/fullTextSearch.py --items 2000000 --queries 200
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+import asyncpg
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import DBbulk  # noqa: E402
+from DBaddDemoData import HELPITEMS_COLUMNS, LANGUAGES, random_helpitem  # noqa: E402
+from papi2 import fetch_text_search, text_search_query  # noqa: E402
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://user:pw@localhost/papi2")
+TYPES = ["helpitem"]
+TITLE, DESCRIPTION, CONTENT = (HELPITEMS_COLUMNS.index(column) for column in ("title", "description", "content"))
+SYLLABLES = ["ka", "lo", "mi", "ner", "pu", "sa", "ti", "vor", "ul", "ex", "dra", "fen", "gol", "hin", "jas", "qua"]
+
+
+def make_vocabulary(size: int) -> list:
+    words = ("".join(parts) for length in (3, 4, 5) for parts in itertools.product(SYLLABLES, repeat=length))
+    return list(itertools.islice(words, size))
+
+
+class Text:
+    """Random text with word i drawn about 1/(i+1) as often as the first word."""
+
+    def __init__(self, vocabulary: list):
+        self.vocabulary = vocabulary
+        self.weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+
+    def words(self, count: int) -> str:
+        return " ".join(random.choices(self.vocabulary, cum_weights=self.weights, k=count))
+
+    def rare(self) -> str:
+        return random.choice(self.vocabulary[len(self.vocabulary) // 2:])
+
+    def common(self) -> str:
+        return random.choice(self.vocabulary[:20])
+
+    def middle(self) -> str:
+        return random.choice(self.vocabulary[20:len(self.vocabulary) // 10])
+
+
+async def make_chapters(conn, chapters: int) -> tuple:
+    root = await conn.fetchval("INSERT INTO tableChapters (title) VALUES ('search benchmark') RETURNING chapterID")
+    children = [await conn.fetchval("INSERT INTO tableChapters (title, parentID) VALUES ('search benchmark', $1) "
+                                    "RETURNING chapterID", root) for _ in range(chapters)]
+    return root, children
+
+
+async def load_items(conn, text: Text, items: int, children: list):
+    for offset in range(0, items, 10000):
+        records = []
+        for _ in range(min(10000, items - offset)):
+            record = list(random_helpitem(random.choice(children), None, None))
+            record[TITLE] = text.words(4)
+            record[DESCRIPTION] = text.words(6)  # VARCHAR(100)
+            record[CONTENT] = text.words(60)
+            records.append(record)
+        await DBbulk.copy_rows(conn, 'tableHelpitems', HELPITEMS_COLUMNS, records)
+    # moves the new rows out of the GIN pending list, as autovacuum would
+    await conn.execute("VACUUM ANALYZE tableHelpitems")
+
+
+def query_mixes(text: Text, root: int, children: list, subtree: list) -> dict:
+    # each mix returns (q, chapter_ids, language) for one query
+    return {
+        "rare_word": lambda: (text.rare(), [root] + children, None),
+        "middle_word": lambda: (text.middle(), [root] + children, None),
+        "common_word": lambda: (text.common(), [root] + children, None),
+        "two_words": lambda: (f"{text.middle()} {text.common()}", [root] + children, None),
+        "phrase": lambda: (f'"{text.common()} {text.common()}"', [root] + children, None),
+        "or": lambda: (f"{text.rare()} or {text.middle()}", [root] + children, None),
+        "common_in_chapter": lambda: (text.common(), [random.choice(children)], None),
+        "common_in_subtree": lambda: (text.common(), subtree, None),
+        "middle_in_language": lambda: (text.middle(), [root] + children, random.choice(LANGUAGES)),
+    }
+
+
+async def page_timings(conn, q: str, chapter_ids: list, language, pages: int, limit: int) -> list:
+    timings, after = [], None
+    for _ in range(pages):
+        query, params = text_search_query(q, TYPES, after, limit, chapter_ids=chapter_ids, language=language)
+        start = time.perf_counter()
+        rows = await fetch_text_search(conn, query, params)
+        timings.append(time.perf_counter() - start)
+        if len(rows) <= limit:
+            break
+        last = rows[limit - 1]
+        after = (last["rank"], last["type"], last["id"])
+    return timings
+
+
+async def match_count(conn, q: str, chapter_ids: list, language) -> int:
+    return await conn.fetchval("""
+        SELECT count(*) FROM tableHelpitems, papi2_ts_query($1, $2) AS q
+        WHERE search_vector @@ q AND chapterID = ANY($3::int[])
+          AND ($2::text IS NULL OR papi2_ts_config(language) = papi2_ts_config($2))
+    """, q, language, chapter_ids)
+
+
+def summarize(values: list) -> dict:
+    values = sorted(values)
+    return {
+        "queries": len(values),
+        "p50_ms": round(statistics.median(values) * 1000, 2),
+        "p99_ms": round(values[int(len(values) * 0.99)] * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=2000000)
+    parser.add_argument("--chapters", type=int, default=200, help="children of the scratch root chapter")
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200, help="queries per mix")
+    parser.add_argument("--pages", type=int, default=10, help="pages followed per query for the deep-page numbers")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--root", type=int, help="reuse the tree of an earlier --keep run instead of loading one")
+    parser.add_argument("--keep", action="store_true", help="keep the generated chapters and items")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    text = Text(make_vocabulary(args.vocabulary))
+    conn = await asyncpg.connect(DATABASE_URL)
+    if args.root:
+        root = args.root
+        children = [row[0] for row in await conn.fetch(
+            "SELECT chapterID FROM tableChapters WHERE parentID = $1 ORDER BY chapterID", root)]
+    else:
+        root, children = await make_chapters(conn, args.chapters)
+    try:
+        start = time.perf_counter()
+        if not args.root:
+            await load_items(conn, text, args.items, children)
+        load_seconds = time.perf_counter() - start
+        items = await conn.fetchval("SELECT count(*) FROM tableHelpitems WHERE chapterID = ANY($1::int[])", children)
+        subtree = [root] + children[:len(children) // 4]
+        results = {"items": items, "load_seconds": round(load_seconds, 1), "mixes": {}}
+        for name, make in query_mixes(text, root, children, subtree).items():
+            first, deep, matches = [], [], []
+            for index in range(args.queries):
+                q, chapter_ids, language = make()
+                timings = await page_timings(conn, q, chapter_ids, language,
+                                             args.pages if index % 10 == 0 else 1, args.limit)
+                first.append(timings[0])
+                deep.extend(timings[1:])
+                if index % 10 == 0:
+                    matches.append(await match_count(conn, q, chapter_ids, language))
+            results["mixes"][name] = {
+                "avg_matches": round(statistics.mean(matches)),
+                "first_page": summarize(first),
+                "deep_pages": summarize(deep) if deep else None,
+            }
+    finally:
+        if not args.keep:
+            await conn.execute("DELETE FROM tableHelpitems WHERE chapterID = ANY($1::int[])", children)
+            await conn.execute("DELETE FROM tableChapters WHERE chapterID = ANY($1::int[])", children + [root])
+        await conn.close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
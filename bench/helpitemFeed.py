@@ -0,0 +1,107 @@
+"""Latency of /v1/helpitems/feed pages for one large chapter.
+
+Creates a chapter with --items helpitems (random votes, kinds, states and
+languages from DBaddDemoData), then times papi2.helpitem_feed_query for the
+first page and for pages deep into the feed, with and without filters. The
+chapter and its items are removed again unless --keep is given.
+
+    python bench/helpitemFeed.py --items 100000 --queries 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+import asyncpg
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import DBbulk  # noqa: E402
+from DBaddDemoData import HELPITEMS_COLUMNS, LANGUAGES, random_helpitem  # noqa: E402
+from papi2 import helpitem_feed_query  # noqa: E402
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://user:pw@localhost/papi2")
+
+FILTERS = {
+    "none": lambda: {},
+    "kind": lambda: {"kind": random.randint(1, 3)},
+    "kind_language": lambda: {"kind": random.randint(1, 3), "language": random.choice(LANGUAGES)},
+    "kind_language_state": lambda: {"kind": random.randint(1, 3), "language": random.choice(LANGUAGES),
+                                    "state": random.randint(0, 2)},
+}
+
+
+async def load_chapter(conn, items: int) -> int:
+    chapter_id = await conn.fetchval("INSERT INTO tableChapters (title) VALUES ('feed benchmark') RETURNING chapterID")
+    for offset in range(0, items, 10000):
+        records = [random_helpitem(chapter_id, None, None) for _ in range(min(10000, items - offset))]
+        await DBbulk.copy_rows(conn, 'tableHelpitems', HELPITEMS_COLUMNS, records)
+    await conn.execute("ANALYZE tableHelpitems")
+    return chapter_id
+
+
+async def page_timings(conn, chapter_id: int, filters: dict, pages: int, limit: int) -> list:
+    timings, after = [], None
+    for _ in range(pages):
+        query, params = helpitem_feed_query(chapter_id, after, limit, **filters)
+        start = time.perf_counter()
+        rows = await conn.fetch(query, *params)
+        timings.append(time.perf_counter() - start)
+        if len(rows) <= limit:
+            break
+        after = (rows[limit - 1]["score"], rows[limit - 1]["itemid"])
+    return timings
+
+
+def summarize(values: list) -> dict:
+    values = sorted(values)
+    return {
+        "queries": len(values),
+        "p50_ms": round(statistics.median(values) * 1000, 3),
+        "p99_ms": round(values[int(len(values) * 0.99)] * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=500, help="feeds read per filter mix")
+    parser.add_argument("--pages", type=int, default=20, help="pages followed per feed for the deep-page numbers")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--chapter", type=int, help="use an existing chapter instead of loading one")
+    parser.add_argument("--keep", action="store_true", help="keep the generated chapter and items")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    conn = await asyncpg.connect(DATABASE_URL)
+    chapter_id = args.chapter
+    try:
+        if chapter_id is None:
+            chapter_id = await load_chapter(conn, args.items)
+        results = {}
+        for name, make_filters in FILTERS.items():
+            first, deep = [], []
+            for _ in range(args.queries):
+                first += await page_timings(conn, chapter_id, make_filters(), 1, args.limit)
+            for _ in range(max(1, args.queries // args.pages)):
+                deep += (await page_timings(conn, chapter_id, make_filters(), args.pages, args.limit))[1:]
+            results[name] = {"first_page": summarize(first), "later_pages": summarize(deep) if deep else None}
+        items = await conn.fetchval("SELECT count(*) FROM tableHelpitems WHERE chapterID = $1", chapter_id)
+    finally:
+        if args.chapter is None and not args.keep and chapter_id is not None:
+            await conn.execute("DELETE FROM tableHelpitems WHERE chapterID = $1", chapter_id)
+            await conn.execute("DELETE FROM tableChapters WHERE chapterID = $1", chapter_id)
+        await conn.close()
+    print(json.dumps({"chapter": chapter_id, "items": items, "filters": results}, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
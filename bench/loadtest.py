@@ -0,0 +1,348 @@
+"""HTTP load test for the papi2 /v1/* endpoints.
+
+Drives a weighted mix of every endpoint at a fixed concurrency against a running
+server (python papi2.py --workers N) backed by a local Postgres filled by DBaddDemoData.py,
+and prints throughput and p50/p95/p99 latency per endpoint as JSON so runs can be
+diffed between releases.
+
+    python bench/loadtest.py --base-url http://127.0.0.1:8000 --concurrency 64 --duration 30 --output run.json
+    python bench/loadtest.py --only experts_read,chapters_ancestors
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+import httpx
+
+
+class State:
+    """Ids discovered from the server at start-up, plus rows this run created."""
+
+    def __init__(self):
+        self.chapter_ids = []
+        self.experts = []          # (chapterID, id)
+        self.created_experts = []  # deletable without hurting other scenarios
+        self.created_chapters = []
+        self.items = set()         # helpitem ids seen in feeds, for votes
+
+
+def pick_chapter(state):
+    return random.choice(state.chapter_ids)
+
+
+def pick_expert(state):
+    return random.choice(state.experts)
+
+
+async def experts_list(client, state):
+    return await client.get("/v1/experts/list", params={"chapterID": pick_expert(state)[0], "limit": 50})
+
+
+async def experts_list_stream(client, state):
+    return await client.get("/v1/experts/list", params={"chapterID": pick_expert(state)[0], "stream": "true"})
+
+
+async def experts_read(client, state):
+    chapter_id, expert_id = pick_expert(state)
+    return await client.get("/v1/experts/read", params={"chapterID": chapter_id, "recno": expert_id})
+
+
+async def experts_read_many(client, state):
+    pairs = random.sample(state.experts, min(20, len(state.experts)))
+    return await client.get("/v1/experts/read_many", params={"ids": ",".join(f"{c}:{e}" for c, e in pairs)})
+
+
+async def experts_search(client, state):
+    params = {"language": random.choice(["English", "French", "Greek"]), "sort": random.choice(["ranking", "jobs", "price"])}
+    if random.random() < 0.5:
+        params["online"] = "online"
+    return await client.get("/v1/experts/search", params=params)
+
+
+async def experts_create(client, state):
+    chapter_id = pick_chapter(state)
+    response = await client.post("/v1/experts/create", params={
+        "chapterID": chapter_id, "name": f"Load {random.randint(1, 10 ** 6)}", "online": "online"})
+    return response
+
+
+async def experts_update(client, state):
+    chapter_id, expert_id = pick_expert(state)
+    return await client.post("/v1/experts/update", params={
+        "chapterID": chapter_id, "recno": expert_id, "jobs": random.randint(0, 100)})
+
+
+async def experts_bulk(client, state):
+    chapter_id = pick_chapter(state)
+    rows = [{"chapterID": chapter_id, "name": f"Bulk {idx}"} for idx in range(20)]
+    response = await client.post("/v1/experts/bulk", json=rows)
+    if response.status_code == 200:
+        state.created_experts.extend(
+            (chapter_id, result["id"]) for result in response.json().get("results", ()) if result.get("id"))
+    return response
+
+
+async def experts_delete(client, state):
+    if not state.created_experts:
+        return await experts_bulk(client, state)
+    chapter_id, expert_id = state.created_experts.pop()
+    return await client.post("/v1/experts/delete", params={"chapterID": chapter_id, "recno": expert_id})
+
+
+async def chapters_read(client, state):
+    return await client.get("/v1/chapters/read", params={"chapter_id": pick_chapter(state)})
+
+
+async def chapters_read_many(client, state):
+    ids = random.sample(state.chapter_ids, min(20, len(state.chapter_ids)))
+    return await client.get("/v1/chapters/read_many", params={"ids": ",".join(map(str, ids))})
+
+
+async def chapters_list(client, state):
+    return await client.get("/v1/chapters/list", params={"limit": 100})
+
+
+async def chapters_create(client, state):
+    response = await client.put("/v1/chapters/create", params={
+        "title": f"Load {random.randint(1, 10 ** 6)}", "parentID": pick_chapter(state)})
+    if response.status_code == 200 and response.json().get("chapterID"):
+        state.created_chapters.append(response.json()["chapterID"])
+    return response
+
+
+async def chapters_update(client, state):
+    return await client.put("/v1/chapters/update", params={
+        "chapter_id": pick_chapter(state), "playlist": f"Playlist {random.randint(1, 100)}"})
+
+
+async def chapters_delete(client, state):
+    if not state.created_chapters:
+        return await chapters_create(client, state)
+    return await client.delete("/v1/chapters/delete", params={"chapter_id": state.created_chapters.pop()})
+
+
+async def chapters_bulk(client, state):
+    rows = [{"op": "update", "chapterID": pick_chapter(state), "budget": random.randint(0, 500)} for _ in range(10)]
+    return await client.post("/v1/chapters/bulk", json=rows)
+
+
+async def chapters_children(client, state):
+    return await client.get("/v1/chapters/children", params={"chapter_id": pick_chapter(state)})
+
+
+async def chapters_ancestors(client, state):
+    return await client.get("/v1/chapters/ancestors", params={"chapter_id": pick_chapter(state)})
+
+
+async def chapters_subtree(client, state):
+    return await client.get("/v1/chapters/subtree", params={"chapter_id": pick_chapter(state), "depth": 2})
+
+
+async def chapters_stats(client, state):
+    params = {"chapter_id": pick_chapter(state)}
+    if random.random() < 0.3:
+        params["subtree"] = "true"
+    return await client.get("/v1/chapters/stats", params=params)
+
+
+# DBaddDemoData.py text is "Demo Title <n>", "Description <n>", "Expert in field <n>" with
+# n up to 100, so each query matches about 1% of the rows; the bare words match them all
+SEARCH_QUERIES = ["title {n}", "description {n}", "expert field {n}", '"demo title {n}"', "field {n} -demo",
+                  "description {n} or title {n}"]
+
+
+async def search(client, state):
+    q = random.choice(SEARCH_QUERIES).format(n=random.randint(1, 100))
+    params = {"q": q, "type": random.choice(["all", "all", "helpitems", "experts"])}
+    if random.random() < 0.3:
+        params["chapterID"] = pick_chapter(state)
+        params["subtree"] = "true"
+    if random.random() < 0.2:
+        params["language"] = random.choice(["English", "French", "Greek"])
+    response = await client.get("/v1/search", params=params)
+    # every fifth search also reads the next page
+    if response.status_code == 200 and response.headers.get("x-next-cursor") and random.random() < 0.2:
+        response = await client.get("/v1/search", params={**params, "cursor": response.headers["x-next-cursor"]})
+    return response
+
+
+async def experts_events(client, state):
+    # opens a chapter's event stream and leaves once the first chunk (the retry line) arrives
+    async with client.stream("GET", "/v1/experts/events", params={"chapterID": pick_expert(state)[0]}) as response:
+        async for _ in response.aiter_bytes():
+            break
+    return response
+
+
+async def helpitems_upload(client, state):
+    # new bytes every time, so each upload is stored and handed to the upload workers
+    files = {"file": ("load.jpg", os.urandom(64 * 1024), "image/jpeg")}
+    return await client.post("/v1/helpitems/upload", params={"chapterID": pick_chapter(state), "kind": 2},
+                             files=files)
+
+
+STATS_PATHS = ["/v1/pool/stats", "/v1/admission/stats", "/v1/cache/stats", "/v1/events/stats",
+               "/v1/statements/stats", "/v1/votes/stats", "/v1/uploads/stats"]
+
+
+async def stats(client, state):
+    return await client.get(random.choice(STATS_PATHS))
+
+
+async def helpitems_feed(client, state):
+    params = {"chapterID": pick_chapter(state)}
+    if random.random() < 0.3:
+        params["kind"] = random.randint(1, 3)
+    response = await client.get("/v1/helpitems/feed", params=params)
+    if response.status_code == 200 and len(state.items) < 10000:
+        state.items.update(item["itemid"] for item in response.json() if isinstance(item, dict))
+    return response
+
+
+async def helpitems_vote(client, state):
+    if not state.items:
+        return await helpitems_feed(client, state)
+    item_id = random.choice(tuple(state.items))
+    return await client.post("/v1/helpitems/vote", params={"itemID": item_id, "vote": random.choice(["up", "down"])})
+
+
+# name -> (weight, scenario); reads dominate like real front-end traffic
+SCENARIOS = {
+    "experts_list": (20, experts_list),
+    "experts_list_stream": (2, experts_list_stream),
+    "experts_read": (25, experts_read),
+    "experts_read_many": (5, experts_read_many),
+    "experts_search": (10, experts_search),
+    "experts_create": (2, experts_create),
+    "experts_update": (3, experts_update),
+    "experts_delete": (1, experts_delete),
+    "experts_bulk": (1, experts_bulk),
+    "chapters_read": (15, chapters_read),
+    "chapters_read_many": (3, chapters_read_many),
+    "chapters_list": (5, chapters_list),
+    "chapters_create": (1, chapters_create),
+    "chapters_update": (2, chapters_update),
+    "chapters_delete": (1, chapters_delete),
+    "chapters_bulk": (1, chapters_bulk),
+    "chapters_children": (8, chapters_children),
+    "chapters_ancestors": (8, chapters_ancestors),
+    "chapters_subtree": (4, chapters_subtree),
+    "chapters_stats": (4, chapters_stats),
+    "helpitems_feed": (10, helpitems_feed),
+    "helpitems_vote": (5, helpitems_vote),
+    "helpitems_upload": (1, helpitems_upload),
+    "experts_events": (1, experts_events),
+    "stats": (1, stats),
+    "search": (5, search),
+}
+
+
+async def discover(client, state, sample_chapters: int):
+    response = await client.get("/v1/chapters/list", params={"limit": 1000})
+    response.raise_for_status()
+    state.chapter_ids = [chapter["chapterid"] for chapter in response.json().get("data", [])]
+    if not state.chapter_ids:
+        sys.exit("no chapters found, load data with DBaddDemoData.py first")
+    for chapter_id in state.chapter_ids[:sample_chapters]:
+        response = await client.get("/v1/experts/list", params={"chapterID": chapter_id, "stream": "true"})
+        if response.status_code == 200:
+            state.experts.extend((chapter_id, json.loads(line)["id"]) for line in response.text.splitlines()[:1000])
+    if not state.experts:
+        sys.exit("no experts found in the first chapters, load data with DBaddDemoData.py first")
+
+
+def is_error(response) -> bool:
+    if response.status_code >= 400:
+        return True
+    if response.headers.get("content-type", "").startswith("application/json"):
+        body = response.json()
+        return isinstance(body, dict) and str(body.get("status", "")).startswith("error")
+    return False
+
+
+async def user(client, state, names, weights, stop_at, samples, errors):
+    while time.perf_counter() < stop_at:
+        name = random.choices(names, weights)[0]
+        start = time.perf_counter()
+        try:
+            response = await SCENARIOS[name][1](client, state)
+            failed = is_error(response)
+        except httpx.HTTPError:
+            failed = True
+        samples[name].append(time.perf_counter() - start)
+        if failed:
+            errors[name] += 1
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+
+def summarize(latencies, error_count, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": error_count,
+        "rps": round(len(latencies) / elapsed, 1),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of measured load")
+    parser.add_argument("--warmup", type=float, default=3.0, help="seconds of unmeasured load first")
+    parser.add_argument("--only", help="comma-separated scenario names (default: all)")
+    parser.add_argument("--sample-chapters", type=int, default=50, help="chapters scanned for expert ids")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    names = args.only.split(",") if args.only else list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        sys.exit(f"unknown scenarios: {', '.join(unknown)} (known: {', '.join(SCENARIOS)})")
+    weights = [SCENARIOS[name][0] for name in names]
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=30.0) as client:
+        state = State()
+        await discover(client, state, args.sample_chapters)
+
+        for phase, duration in (("warmup", args.warmup), ("measure", args.duration)):
+            samples = {name: [] for name in names}
+            errors = {name: 0 for name in names}
+            start = time.perf_counter()
+            await asyncio.gather(*(user(client, state, names, weights, start + duration, samples, errors)
+                                   for _ in range(args.concurrency)))
+            elapsed = time.perf_counter() - start
+
+    report = {
+        "config": {"base_url": args.base_url, "concurrency": args.concurrency, "duration": args.duration,
+                   "scenarios": names, "seed": args.seed},
+        "total": summarize([value for values in samples.values() for value in values], sum(errors.values()), elapsed),
+        "endpoints": {name: summarize(samples[name], errors[name], elapsed) for name in names},
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+"""Per-request cost of one access-log record on the event loop, by log sink.
+
+Simulates many concurrent requests that each log one access record, the way
+papi2's MetricsMiddleware does, and measures how long the logging call holds
+the event loop:
+
+  none            logger with no handler (the floor)
+  blocking_write  open(LOG_FILE, 'a').write per record, the old papi2 pattern
+  file_handler    logging.FileHandler, one write + flush per record
+  queue_json      papi2.BatchedJSONLogHandler (bounded queue, batched writer thread)
+
+    python bench/logOverhead.py --requests 200000 --concurrency 256
+    python bench/logOverhead.py --queue-size 1000   # show the drop counter under overload
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from papi2 import BatchedJSONLogHandler  # noqa: E402
+
+
+class BlockingWriteHandler(logging.Handler):
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+
+    def emit(self, record):
+        with open(self.path, 'a') as f:
+            f.write(f'{datetime.now()} - {record.getMessage()}\n')
+
+
+def make_handler(sink: str, path: str, args):
+    if sink == "none":
+        return None
+    if sink == "blocking_write":
+        return BlockingWriteHandler(path)
+    if sink == "file_handler":
+        return logging.FileHandler(path)
+    handler = BatchedJSONLogHandler(path, queue_size=args.queue_size, batch_size=args.batch_size,
+                                    flush_interval=args.flush_interval, max_bytes=args.max_bytes)
+    handler.start()
+    return handler
+
+
+async def fake_request(log, index: int, samples: list):
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    log.info("%s %s %s", "GET", "/v1/experts/read", 200, extra={"fields": {
+        "method": "GET", "path": "/v1/experts/read", "route": "/v1/experts/read", "status": 200,
+        "duration_ms": 1.234, "pool_acquire_ms": 0.05, "db_ms": 0.9, "serialize_ms": 0.02, "errors": [],
+        "request": index,
+    }})
+    samples.append(time.perf_counter() - start)
+
+
+async def run(sink: str, args) -> dict:
+    directory = tempfile.mkdtemp(prefix="papi2-log-")
+    path = os.path.join(directory, "helpthing.log")
+    log = logging.getLogger(f"bench.{sink}")
+    log.propagate = False
+    log.setLevel(logging.INFO)
+    handler = make_handler(sink, path, args)
+    if handler is not None:
+        log.addHandler(handler)
+
+    samples = []
+    start = time.perf_counter()
+    for offset in range(0, args.requests, args.concurrency):
+        await asyncio.gather(*(fake_request(log, index, samples)
+                               for index in range(offset, min(offset + args.concurrency, args.requests))))
+    elapsed = time.perf_counter() - start
+
+    result = {"sink": sink, "requests": len(samples), "requests_per_sec": round(len(samples) / elapsed, 1)}
+    if handler is not None:
+        log.removeHandler(handler)
+        handler.close()
+        if isinstance(handler, BatchedJSONLogHandler):
+            result.update(dropped=handler.dropped, written=handler.written, batches=handler.batches,
+                          rotations=handler.rotations)
+    samples.sort()
+    result.update(
+        mean_us=round(statistics.fmean(samples) * 1e6, 2),
+        p50_us=round(samples[len(samples) // 2] * 1e6, 2),
+        p99_us=round(samples[int(len(samples) * 0.99)] * 1e6, 2),
+        max_us=round(samples[-1] * 1e6, 2),
+    )
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200000)
+    parser.add_argument("--concurrency", type=int, default=256)
+    parser.add_argument("--queue-size", type=int, default=10000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--flush-interval", type=float, default=1.0)
+    parser.add_argument("--max-bytes", type=int, default=50 * 1024 * 1024)
+    parser.add_argument("--sinks", default="none,blocking_write,file_handler,queue_json")
+    args = parser.parse_args()
+
+    results = [await run(sink, args) for sink in args.sinks.split(",")]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
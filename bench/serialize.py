@@ -0,0 +1,95 @@
+"""Serialize 10k expert rows: dict copies + stdlib json vs Records straight into orjson.
+
+The old list/stream paths copied every asyncpg Record into a dict and ran
+json.dumps(default=str). papi2 now hands the Records to RecordJSONResponse /
+ndjson_line, whose json_default still makes a dict per Record, but only as orjson
+reaches it.
+
+    python bench/serialize.py --rows 10000 --repeat 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+import asyncpg
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from papi2 import RecordJSONResponse, ndjson_line  # noqa: E402
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://user:pw@localhost/papi2")
+
+# expert-shaped rows without needing demo data: same column names and types as tableExperts
+ROWS_QUERY = """
+    SELECT n AS id, n % 500 AS chapterID, n % 1000 AS userID, 'Expert ' || n AS name,
+           'Expert in field ' || (n % 100) AS description, 'Mon-Fri 9-5' AS schedule,
+           'English, French' AS languages, 'online' AS online,
+           round((10 + n % 90)::numeric + 0.25, 2) AS price, round((n % 50)::numeric / 10, 1) AS ranking,
+           n % 100 AS jobs, 'real' AS type, 'expert' || n || '.jpg' AS url_image,
+           'expert' || n || '.mp4' AS url_video, TRUE AS _active, TRUE AS enabled,
+           now() - n * interval '1 minute' AS updated
+    FROM generate_series(1, $1) AS n
+"""
+
+
+def old_response(rows) -> bytes:
+    data = [dict(row) for row in rows]
+    return json.dumps({"status": "success", "data": data}, default=str).encode()
+
+
+def new_response(rows) -> bytes:
+    return RecordJSONResponse(content={"status": "success", "data": rows}).body
+
+
+def old_stream(rows) -> bytes:
+    return b"".join(json.dumps(dict(row), default=str).encode() + b"\n" for row in rows)
+
+
+def new_stream(rows) -> bytes:
+    return b"".join(ndjson_line(row) for row in rows)
+
+
+def measure(name: str, encode, rows, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = encode(rows)
+        timings.append(time.perf_counter() - start)
+    return {
+        "mode": name,
+        "rows": len(rows),
+        "bytes": len(body),
+        "median_ms": round(statistics.median(timings) * 1000, 3),
+        "min_ms": round(min(timings) * 1000, 3),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(DATABASE_URL)
+    try:
+        rows = await conn.fetch(ROWS_QUERY, args.rows)
+    finally:
+        await conn.close()
+
+    results = [
+        measure("response_stdlib_json", old_response, rows, args.repeat),
+        measure("response_orjson", new_response, rows, args.repeat),
+        measure("ndjson_stdlib_json", old_stream, rows, args.repeat),
+        measure("ndjson_orjson", new_stream, rows, args.repeat),
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,262 @@
+"""Many /v1/experts/events subscribers on one worker: fan-out latency, memory, eviction.
+
+Starts papi2 (python papi2.py, one worker) and creates --chapters scratch chapters
+with one expert each, plus a "hot" chapter with --hot-experts experts. Opens
+--subscribers SSE connections spread over the scratch chapters and --slow ones
+on the hot chapter that never read (with a 4 KiB receive window), next to
+--hot-readers that do. Then changes
+the scratch experts' online status --updates times at --rate per second and
+floods the hot chapter with --flood-rounds updates of all its experts, one every
+--flood-pause seconds.
+
+Reports the time from sending each UPDATE to a subscriber's receipt of it, how many
+deliveries arrived, how many slow clients (and hot readers, which should not be)
+were evicted, how many missed events a
+resumed connection (Last-Event-ID) got, and the server's RSS per subscriber.
+The scratch rows are removed afterwards.
+
+    python bench/sseSubscribers.py --subscribers 10000 --chapters 100 --updates 200 --rate 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import asyncpg
+from dotenv import load_dotenv
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+load_dotenv(os.path.join(ROOT, ".env"))
+
+DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://user:pw@localhost/papi2")
+
+
+def memory_kb(pid: int, field: str) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+class Client:
+    """One SSE connection over a raw socket; parses the chunked body into events."""
+
+    def __init__(self, port: int, chapter_id: int, on_event, last_event_id: str = None, receive_buffer: int = 0):
+        self.port = port
+        self.receive_buffer = receive_buffer
+        self.chapter_id = chapter_id
+        self.on_event = on_event
+        self.last_event_id = last_event_id
+        self.reader = self.writer = None
+        self.events = []  # event types seen
+        self.pending = b""
+
+    async def connect(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if self.receive_buffer:
+            # a small window, like a client on a slow link: the server's writes back up quickly
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer)
+        sock.setblocking(False)
+        await asyncio.get_running_loop().sock_connect(sock, ("127.0.0.1", self.port))
+        self.reader, self.writer = await asyncio.open_connection(sock=sock)
+        headers = f"GET /v1/experts/events?chapterID={self.chapter_id} HTTP/1.1\r\nHost: bench\r\n"
+        if self.last_event_id:
+            headers += f"Last-Event-ID: {self.last_event_id}\r\n"
+        self.writer.write((headers + "\r\n").encode())
+        status = await self.reader.readuntil(b"\r\n\r\n")
+        if not status.startswith(b"HTTP/1.1 200"):
+            raise RuntimeError(status.split(b"\r\n")[0].decode())
+        await self.read_chunk()  # retry: line
+
+    async def read_chunk(self) -> bytes:
+        size = int((await self.reader.readuntil(b"\r\n")).strip(), 16)
+        if size == 0:
+            raise EOFError
+        data = await self.reader.readexactly(size + 2)
+        return data[:-2]
+
+    async def listen(self):
+        try:
+            while True:
+                self.pending += await self.read_chunk()
+                *events, self.pending = self.pending.split(b"\n\n")
+                for event in events:
+                    self.handle(event)
+        except (EOFError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    def handle(self, raw: bytes):
+        fields = dict(line.split(b": ", 1) for line in raw.split(b"\n") if b": " in line and not line.startswith(b":"))
+        if b"event" not in fields:
+            return
+        self.events.append(fields[b"event"].decode())
+        if b"id" in fields:
+            self.last_event_id = fields[b"id"].decode()
+        if self.on_event is not None:
+            self.on_event(fields[b"event"].decode(), json.loads(fields[b"data"]))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def wait_for_server(port: int, process):
+    for _ in range(300):
+        if process.poll() is not None:
+            raise RuntimeError("papi2 exited during startup")
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("papi2 did not start")
+
+
+async def make_chapters(conn, count: int, hot_experts: int):
+    chapters, experts = [], []
+    for index in range(count):
+        chapter_id = await conn.fetchval("INSERT INTO tableChapters (title) VALUES ('events benchmark') RETURNING chapterID")
+        chapters.append(chapter_id)
+        experts.append(await conn.fetchval(
+            "INSERT INTO tableExperts (chapterID, name, online) VALUES ($1, 'events benchmark', 'offline') RETURNING id",
+            chapter_id))
+    hot = await conn.fetchval("INSERT INTO tableChapters (title) VALUES ('events benchmark hot') RETURNING chapterID")
+    await conn.executemany("INSERT INTO tableExperts (chapterID, name, online) VALUES ($1, 'hot', 'offline')",
+                           [(hot,)] * hot_experts)
+    return chapters, experts, hot
+
+
+async def run(args, pid: int, conn, chapters, experts, hot) -> dict:
+    committed = {}   # marker -> time the UPDATE was sent
+    latencies = []
+    counts = {"expert": 0}
+
+    def on_event(kind, data):
+        if kind == "expert" and data["online"] in committed:
+            latencies.append(time.perf_counter() - committed[data["online"]])
+            counts["expert"] += 1
+
+    rss_start = memory_kb(pid, "VmRSS")
+    clients = [Client(args.port, chapters[index % len(chapters)], on_event) for index in range(args.subscribers)]
+    slow = [Client(args.port, hot, None, receive_buffer=4096) for _ in range(args.slow)]
+    hot_readers = [Client(args.port, hot, None) for _ in range(args.hot_readers)]
+    start = time.perf_counter()
+    for offset in range(0, len(clients), args.connect_batch):
+        await asyncio.gather(*(client.connect() for client in clients[offset:offset + args.connect_batch]))
+    await asyncio.gather(*(client.connect() for client in slow + hot_readers))
+    connect_seconds = time.perf_counter() - start
+    await asyncio.sleep(1)
+    rss_connected = memory_kb(pid, "VmRSS")
+    listeners = [asyncio.ensure_future(client.listen()) for client in clients + hot_readers]
+
+    # online status changes on the scratch experts, one per chapter in turn
+    for update in range(args.updates):
+        marker = f"b{update}"
+        index = update % len(chapters)
+        committed[marker] = time.perf_counter()
+        await conn.execute("UPDATE tableExperts SET online = $1 WHERE chapterID = $2 AND id = $3",
+                           marker, chapters[index], experts[index])
+        await asyncio.sleep(1 / args.rate)
+    await asyncio.sleep(args.settle)
+    expected = sum(len([c for c in clients if c.chapter_id == chapters[update % len(chapters)]])
+                   for update in range(args.updates))
+
+    # resume: drop one client, change its chapter, reconnect with the last id it saw
+    resumed_client = clients[0]
+    resumed_client.close()
+    for update in range(3):
+        await conn.execute("UPDATE tableExperts SET online = $1 WHERE chapterID = $2 AND id = $3",
+                           f"r{update}", resumed_client.chapter_id, experts[0])
+    await asyncio.sleep(0.5)
+    resumed = Client(args.port, resumed_client.chapter_id, None, resumed_client.last_event_id)
+    await resumed.connect()
+    resume_task = asyncio.ensure_future(resumed.listen())
+    await asyncio.sleep(0.5)
+
+    # the hot chapter: every round notifies once per expert, the slow clients never read
+    for _ in range(args.flood_rounds):
+        await conn.execute("UPDATE tableExperts SET online = online WHERE chapterID = $1", hot)
+        await asyncio.sleep(args.flood_pause)
+    await asyncio.sleep(args.settle)
+
+    rss_peak = memory_kb(pid, "VmHWM")
+    reader, writer = await asyncio.open_connection("127.0.0.1", args.port)
+    writer.write(b"GET /v1/events/stats HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n")
+    stats = json.loads((await reader.read()).split(b"\r\n\r\n", 1)[1])
+    writer.close()
+
+    for client in clients + slow + hot_readers + [resumed]:
+        client.close()
+    for task in listeners + [resume_task]:
+        task.cancel()
+    await asyncio.gather(*listeners, resume_task, return_exceptions=True)
+
+    latencies.sort()
+    return {
+        "subscribers": args.subscribers,
+        "slow_subscribers": args.slow,
+        "hot_readers": args.hot_readers,
+        "connect_seconds": round(connect_seconds, 2),
+        "updates": args.updates,
+        "deliveries_expected": expected,
+        "deliveries": counts["expert"],
+        "latency_p50_ms": round(statistics.median(latencies) * 1000, 2) if latencies else None,
+        "latency_p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2) if latencies else None,
+        "latency_max_ms": round(latencies[-1] * 1000, 2) if latencies else None,
+        "evicted": stats["evicted"],
+        "hot_readers_evicted": sum("evicted" in client.events for client in hot_readers),
+        "hot_reader_events": min((client.events.count("expert") for client in hot_readers), default=0),
+        "resumed_events": resumed.events.count("expert"),
+        "server_rss_start_mib": round(rss_start / 1024, 1),
+        "server_rss_connected_mib": round(rss_connected / 1024, 1),
+        "server_kib_per_subscriber": round((rss_connected - rss_start) / (args.subscribers + args.slow), 1),
+        "server_peak_rss_mib": round(rss_peak / 1024, 1),
+        "server": stats,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--subscribers", type=int, default=10000)
+    parser.add_argument("--slow", type=int, default=20, help="subscribers of the hot chapter that never read")
+    parser.add_argument("--hot-readers", type=int, default=20, help="subscribers of the hot chapter that keep up")
+    parser.add_argument("--chapters", type=int, default=100)
+    parser.add_argument("--hot-experts", type=int, default=300)
+    parser.add_argument("--updates", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=20, help="updates per second")
+    parser.add_argument("--flood-rounds", type=int, default=100)
+    parser.add_argument("--flood-pause", type=float, default=0.05, help="seconds between flood rounds")
+    parser.add_argument("--settle", type=float, default=5, help="seconds to wait for the last deliveries")
+    parser.add_argument("--connect-batch", type=int, default=500)
+    parser.add_argument("--port", type=int, default=8767)
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(DATABASE_URL)
+    chapters, experts, hot = await make_chapters(conn, args.chapters, args.hot_experts)
+    env = dict(os.environ, ADMISSION_LIMITS=f"events={args.subscribers + args.slow + args.hot_readers + 10}:0",
+               LOG_FILE=os.path.join(tempfile.gettempdir(), "papi2-events.log"))
+    process = subprocess.Popen([sys.executable, "papi2.py", "--port", str(args.port)], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        await wait_for_server(args.port, process)
+        result = await run(args, process.pid, conn, chapters, experts, hot)
+    finally:
+        process.terminate()
+        process.wait()
+        await conn.execute("DELETE FROM tableExperts WHERE chapterID = ANY($1::int[])", chapters + [hot])
+        await conn.execute("DELETE FROM tableChapters WHERE chapterID = ANY($1::int[])", chapters + [hot])
+        await conn.close()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
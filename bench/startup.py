@@ -0,0 +1,90 @@
+"""Import / create_app / lifespan startup time of papi2, checked against a budget.
+
+Each run is a fresh interpreter (a worker process as uvicorn starts it) that times
+`import papi2`, `papi2.create_app()` and, unless --no-db, the lifespan startup
+(pools, chapter tree, listener) against DATABASE_URL. Importing and creating the
+app must not print anything or touch LOG_FILE. Exits with status 1 when the median
+of a phase is over its budget or a side effect is seen, so it can gate a deploy.
+
+    python bench/startup.py --runs 10
+    python bench/startup.py --no-db --import-budget 0.8
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from dotenv import load_dotenv
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_BUDGET, CREATE_BUDGET, STARTUP_BUDGET = 1.0, 0.05, 2.0  # seconds, also enforced by tests/test_startup.py
+
+WORKER = r"""
+import asyncio, contextlib, io, json, sys, time
+captured = io.StringIO()
+start = time.perf_counter()
+with contextlib.redirect_stdout(captured), contextlib.redirect_stderr(captured):
+    import papi2
+    imported = time.perf_counter()
+    app = papi2.create_app()
+    created = time.perf_counter()
+result = {"import": imported - start, "create_app": created - imported, "output": captured.getvalue()}
+
+async def startup():
+    async with app.router.lifespan_context(app):
+        result["startup"] = time.perf_counter() - begin
+
+if sys.argv[1] == "db":
+    begin = time.perf_counter()
+    asyncio.run(startup())
+print(json.dumps(result))
+"""
+
+
+def run_once(with_db: bool, env: dict) -> dict:
+    completed = subprocess.run([sys.executable, "-c", WORKER, "db" if with_db else "nodb"], cwd=ROOT, env=env,
+                               capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--no-db", action="store_true", help="skip the lifespan startup")
+    parser.add_argument("--import-budget", type=float, default=IMPORT_BUDGET, help="seconds")
+    parser.add_argument("--create-budget", type=float, default=CREATE_BUDGET, help="seconds")
+    parser.add_argument("--startup-budget", type=float, default=STARTUP_BUDGET, help="seconds")
+    args = parser.parse_args()
+
+    load_dotenv()
+    log_file = os.path.join(tempfile.mkdtemp(prefix="papi2-startup-"), "helpthing.log")
+    env = dict(os.environ, LOG_FILE=log_file, PYTHONDONTWRITEBYTECODE="1")
+    runs = [run_once(not args.no_db, env) for _ in range(args.runs)]
+
+    budgets = {"import": args.import_budget, "create_app": args.create_budget}
+    if not args.no_db:
+        budgets["startup"] = args.startup_budget
+    failures = []
+    results = {}
+    for phase, budget in budgets.items():
+        values = sorted(run[phase] for run in runs)
+        median = statistics.median(values)
+        results[phase] = {"median_ms": round(median * 1000, 1), "max_ms": round(values[-1] * 1000, 1),
+                          "budget_ms": round(budget * 1000, 1)}
+        if median > budget:
+            failures.append(f"{phase} took {median * 1000:.1f} ms, budget {budget * 1000:.1f} ms")
+    output = {run["output"] for run in runs if run["output"]}
+    if output:
+        failures.append(f"import/create_app wrote output: {output.pop()!r}")
+    if args.no_db and os.path.exists(log_file):
+        failures.append(f"import/create_app created {log_file}")
+
+    print(json.dumps({"runs": args.runs, "phases": results, "failures": failures}, indent=2))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
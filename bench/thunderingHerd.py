@@ -0,0 +1,99 @@
+"""Thundering herd on one chapter page: DB queries per burst with and without coalescing.
+
+Runs papi2 in-process (no HTTP server) and fires --clients identical requests at
+/v1/experts/list?chapterID=X and /v1/chapters/read?chapter_id=X at once, --bursts
+times. The read cache is disabled (each burst is a cold page) so only request
+coalescing can save queries. Counts the queries the pool connections ran, the
+latency per request and the coalescing counters.
+
+    python bench/thunderingHerd.py --clients 500 --bursts 20 --chapter 11
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+os.environ["READ_CACHE_SIZE"] = "0"
+os.environ.setdefault("LOG_FILE", os.devnull)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import papi2  # noqa: E402
+
+queries = 0
+
+
+def count_queries(method):
+    def counted(self, *args, **kwargs):
+        global queries
+        queries += 1
+        return method(self, *args, **kwargs)
+    return counted
+
+
+# only the reads under test use fetch/fetchrow on pool connections
+papi2.TimedConnection.fetch = count_queries(papi2.TimedConnection.fetch)
+papi2.TimedConnection.fetchrow = count_queries(papi2.TimedConnection.fetchrow)
+
+
+async def timed_get(client, url: str, latencies: list, statuses: dict):
+    start = time.perf_counter()
+    response = await client.get(url)
+    latencies.append(time.perf_counter() - start)
+    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    return response.content
+
+
+async def run(app, client, mode: str, args) -> dict:
+    global queries
+    app.state.single_flight = papi2.SingleFlight(args.max_waiters if mode == "coalesced" else 0)
+    urls = [f"/v1/experts/list?chapterID={args.chapter}&limit={args.limit}",
+            f"/v1/chapters/read?chapter_id={args.chapter}"]
+    latencies, statuses, bodies = [], {}, set()
+    queries = 0
+    start = time.perf_counter()
+    for _ in range(args.bursts):
+        results = await asyncio.gather(*(timed_get(client, urls[index % 2], latencies, statuses)
+                                         for index in range(args.clients)))
+        bodies.update(results)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "mode": mode,
+        "requests": len(latencies),
+        "db_queries": queries,
+        "queries_per_burst": round(queries / args.bursts, 1),
+        "requests_per_sec": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+        "statuses": statuses,
+        "distinct_bodies": len(bodies),
+        "coalescing": app.state.single_flight.stats(),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=500, help="identical requests per burst")
+    parser.add_argument("--bursts", type=int, default=20)
+    parser.add_argument("--chapter", type=int, default=11)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--max-waiters", type=int, default=papi2.COALESCE_MAX_WAITERS)
+    args = parser.parse_args()
+
+    app = papi2.create_app()
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            results = [await run(app, client, mode, args) for mode in ("uncoalesced", "coalesced")]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
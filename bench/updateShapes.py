@@ -0,0 +1,116 @@
+"""Random-field-subset expert updates: per-request SQL text vs the canonical shape.
+
+The old update_expert built one statement per combination of non-None fields
+(up to 2^11 texts), which keeps missing asyncpg's statement cache and makes
+Postgres re-plan. papi2 now runs a single COALESCE-shaped UPDATE.
+
+    python bench/updateShapes.py --updates 20000 --connections 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+import asyncpg
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from papi2 import EXPERT_FIELDS, coalesce_update_sql  # noqa: E402
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://user:pw@localhost/papi2")
+
+SAMPLE_VALUES = {
+    'name': lambda: f"Expert {random.randint(1, 100)}",
+    'description': lambda: f"Expert in field {random.randint(1, 100)}",
+    'languages': lambda: random.choice(['English', 'French, Spanish', 'English, Italian']),
+    'online': lambda: random.choice(['online', 'offline']),
+    'price': lambda: round(random.uniform(10, 100), 2),
+    'ranking': lambda: round(random.uniform(0, 5), 1),
+    'jobs': lambda: random.randint(0, 100),
+    'type': lambda: random.choice(['real', 'bot', 'AI']),
+    'url_image': lambda: f"expert{random.randint(1, 100)}.jpg",
+    'url_video': lambda: f"expert{random.randint(1, 100)}.mp4",
+    'enabled': lambda: random.choice([True, False]),
+}
+
+
+def random_fields() -> list:
+    # every field independently present or absent, like optional query params
+    fields = [random.choice([None, SAMPLE_VALUES[name]()]) for name in EXPERT_FIELDS]
+    if all(value is None for value in fields):
+        fields[0] = SAMPLE_VALUES['name']()
+    return fields
+
+
+def dynamic_statement(fields: list, chapter_id: int, expert_id: int):
+    # the pre-canonical builder from update_expert
+    set_clauses = [f"{key} = ${idx + 1}" for idx, key in enumerate(
+        name for name, value in zip(EXPERT_FIELDS, fields) if value is not None)]
+    query = f"""
+        UPDATE tableExperts
+        SET {', '.join(set_clauses)}
+        WHERE chapterID = ${len(set_clauses) + 1} AND id = ${len(set_clauses) + 2};
+    """
+    return query, [value for value in fields if value is not None] + [chapter_id, expert_id]
+
+
+CANONICAL = coalesce_update_sql("tableExperts", EXPERT_FIELDS, ["chapterID", "id"])
+
+
+def canonical_statement(fields: list, chapter_id: int, expert_id: int):
+    return CANONICAL, fields + [chapter_id, expert_id]
+
+
+async def worker(pool, build, jobs: list):
+    for fields, chapter_id, expert_id in jobs:
+        query, params = build(fields, chapter_id, expert_id)
+        async with pool.acquire() as conn:
+            await conn.execute(query, *params)
+
+
+async def run(pool, name: str, build, jobs: list, connections: int) -> dict:
+    texts = {build(*job)[0] for job in jobs}
+    chunks = [jobs[idx::connections] for idx in range(connections)]
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(pool, build, chunk) for chunk in chunks))
+    elapsed = time.perf_counter() - start
+    return {
+        "mode": name,
+        "updates": len(jobs),
+        "distinct_statements": len(texts),
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round(len(jobs) / elapsed, 1),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    pool = await asyncpg.create_pool(DATABASE_URL, min_size=args.connections, max_size=args.connections)
+    try:
+        async with pool.acquire() as conn:
+            targets = await conn.fetch("SELECT chapterID, id FROM tableExperts ORDER BY id LIMIT 100")
+        if not targets:
+            sys.exit("tableExperts is empty, run DBaddDemoData.py first")
+        jobs = [(random_fields(), *random.choice(targets)) for _ in range(args.updates)]
+        results = [
+            await run(pool, "dynamic", dynamic_statement, jobs, args.connections),
+            await run(pool, "canonical", canonical_statement, jobs, args.connections),
+        ]
+    finally:
+        await pool.close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,149 @@
+"""Streaming uploads to /v1/helpitems/upload: throughput and server memory.
+
+Starts papi2 (python papi2.py) with a scratch UPLOAD_DIR / UPLOAD_HOST_DIR, then
+posts --uploads multipart bodies of --size MiB, --concurrency at a time. Bodies
+are generated chunk by chunk on the client, so neither side ever needs a whole
+file in memory. Reports upload throughput, the server's peak RSS (VmHWM) against
+its RSS before the run, whether a repeated file was deduplicated, and how long
+the upload workers took to move everything to the host. The helpitems and files
+are removed afterwards.
+
+    python bench/upload.py --uploads 16 --size 256 --concurrency 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import asyncpg
+import httpx
+from dotenv import load_dotenv
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+load_dotenv(os.path.join(ROOT, ".env"))
+
+DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://user:pw@localhost/papi2")
+CHUNK = 256 * 1024
+
+
+def memory_kb(pid: int, field: str) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+async def multipart_body(boundary: str, seed: int, size: int):
+    yield (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"bench{seed}.mp4\"\r\n"
+           f"Content-Type: application/octet-stream\r\n\r\n").encode()
+    block = seed.to_bytes(8, "little") * (CHUNK // 8)
+    for offset in range(0, size, CHUNK):
+        yield block[:min(CHUNK, size - offset)]
+    yield f"\r\n--{boundary}--\r\n".encode()
+
+
+async def upload(client, chapter_id: int, seed: int, size: int) -> dict:
+    boundary = uuid.uuid4().hex
+    response = await client.post(f"/v1/helpitems/upload?chapterID={chapter_id}&kind=1&title=bench",
+                                 content=multipart_body(boundary, seed, size),
+                                 headers={"content-type": f"multipart/form-data; boundary={boundary}"})
+    response.raise_for_status()
+    return response.json()
+
+
+async def wait_for_server(client, process):
+    for _ in range(300):
+        if process.poll() is not None:
+            raise RuntimeError("papi2 exited during startup")
+        try:
+            await client.get("/v1/uploads/stats")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("papi2 did not start")
+
+
+async def run(args, base_url: str, pid: int) -> dict:
+    size = args.size * 1024 * 1024
+    conn = await asyncpg.connect(DATABASE_URL)
+    chapter_id = await conn.fetchval("INSERT INTO tableChapters (title) VALUES ('upload benchmark') RETURNING chapterID")
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=None) as client:
+            rss_before = memory_kb(pid, "VmRSS")
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def limited(seed):
+                async with semaphore:
+                    return await upload(client, chapter_id, seed, size)
+
+            start = time.perf_counter()
+            # the last upload repeats the first file, it must be deduplicated
+            results = await asyncio.gather(*(limited(seed % max(args.uploads - 1, 1))
+                                             for seed in range(args.uploads)))
+            elapsed = time.perf_counter() - start
+            peak_kb = memory_kb(pid, "VmHWM")
+
+            while await conn.fetchval("SELECT count(*) FROM tableHelpitems WHERE chapterID = $1 AND uploadstate IN (2, 3)",
+                                      chapter_id):
+                await asyncio.sleep(0.2)
+            processed = time.perf_counter() - start
+            states = dict(await conn.fetch(
+                "SELECT uploadstate, count(*) FROM tableHelpitems WHERE chapterID = $1 GROUP BY 1", chapter_id))
+            stats = (await client.get("/v1/uploads/stats")).json()
+    finally:
+        await conn.execute("DELETE FROM tableHelpitems WHERE chapterID = $1", chapter_id)
+        await conn.execute("DELETE FROM tableChapters WHERE chapterID = $1", chapter_id)
+        await conn.close()
+
+    total = len(results) * size
+    return {
+        "uploads": len(results),
+        "file_mib": args.size,
+        "concurrency": args.concurrency,
+        "mib_per_sec": round(total / 1024 / 1024 / elapsed, 1),
+        "seconds": round(elapsed, 2),
+        "seconds_until_processed": round(processed, 2),
+        "server_rss_before_mib": round(rss_before / 1024, 1),
+        "server_peak_rss_mib": round(peak_kb / 1024, 1),
+        "all_bytes_received": all(result["bytes"] == size for result in results),
+        "deduplicated": sum(result["deduplicated"] for result in results),
+        "upload_states": states,
+        "server": stats,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--uploads", type=int, default=16)
+    parser.add_argument("--size", type=int, default=256, help="MiB per file")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="papi2-upload-")
+    env = dict(os.environ, UPLOAD_DIR=os.path.join(scratch, "uploads"), UPLOAD_HOST_DIR=os.path.join(scratch, "host"),
+               UPLOAD_POLL_INTERVAL="0.5", LOG_FILE=os.path.join(scratch, "helpthing.log"))
+    process = subprocess.Popen([sys.executable, "papi2.py", "--port", str(args.port)], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        async with httpx.AsyncClient(base_url=base_url) as client:
+            await wait_for_server(client, process)
+        result = await run(args, base_url, process.pid)
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(scratch, ignore_errors=True)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
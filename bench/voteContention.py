@@ -0,0 +1,119 @@
+"""Many concurrent voters on a handful of hot helpitems: per-vote UPDATE vs VoteBuffer.
+
+  direct    UPDATE tableHelpitems SET voteup = voteup + 1 WHERE itemID = $1 per vote,
+            the naive endpoint: every vote waits for the row lock and writes WAL
+  buffered  papi2.VoteBuffer: votes are summed in memory and flushed every
+            --flush-interval seconds with one batched UPDATE
+
+Both runs use fresh items in a scratch chapter (removed afterwards) and check that
+the final counters equal the number of votes cast.
+
+    python bench/voteContention.py --voters 200 --items 5 --duration 10 --connections 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+import asyncpg
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from papi2 import VoteBuffer  # noqa: E402
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://user:pw@localhost/papi2")
+
+
+async def make_items(conn, count: int):
+    chapter_id = await conn.fetchval("INSERT INTO tableChapters (title) VALUES ('vote benchmark') RETURNING chapterID")
+    item_ids = [await conn.fetchval(
+        "INSERT INTO tableHelpitems (chapterID, title) VALUES ($1, 'hot item') RETURNING itemID", chapter_id)
+        for _ in range(count)]
+    return chapter_id, item_ids
+
+
+async def voter(cast, item_ids, stop_at, latencies, votes):
+    while time.perf_counter() < stop_at:
+        item_id = random.choice(item_ids)
+        up = random.random() < 0.8
+        start = time.perf_counter()
+        await cast(item_id, up)
+        latencies.append(time.perf_counter() - start)
+        votes[up] += 1
+
+
+async def run(mode: str, pool, args) -> dict:
+    async with pool.acquire() as conn:
+        chapter_id, item_ids = await make_items(conn, args.items)
+        wal_start = await conn.fetchval("SELECT pg_current_wal_lsn()")
+
+    buffer = None
+    if mode == "direct":
+        async def cast(item_id, up):
+            column = "voteup" if up else "votedown"
+            async with pool.acquire() as conn:
+                await conn.execute(f"UPDATE tableHelpitems SET {column} = {column} + 1 WHERE itemID = $1", item_id)
+    else:
+        buffer = VoteBuffer(pool, flush_interval=args.flush_interval)
+        await buffer.start()
+
+        async def cast(item_id, up):
+            buffer.add(item_id, 1 if up else 0, 0 if up else 1)
+            await asyncio.sleep(0)
+
+    latencies, votes = [], {True: 0, False: 0}
+    start = time.perf_counter()
+    await asyncio.gather(*(voter(cast, item_ids, start + args.duration, latencies, votes)
+                           for _ in range(args.voters)))
+    if buffer is not None:
+        await buffer.stop()
+    elapsed = time.perf_counter() - start
+
+    async with pool.acquire() as conn:
+        wal_bytes = await conn.fetchval("SELECT pg_current_wal_lsn() - $1::pg_lsn", wal_start)
+        totals = await conn.fetchrow(
+            "SELECT sum(voteup) AS up, sum(votedown) AS down FROM tableHelpitems WHERE chapterID = $1", chapter_id)
+        await conn.execute("DELETE FROM tableHelpitems WHERE chapterID = $1", chapter_id)
+        await conn.execute("DELETE FROM tableChapters WHERE chapterID = $1", chapter_id)
+
+    cast_votes = votes[True] + votes[False]
+    latencies.sort()
+    result = {
+        "mode": mode,
+        "votes": cast_votes,
+        "votes_per_sec": round(cast_votes / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 3),
+        "wal_bytes_per_vote": round(float(wal_bytes) / max(cast_votes, 1), 1),
+        "counts_match": totals["up"] == votes[True] and totals["down"] == votes[False],
+    }
+    if buffer is not None:
+        result["flushes"] = buffer.flushes
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--voters", type=int, default=200, help="concurrent voters")
+    parser.add_argument("--items", type=int, default=5, help="hot items the votes go to")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--connections", type=int, default=10)
+    parser.add_argument("--flush-interval", type=float, default=1.0)
+    args = parser.parse_args()
+
+    pool = await asyncpg.create_pool(DATABASE_URL, min_size=args.connections, max_size=args.connections)
+    try:
+        results = [await run(mode, pool, args) for mode in ("direct", "buffered")]
+    finally:
+        await pool.close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
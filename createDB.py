@@ -1,7 +1,10 @@
 import psycopg2
 from psycopg2 import sql
 from dotenv import load_dotenv
+from collections import namedtuple
+import argparse
 import os
+import re
 
 # Load environment variables from .env file
 load_dotenv()
@@ -25,13 +28,29 @@ db_config = {
     'port': 5432
 }
 
-def create_table():
-    try:
-        # Establish connection to the database
-        connection = psycopg2.connect(**db_config)
-        cursor = connection.cursor()
+# Versioned schema migrations. Applied versions are recorded in schema_migrations;
+# every statement is also written to be safe to rerun on a database that was set up
+# by hand or by an older createDB.py. Append new migrations, never edit applied ones.
+#
+# concurrent=True migrations run outside a transaction with CREATE INDEX CONCURRENTLY
+# so they can be rolled out against live tables without blocking writes.
+Migration = namedtuple('Migration', ['version', 'description', 'statements', 'concurrent'], defaults=[False])
+
+
+def add_foreign_key(table, name, definition):
+    # ADD CONSTRAINT has no IF NOT EXISTS; NOT VALID skips the full-table check and lock
+    return f'''
+        DO $$ BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = '{name.lower()}') THEN
+                ALTER TABLE {table} ADD CONSTRAINT {name} {definition} NOT VALID;
+            END IF;
+        END $$;
+    '''
 
-        create_table_query = '''
+
+MIGRATIONS = [
+    Migration(1, "base tables", [
+        '''
         CREATE TABLE IF NOT EXISTS tableUsers (
             userID        SERIAL PRIMARY KEY,
             token         BIGINT,
@@ -47,20 +66,8 @@ def create_table():
             bankIban      VARCHAR(30),
             likes         JSON              -- JSON structure for chapterID and likes
         );
+        ''',
         '''
-        cursor.execute(create_table_query)
-        connection.commit()
-        print("Table 'tableUsers' created successfully or already exists.")
-
-
-        #drop table tableHelpitems
-        if False:
-            cursor.execute("DROP TABLE IF EXISTS tableHelpitems;")
-            connection.commit()
-            print("Table 'tableHelpitems' dropped successfully.")
-
-        # Create table tableHelpitems
-        create_table_query = '''
         CREATE TABLE IF NOT EXISTS tableHelpitems (
             itemID        SERIAL PRIMARY KEY,
             creatorID     INT,   --  reference to creator in tableUsers
@@ -84,12 +91,8 @@ def create_table():
             price         NUMERIC,
             budget        NUMERIC                              -- Domain owner budget; if 0, item becomes premium
         );
+        ''',
         '''
-        cursor.execute(create_table_query)
-        connection.commit()
-        print("Table 'tableHelpitems' created successfully or already exists.")
-
-        create_table_query = '''
         CREATE TABLE IF NOT EXISTS tableChapters (
             chapterID     SERIAL PRIMARY KEY,
             domainID      INT ,  --key to domain ID in tableUsers, if applicable
@@ -104,18 +107,14 @@ def create_table():
             playlist      TEXT,                                 -- Default playlist for the chapter
             budget        NUMERIC                               -- Budget for chapter; if 0, it becomes premium
         );
+        ''',
         '''
-        cursor.execute(create_table_query)
-        connection.commit()
-        print("Table 'tableChapters' created successfully or already exists.")
-
-        create_table_query = '''
-        CREATE TABLE tableExperts (
+        CREATE TABLE IF NOT EXISTS tableExperts (
             id SERIAL PRIMARY KEY,
             chapterID INTEGER,              --to  chapterID in tableChapters
             userID INTEGER,                 -- to userID in tableUsers
             name VARCHAR(255) NOT NULL,
-            description TEXT,    
+            description TEXT,
             schedule TEXT,                  -- future
             languages VARCHAR(255),         -- Comma separated list of languages  -- You could use an array if you prefer: TEXT[]
             online VARCHAR(10),             -- Enum-like column for status
@@ -126,24 +125,694 @@ def create_table():
             url_image VARCHAR(128),         -- URL of the title image
             url_video VARCHAR(128),         -- future
             _active BOOLEAN DEFAULT TRUE,   -- Indicates if the entry is active  -- URL of the video    _active BOOLEAN DEFAULT TRUE,  -- Indicates if the entry is active
+            enabled BOOLEAN DEFAULT TRUE,   -- Set through /v1/experts/create and /v1/experts/update
             _cdt TIMESTAMP DEFAULT CURRENT_TIMESTAMP  -- Creation date and time
         );
+        ''',
+        # databases created before the enabled column existed
+        "ALTER TABLE tableExperts ADD COLUMN IF NOT EXISTS enabled BOOLEAN DEFAULT TRUE;",
+    ]),
+    # Change notifications for papi2: every worker LISTENs on papi2_changes and
+    # drops cached experts/chapters when a row changes
+    Migration(2, "change notification triggers", [
+        '''
+        CREATE OR REPLACE FUNCTION papi2_notify_expert_change() RETURNS trigger AS $$
+        DECLARE
+            rec RECORD;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN rec := OLD; ELSE rec := NEW; END IF;
+            PERFORM pg_notify('papi2_changes', json_build_object(
+                'table', 'experts',
+                'op', TG_OP,
+                'id', rec.id,
+                'chapterid', rec.chapterID,
+                'old_chapterid', CASE WHEN TG_OP = 'UPDATE' THEN OLD.chapterID END
+            )::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE OR REPLACE FUNCTION papi2_notify_chapter_change() RETURNS trigger AS $$
+        DECLARE
+            rec RECORD;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN rec := OLD; ELSE rec := NEW; END IF;
+            PERFORM pg_notify('papi2_changes', json_build_object(
+                'table', 'chapters',
+                'op', TG_OP,
+                'id', rec.chapterID,
+                'parentid', rec.parentID,
+                'title', rec.title
+            )::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS papi2_expert_change ON tableExperts;
+        CREATE TRIGGER papi2_expert_change AFTER INSERT OR UPDATE OR DELETE ON tableExperts
+            FOR EACH ROW EXECUTE FUNCTION papi2_notify_expert_change();
 
+        DROP TRIGGER IF EXISTS papi2_chapter_change ON tableChapters;
+        CREATE TRIGGER papi2_chapter_change AFTER INSERT OR UPDATE OR DELETE ON tableChapters
+            FOR EACH ROW EXECUTE FUNCTION papi2_notify_chapter_change();
+        ''',
+    ]),
+    # one index per endpoint predicate
+    Migration(3, "indexes for endpoint lookups", [
+        # list_experts keyset (chapterID = $1 AND id > $2 ORDER BY id), read/update/delete expert
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_experts_chapter_id ON tableExperts (chapterID, id);",
+        # helpitems by chapter
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_helpitems_chapter_item ON tableHelpitems (chapterID, itemID);",
+        # parentID walks (chapter tree CTE, children of a chapter)
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_chapters_parent ON tableChapters (parentID, chapterID);",
+        # foreign key columns, so deletes on the referenced tables do not scan
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_experts_user ON tableExperts (userID);",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_helpitems_creator ON tableHelpitems (creatorID);",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_helpitems_owner ON tableHelpitems (ownerID);",
+    ], concurrent=True),
+    # enforced for new rows right away; existing rows are checked by the next migration.
+    # A chapter with experts or helpitems can't be deleted (RESTRICT): they are moved or
+    # deleted first, never silently with the chapter. Subchapters become roots.
+    Migration(4, "foreign keys", [
+        add_foreign_key('tableExperts', 'fk_experts_chapter',
+                        'FOREIGN KEY (chapterID) REFERENCES tableChapters (chapterID) ON DELETE RESTRICT'),
+        add_foreign_key('tableExperts', 'fk_experts_user',
+                        'FOREIGN KEY (userID) REFERENCES tableUsers (userID) ON DELETE SET NULL'),
+        add_foreign_key('tableHelpitems', 'fk_helpitems_chapter',
+                        'FOREIGN KEY (chapterID) REFERENCES tableChapters (chapterID) ON DELETE RESTRICT'),
+        add_foreign_key('tableHelpitems', 'fk_helpitems_creator',
+                        'FOREIGN KEY (creatorID) REFERENCES tableUsers (userID) ON DELETE SET NULL'),
+        add_foreign_key('tableHelpitems', 'fk_helpitems_owner',
+                        'FOREIGN KEY (ownerID) REFERENCES tableUsers (userID) ON DELETE SET NULL'),
+        add_foreign_key('tableChapters', 'fk_chapters_parent',
+                        'FOREIGN KEY (parentID) REFERENCES tableChapters (chapterID) ON DELETE SET NULL'),
+    ]),
+    # VALIDATE only takes a SHARE UPDATE EXCLUSIVE lock, reads and writes keep going.
+    # Fails if existing rows point at missing chapters/users; fix those and rerun.
+    Migration(5, "validate foreign keys", [
+        "ALTER TABLE tableExperts VALIDATE CONSTRAINT fk_experts_chapter;",
+        "ALTER TABLE tableExperts VALIDATE CONSTRAINT fk_experts_user;",
+        "ALTER TABLE tableHelpitems VALIDATE CONSTRAINT fk_helpitems_chapter;",
+        "ALTER TABLE tableHelpitems VALIDATE CONSTRAINT fk_helpitems_creator;",
+        "ALTER TABLE tableHelpitems VALIDATE CONSTRAINT fk_helpitems_owner;",
+        "ALTER TABLE tableChapters VALIDATE CONSTRAINT fk_chapters_parent;",
+    ]),
+    # /v1/experts/search matches languages as set membership instead of splitting the
+    # comma-separated VARCHAR of every row. Adding the STORED column rewrites
+    # tableExperts once under an exclusive lock; run it in a quiet window.
+    Migration(6, "expert language array", [
+        r'''
+        CREATE OR REPLACE FUNCTION papi2_language_list(languages TEXT) RETURNS TEXT[] AS $$
+            SELECT COALESCE(array_remove(regexp_split_to_array(lower(btrim(languages)), '\s*,\s*'), ''), '{}')
+        $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+        ''',
+        '''
+        ALTER TABLE tableExperts ADD COLUMN IF NOT EXISTS language_list TEXT[]
+            GENERATED ALWAYS AS (papi2_language_list(languages)) STORED;
+        ''',
+    ]),
+    # search only returns active, enabled experts, so its indexes are partial; one
+    # btree per sort order (walked in order until LIMIT rows pass the filters) plus
+    # GIN for language containment
+    Migration(7, "expert search indexes", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_experts_search_languages ON tableExperts "
+        "USING GIN (language_list) WHERE _active AND enabled;",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_experts_search_ranking ON tableExperts "
+        "((COALESCE(ranking, 0)) DESC, id DESC) WHERE _active AND enabled;",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_experts_search_jobs ON tableExperts "
+        "((COALESCE(jobs, 0)) DESC, id DESC) WHERE _active AND enabled;",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_experts_search_price ON tableExperts "
+        "((COALESCE(price, 0)), id) WHERE _active AND enabled;",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_experts_search_newest ON tableExperts "
+        "(id DESC) WHERE _active AND enabled;",
+        # the planner ignores expression statistics of partial indexes, so without these
+        # a price or ranking range is estimated at a default 0.5% of the table
+        "CREATE STATISTICS IF NOT EXISTS stx_experts_search_keys ON "
+        "(COALESCE(price, 0)), (COALESCE(ranking, 0)), (COALESCE(jobs, 0)) FROM tableExperts;",
+        "ANALYZE tableExperts;",
+    ], concurrent=True),
+    # /v1/helpitems/feed ranks items by the lower bound of the Wilson score interval
+    # (95%) of their votes: few votes rank below many votes with the same ratio. The
+    # score is a STORED generated column, so it is indexed and never computed per query.
+    Migration(8, "helpitem score", [
+        '''
+        CREATE OR REPLACE FUNCTION papi2_wilson_score(voteup INT, votedown INT) RETURNS DOUBLE PRECISION AS $$
+            SELECT CASE WHEN n = 0 THEN 0.0 ELSE
+                (p + 1.9208 / n - 1.96 * sqrt((p * (1 - p) + 0.9604 / n) / n)) / (1 + 3.8416 / n)
+            END
+            FROM (SELECT GREATEST(COALESCE(voteup, 0), 0) + GREATEST(COALESCE(votedown, 0), 0) AS n,
+                         GREATEST(COALESCE(voteup, 0), 0)::float8
+                             / NULLIF(GREATEST(COALESCE(voteup, 0), 0) + GREATEST(COALESCE(votedown, 0), 0), 0) AS p) v
+        $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+        ''',
+        '''
+        ALTER TABLE tableHelpitems ADD COLUMN IF NOT EXISTS score DOUBLE PRECISION
+            GENERATED ALWAYS AS (papi2_wilson_score(voteup, votedown)) STORED;
+        ''',
+    ]),
+    Migration(9, "helpitem feed index", [
+        # feed keyset: chapterID = $1 AND (score, itemID) < (...) ORDER BY score DESC, itemID DESC
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_helpitems_feed ON tableHelpitems "
+        "(chapterID, score DESC, itemID DESC);",
+    ], concurrent=True),
+    # Version counters behind the papi2 ETags: 'experts:<chapterID>' for the experts of
+    # a chapter and 'chapters' for the chapter table. Statement-level triggers bump each
+    # touched scope once per statement (a 10k-row COPY is one bump per chapter, not 10k)
+    # and publish the new version on papi2_changes. A bump holds the scope's row lock
+    # until commit, so concurrent writes to the same chapter's experts queue up briefly.
+    Migration(10, "version counters", [
+        '''
+        CREATE TABLE IF NOT EXISTS tableVersions (
+            scope         TEXT PRIMARY KEY,
+            version       BIGINT NOT NULL DEFAULT 0
+        );
+        ''',
+        '''
+        CREATE OR REPLACE FUNCTION papi2_bump_versions(scopes TEXT[]) RETURNS void AS $$
+        DECLARE
+            bumped RECORD;
+        BEGIN
+            FOR bumped IN
+                INSERT INTO tableVersions AS v (scope, version)
+                SELECT DISTINCT scope, 1 FROM unnest(scopes) AS scope WHERE scope IS NOT NULL ORDER BY 1
+                ON CONFLICT (scope) DO UPDATE SET version = v.version + 1
+                RETURNING v.scope, v.version
+            LOOP
+                PERFORM pg_notify('papi2_changes', json_build_object(
+                    'table', 'versions',
+                    'scope', bumped.scope,
+                    'version', bumped.version
+                )::text);
+            END LOOP;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE OR REPLACE FUNCTION papi2_expert_versions() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                PERFORM papi2_bump_versions(ARRAY(SELECT 'experts:' || chapterID FROM new_rows));
+            ELSIF TG_OP = 'DELETE' THEN
+                PERFORM papi2_bump_versions(ARRAY(SELECT 'experts:' || chapterID FROM old_rows));
+            ELSE
+                PERFORM papi2_bump_versions(ARRAY(
+                    SELECT 'experts:' || chapterID FROM new_rows
+                    UNION SELECT 'experts:' || chapterID FROM old_rows));
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE OR REPLACE FUNCTION papi2_chapter_versions() RETURNS trigger AS $$
+        BEGIN
+            -- PL/pgSQL plans a whole condition, and each trigger only has its own
+            -- transition table, so old_rows and new_rows are never in the same one
+            IF TG_OP = 'DELETE' THEN
+                IF EXISTS (SELECT 1 FROM old_rows) THEN
+                    PERFORM papi2_bump_versions(ARRAY['chapters']);
+                END IF;
+            ELSIF EXISTS (SELECT 1 FROM new_rows) THEN
+                PERFORM papi2_bump_versions(ARRAY['chapters']);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        ''',
+        '''
+        DROP TRIGGER IF EXISTS papi2_expert_versions_insert ON tableExperts;
+        CREATE TRIGGER papi2_expert_versions_insert AFTER INSERT ON tableExperts
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION papi2_expert_versions();
+        DROP TRIGGER IF EXISTS papi2_expert_versions_update ON tableExperts;
+        CREATE TRIGGER papi2_expert_versions_update AFTER UPDATE ON tableExperts
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION papi2_expert_versions();
+        DROP TRIGGER IF EXISTS papi2_expert_versions_delete ON tableExperts;
+        CREATE TRIGGER papi2_expert_versions_delete AFTER DELETE ON tableExperts
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION papi2_expert_versions();
+
+        DROP TRIGGER IF EXISTS papi2_chapter_versions_insert ON tableChapters;
+        CREATE TRIGGER papi2_chapter_versions_insert AFTER INSERT ON tableChapters
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION papi2_chapter_versions();
+        DROP TRIGGER IF EXISTS papi2_chapter_versions_update ON tableChapters;
+        CREATE TRIGGER papi2_chapter_versions_update AFTER UPDATE ON tableChapters
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION papi2_chapter_versions();
+        DROP TRIGGER IF EXISTS papi2_chapter_versions_delete ON tableChapters;
+        CREATE TRIGGER papi2_chapter_versions_delete AFTER DELETE ON tableChapters
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION papi2_chapter_versions();
+        ''',
+    ]),
+    # Per-chapter rollups behind /v1/chapters/stats: one row per (chapterID, metric),
+    # e.g. 'experts', 'experts_online:offline', 'experts_type:bot', 'helpitems_kind:2',
+    # 'votes_up', 'helpitems_budget', 'chapter_budget'. The papi2_*_deltas functions say
+    # what one row contributes; statement-level triggers add the contributions of the
+    # new rows and subtract those of the old ones, so an update that changes no counted
+    # column writes nothing. viewChapterStatsFresh computes the same from scratch for
+    # --rebuild-stats and --check-stats.
+    Migration(11, "chapter stats rollup", [
+        '''
+        CREATE TABLE IF NOT EXISTS tableChapterStats (
+            chapterID     INT NOT NULL,
+            metric        TEXT NOT NULL,
+            value         NUMERIC NOT NULL DEFAULT 0,
+            PRIMARY KEY (chapterID, metric)
+        );
+        ''',
+        '''
+        DO $$ BEGIN
+            CREATE TYPE papi2_stat_delta AS (chapterID INT, metric TEXT, delta NUMERIC);
+        EXCEPTION WHEN duplicate_object THEN NULL;
+        END $$;
+
+        CREATE OR REPLACE FUNCTION papi2_expert_deltas(chapter_id INT, online TEXT, type TEXT, sign INT)
+        RETURNS SETOF papi2_stat_delta AS $$
+            SELECT chapter_id, m.metric, m.delta FROM (VALUES
+                ('experts', sign::numeric),
+                ('experts_online:' || COALESCE(online, ''), sign),
+                ('experts_type:' || COALESCE(type, ''), sign)
+            ) AS m(metric, delta);
+        $$ LANGUAGE sql IMMUTABLE;
+
+        CREATE OR REPLACE FUNCTION papi2_helpitem_deltas(chapter_id INT, kind INT, voteup INT, votedown INT,
+                                                         budget NUMERIC, sign INT)
+        RETURNS SETOF papi2_stat_delta AS $$
+            SELECT chapter_id, m.metric, m.delta FROM (VALUES
+                ('helpitems', sign::numeric),
+                ('helpitems_kind:' || COALESCE(kind::text, ''), sign),
+                ('votes_up', sign * COALESCE(voteup, 0)),
+                ('votes_down', sign * COALESCE(votedown, 0)),
+                ('helpitems_budget', sign * COALESCE(budget, 0))
+            ) AS m(metric, delta);
+        $$ LANGUAGE sql IMMUTABLE;
+
+        CREATE OR REPLACE FUNCTION papi2_chapter_deltas(chapter_id INT, budget NUMERIC, sign INT)
+        RETURNS SETOF papi2_stat_delta AS $$
+            SELECT chapter_id, 'chapter_budget', sign * COALESCE(budget, 0);
+        $$ LANGUAGE sql IMMUTABLE;
+
+        CREATE OR REPLACE FUNCTION papi2_add_chapter_stats(deltas papi2_stat_delta[]) RETURNS void AS $$
+            INSERT INTO tableChapterStats AS s (chapterID, metric, value)
+            SELECT d.chapterID, d.metric, sum(d.delta) FROM unnest(deltas) AS d
+            WHERE d.chapterID IS NOT NULL
+            GROUP BY d.chapterID, d.metric
+            HAVING sum(d.delta) <> 0
+            ORDER BY 1, 2  -- same lock order in every transaction
+            ON CONFLICT (chapterID, metric) DO UPDATE SET value = s.value + EXCLUDED.value;
+        $$ LANGUAGE sql;
+        ''',
+        '''
+        CREATE OR REPLACE FUNCTION papi2_expert_stats() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                PERFORM papi2_add_chapter_stats(ARRAY(
+                    SELECT d FROM new_rows n, papi2_expert_deltas(n.chapterID, n.online, n.type, 1) d));
+            ELSIF TG_OP = 'DELETE' THEN
+                PERFORM papi2_add_chapter_stats(ARRAY(
+                    SELECT d FROM old_rows o, papi2_expert_deltas(o.chapterID, o.online, o.type, -1) d));
+            ELSE
+                PERFORM papi2_add_chapter_stats(ARRAY(
+                    SELECT d FROM new_rows n, papi2_expert_deltas(n.chapterID, n.online, n.type, 1) d
+                    UNION ALL
+                    SELECT d FROM old_rows o, papi2_expert_deltas(o.chapterID, o.online, o.type, -1) d));
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE OR REPLACE FUNCTION papi2_helpitem_stats() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                PERFORM papi2_add_chapter_stats(ARRAY(
+                    SELECT d FROM new_rows n,
+                        papi2_helpitem_deltas(n.chapterID, n.kind, n.voteup, n.votedown, n.budget, 1) d));
+            ELSIF TG_OP = 'DELETE' THEN
+                PERFORM papi2_add_chapter_stats(ARRAY(
+                    SELECT d FROM old_rows o,
+                        papi2_helpitem_deltas(o.chapterID, o.kind, o.voteup, o.votedown, o.budget, -1) d));
+            ELSE
+                PERFORM papi2_add_chapter_stats(ARRAY(
+                    SELECT d FROM new_rows n,
+                        papi2_helpitem_deltas(n.chapterID, n.kind, n.voteup, n.votedown, n.budget, 1) d
+                    UNION ALL
+                    SELECT d FROM old_rows o,
+                        papi2_helpitem_deltas(o.chapterID, o.kind, o.voteup, o.votedown, o.budget, -1) d));
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE OR REPLACE FUNCTION papi2_chapter_stats() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                PERFORM papi2_add_chapter_stats(ARRAY(
+                    SELECT d FROM new_rows n, papi2_chapter_deltas(n.chapterID, n.budget, 1) d));
+            ELSIF TG_OP = 'DELETE' THEN
+                PERFORM papi2_add_chapter_stats(ARRAY(
+                    SELECT d FROM old_rows o, papi2_chapter_deltas(o.chapterID, o.budget, -1) d));
+            ELSE
+                PERFORM papi2_add_chapter_stats(ARRAY(
+                    SELECT d FROM new_rows n, papi2_chapter_deltas(n.chapterID, n.budget, 1) d
+                    UNION ALL
+                    SELECT d FROM old_rows o, papi2_chapter_deltas(o.chapterID, o.budget, -1) d));
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        ''',
+        *[f'''
+        DROP TRIGGER IF EXISTS papi2_{name}_stats_insert ON {table};
+        CREATE TRIGGER papi2_{name}_stats_insert AFTER INSERT ON {table}
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION papi2_{name}_stats();
+        DROP TRIGGER IF EXISTS papi2_{name}_stats_update ON {table};
+        CREATE TRIGGER papi2_{name}_stats_update AFTER UPDATE ON {table}
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION papi2_{name}_stats();
+        DROP TRIGGER IF EXISTS papi2_{name}_stats_delete ON {table};
+        CREATE TRIGGER papi2_{name}_stats_delete AFTER DELETE ON {table}
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION papi2_{name}_stats();
+        ''' for name, table in (("expert", "tableExperts"), ("helpitem", "tableHelpitems"),
+                                 ("chapter", "tableChapters"))],
+        '''
+        CREATE OR REPLACE VIEW viewChapterStatsFresh AS
+        SELECT d.chapterID, d.metric, sum(d.delta) AS value
+        FROM (
+            SELECT d.* FROM tableExperts e, papi2_expert_deltas(e.chapterID, e.online, e.type, 1) d
+            UNION ALL
+            SELECT d.* FROM tableHelpitems h,
+                papi2_helpitem_deltas(h.chapterID, h.kind, h.voteup, h.votedown, h.budget, 1) d
+            UNION ALL
+            SELECT d.* FROM tableChapters c, papi2_chapter_deltas(c.chapterID, c.budget, 1) d
+        ) AS d
+        WHERE d.chapterID IS NOT NULL
+        GROUP BY d.chapterID, d.metric
+        HAVING sum(d.delta) <> 0;
+        ''',
+        # the triggers above already hold locks that keep writers out until commit
+        "DELETE FROM tableChapterStats;",
+        "INSERT INTO tableChapterStats (chapterID, metric, value) SELECT * FROM viewChapterStatsFresh;",
+    ]),
+    # Media uploads (POST /v1/helpitems/upload): the stored file's sha256 for dedup, the
+    # upload states the papi2 upload workers move an item through, and when a worker
+    # claimed it, so items a crashed server left processing can be claimed again.
+    Migration(12, "helpitem uploads", [
+        "ALTER TABLE tableHelpitems ADD COLUMN IF NOT EXISTS sha256 CHAR(64);",
+        "ALTER TABLE tableHelpitems ADD COLUMN IF NOT EXISTS uploadclaimed TIMESTAMPTZ;",
         '''
-        cursor.execute(create_table_query)
+        COMMENT ON COLUMN tableHelpitems.uploadstate IS
+            '0 = nothing to upload, 1 = requires upload (no local file), 2 = pending, 3 = processing, '
+            '4 = on host, 5 = failed';
+        ''',
+    ]),
+    Migration(13, "helpitem upload indexes", [
+        # the upload workers claim pending items in itemID order
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_helpitems_upload_pending ON tableHelpitems (itemID) "
+        "WHERE uploadstate = 2;",
+        # ... and take back processing items whose claim is older than UPLOAD_CLAIM_TIMEOUT
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_helpitems_upload_processing ON tableHelpitems (uploadclaimed) "
+        "WHERE uploadstate = 3;",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_helpitems_sha256 ON tableHelpitems (sha256) "
+        "WHERE sha256 IS NOT NULL;",
+    ], concurrent=True),
+    # /v1/experts/events forwards expert notifications to browsers; carry the online status
+    # so a status change needs no read of the row
+    Migration(14, "expert online status in change notifications", [
+        '''
+        CREATE OR REPLACE FUNCTION papi2_notify_expert_change() RETURNS trigger AS $$
+        DECLARE
+            rec RECORD;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN rec := OLD; ELSE rec := NEW; END IF;
+            PERFORM pg_notify('papi2_changes', json_build_object(
+                'table', 'experts',
+                'op', TG_OP,
+                'id', rec.id,
+                'chapterid', rec.chapterID,
+                'old_chapterid', CASE WHEN TG_OP = 'UPDATE' THEN OLD.chapterID END,
+                'online', rec.online,
+                'old_online', CASE WHEN TG_OP = 'UPDATE' THEN OLD.online END
+            )::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        ''',
+    ]),
+    # Full-text search (/v1/search). Each row is indexed with the text search config of
+    # its own language ('English', 'en', ... -> english; unknown or missing -> simple):
+    # titles and names weigh most, then descriptions, then content. The config lookup
+    # is a CASE over regconfig constants rather than a cast of the name, which would be
+    # STABLE (it depends on search_path): generated columns need it IMMUTABLE, and the
+    # planner only inlines it into queries when it is. Adding the columns rewrites
+    # both tables.
+    Migration(15, "full-text search columns", [
+        '''
+        CREATE OR REPLACE FUNCTION papi2_ts_config(language TEXT) RETURNS regconfig AS $$
+            SELECT CASE lower(btrim(language))
+                WHEN 'english' THEN 'pg_catalog.english'::regconfig WHEN 'en' THEN 'pg_catalog.english'::regconfig
+                WHEN 'german' THEN 'pg_catalog.german'::regconfig WHEN 'de' THEN 'pg_catalog.german'::regconfig
+                WHEN 'french' THEN 'pg_catalog.french'::regconfig WHEN 'fr' THEN 'pg_catalog.french'::regconfig
+                WHEN 'spanish' THEN 'pg_catalog.spanish'::regconfig WHEN 'es' THEN 'pg_catalog.spanish'::regconfig
+                WHEN 'italian' THEN 'pg_catalog.italian'::regconfig WHEN 'it' THEN 'pg_catalog.italian'::regconfig
+                WHEN 'greek' THEN 'pg_catalog.greek'::regconfig WHEN 'el' THEN 'pg_catalog.greek'::regconfig
+                WHEN 'portuguese' THEN 'pg_catalog.portuguese'::regconfig WHEN 'pt' THEN 'pg_catalog.portuguese'::regconfig
+                WHEN 'dutch' THEN 'pg_catalog.dutch'::regconfig WHEN 'nl' THEN 'pg_catalog.dutch'::regconfig
+                WHEN 'russian' THEN 'pg_catalog.russian'::regconfig WHEN 'ru' THEN 'pg_catalog.russian'::regconfig
+                WHEN 'swedish' THEN 'pg_catalog.swedish'::regconfig WHEN 'sv' THEN 'pg_catalog.swedish'::regconfig
+                WHEN 'danish' THEN 'pg_catalog.danish'::regconfig WHEN 'da' THEN 'pg_catalog.danish'::regconfig
+                WHEN 'finnish' THEN 'pg_catalog.finnish'::regconfig WHEN 'fi' THEN 'pg_catalog.finnish'::regconfig
+                WHEN 'norwegian' THEN 'pg_catalog.norwegian'::regconfig WHEN 'no' THEN 'pg_catalog.norwegian'::regconfig
+                WHEN 'turkish' THEN 'pg_catalog.turkish'::regconfig WHEN 'tr' THEN 'pg_catalog.turkish'::regconfig
+                ELSE 'pg_catalog.simple'::regconfig
+            END
+        $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+        ''',
+        # the query side: with a language, the query is stemmed for that config; without
+        # one it is stemmed for every config above and the variants are OR'ed, so a word
+        # matches documents in any language while the whole query stays one constant
+        # tsquery the GIN indexes can use. -negated words and "phrases" are split off
+        # first: OR'ing whole variants would let 'foo' & !'running' (simple) match a row
+        # indexed as 'foo' 'run' (english), so a row must miss every variant of those.
+        r'''
+        CREATE OR REPLACE FUNCTION papi2_ts_query(q TEXT, language TEXT) RETURNS tsquery AS $$
+        DECLARE
+            configs CONSTANT regconfig[] := ARRAY['simple', 'english', 'german', 'french', 'spanish', 'italian',
+                                                  'greek', 'portuguese', 'dutch', 'russian', 'swedish', 'danish',
+                                                  'finnish', 'norwegian', 'turkish'];
+            token TEXT;
+            positive TEXT := '';
+            negated TEXT[] := '{}';
+            included tsquery;
+            excluded tsquery;
+        BEGIN
+            IF language IS NOT NULL THEN
+                RETURN websearch_to_tsquery(papi2_ts_config(language), q);
+            END IF;
+            FOR token IN SELECT match[1] FROM regexp_matches(q, '(-?"[^"]*"?|\S+)', 'g') AS match LOOP
+                IF token LIKE '-_%' THEN
+                    negated := negated || substr(token, 2);
+                ELSE
+                    positive := positive || ' ' || token;
+                END IF;
+            END LOOP;
+            SELECT string_agg(DISTINCT '(' || variant::text || ')', ' | ')::tsquery INTO included
+            FROM unnest(configs) AS config, websearch_to_tsquery(config, positive) AS variant
+            WHERE numnode(variant) > 0;
+            SELECT string_agg(DISTINCT '(' || variant::text || ')', ' | ')::tsquery INTO excluded
+            FROM unnest(configs) AS config, unnest(negated) AS term, websearch_to_tsquery(config, term) AS variant
+            WHERE numnode(variant) > 0;
+            IF excluded IS NULL THEN
+                RETURN COALESCE(included, ''::tsquery);
+            ELSIF included IS NULL THEN
+                RETURN !! excluded;
+            END IF;
+            RETURN included && !! excluded;
+        END;
+        $$ LANGUAGE plpgsql STABLE PARALLEL SAFE;
+        ''',
+        '''
+        ALTER TABLE tableHelpitems ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector(papi2_ts_config(language), COALESCE(title, '')), 'A') ||
+            setweight(to_tsvector(papi2_ts_config(language), COALESCE(description, '')), 'B') ||
+            setweight(to_tsvector(papi2_ts_config(language), COALESCE(content, '')), 'C')
+        ) STORED;
+        ''',
+        # experts list several languages; their text is indexed in the first one
+        '''
+        ALTER TABLE tableExperts ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector(papi2_ts_config((papi2_language_list(languages))[1]), COALESCE(name, '')), 'A') ||
+            setweight(to_tsvector(papi2_ts_config((papi2_language_list(languages))[1]), COALESCE(description, '')), 'B')
+        ) STORED;
+        ''',
+    ]),
+    Migration(16, "full-text search indexes", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_helpitems_search_vector ON tableHelpitems "
+        "USING GIN (search_vector);",
+        # /v1/search, like /v1/experts/search, only returns active, enabled experts
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_experts_search_vector ON tableExperts "
+        "USING GIN (search_vector) WHERE _active AND enabled;",
+        "ANALYZE tableHelpitems, tableExperts;",
+    ], concurrent=True),
+]
+
+# keeps two createDB.py runs (e.g. two deploys) from migrating at the same time
+MIGRATION_LOCK_ID = 72034001
+
+
+def applied_versions(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version       INT PRIMARY KEY,
+            description   TEXT,
+            applied_at    TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    ''')
+    cursor.execute("SELECT version FROM schema_migrations;")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def drop_invalid_index(cursor, statement):
+    # an interrupted CREATE INDEX CONCURRENTLY leaves an INVALID index behind that
+    # IF NOT EXISTS would happily skip; drop it so the build is retried
+    match = re.search(r"INDEX CONCURRENTLY IF NOT EXISTS (\w+)", statement)
+    if not match:
+        return
+    cursor.execute('''
+        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND NOT i.indisvalid;
+    ''', (match.group(1).lower(),))
+    if cursor.fetchone():
+        print(f"Dropping invalid index {match.group(1)} left by an interrupted build.")
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {match.group(1)};")
+
+
+def apply_migration(connection, migration, concurrently=True):
+    cursor = connection.cursor()
+    try:
+        if migration.concurrent and concurrently:
+            connection.autocommit = True
+            for statement in migration.statements:
+                drop_invalid_index(cursor, statement)
+                cursor.execute(statement)
+            connection.autocommit = False
+        else:
+            for statement in migration.statements:
+                cursor.execute(statement.replace("INDEX CONCURRENTLY", "INDEX"))
+        cursor.execute("INSERT INTO schema_migrations (version, description) VALUES (%s, %s);",
+                       (migration.version, migration.description))
         connection.commit()
-        print("Table 'tableExperts' created successfully or already exists.")
+    except Exception:
+        connection.rollback()
+        connection.autocommit = False
+        raise
+    finally:
+        cursor.close()
 
 
+def migrate(target=None, concurrently=True):
+    connection = psycopg2.connect(**db_config)
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT pg_advisory_lock(%s);", (MIGRATION_LOCK_ID,))
+        done = applied_versions(cursor)
+        connection.commit()
+        for migration in MIGRATIONS:
+            if migration.version in done or (target is not None and migration.version > target):
+                continue
+            print(f"Applying migration {migration.version}: {migration.description} ...")
+            apply_migration(connection, migration, concurrently)
+            print(f"Migration {migration.version} applied.")
+        print("Database schema is up to date." if target is None else f"Database schema is at version {target}.")
     except (Exception, psycopg2.DatabaseError) as error:
-        print(f"Error while creating the table: {error}")
+        print(f"Error while migrating the database: {error}")
+        raise
+    finally:
+        connection.close()
 
+
+def migration_status():
+    connection = psycopg2.connect(**db_config)
+    try:
+        done = applied_versions(connection.cursor())
+        connection.commit()
+    finally:
+        connection.close()
+    for migration in MIGRATIONS:
+        print(f"{'applied' if migration.version in done else 'pending':8} {migration.version:3}  {migration.description}")
+
+
+# Rollup rows that differ from a fresh aggregate; metrics that are 0 on one side may be
+# missing on the other (the triggers never delete a row that went back to 0).
+CHAPTER_STATS_DIFF = '''
+    SELECT COALESCE(s.chapterID, f.chapterID), COALESCE(s.metric, f.metric),
+           COALESCE(s.value, 0), COALESCE(f.value, 0)
+    FROM (SELECT * FROM tableChapterStats WHERE value <> 0) AS s
+    FULL JOIN viewChapterStatsFresh AS f ON f.chapterID = s.chapterID AND f.metric = s.metric
+    WHERE COALESCE(s.value, 0) <> COALESCE(f.value, 0)
+    ORDER BY 1, 2;
+'''
+
+
+def rebuild_chapter_stats():
+    connection = psycopg2.connect(**db_config)
+    try:
+        cursor = connection.cursor()
+        # SHARE blocks writers (and so the rollup triggers) but not readers while rebuilding
+        cursor.execute("LOCK TABLE tableExperts, tableHelpitems, tableChapters IN SHARE MODE;")
+        cursor.execute("DELETE FROM tableChapterStats;")
+        cursor.execute("INSERT INTO tableChapterStats (chapterID, metric, value) SELECT * FROM viewChapterStatsFresh;")
+        print(f"Rebuilt chapter stats: {cursor.rowcount} rows.")
+        connection.commit()
     finally:
-        # Close the cursor and the connection
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
+        connection.close()
+
+
+def check_chapter_stats(limit=20):
+    connection = psycopg2.connect(**db_config)
+    try:
+        cursor = connection.cursor()
+        # one snapshot for both sides, so concurrent writes cannot show up as drift
+        connection.set_session(isolation_level='REPEATABLE READ', readonly=True)
+        cursor.execute(CHAPTER_STATS_DIFF)
+        rows = cursor.fetchall()
+        connection.commit()
+    finally:
+        connection.close()
+    for chapter_id, metric, rollup, fresh in rows[:limit]:
+        print(f"chapter {chapter_id} {metric}: rollup {rollup}, fresh {fresh}")
+    if len(rows) > limit:
+        print(f"... and {len(rows) - limit} more")
+    print("Chapter stats are consistent." if not rows else f"{len(rows)} chapter stats differ, run --rebuild-stats.")
+    return not rows
+
+
+def create_table():
+    migrate()
+
 
 if __name__ == "__main__":
-    create_table()
+    parser = argparse.ArgumentParser(description="Create or migrate the help database schema.")
+    parser.add_argument("--status", action="store_true", help="list migrations and whether they are applied")
+    parser.add_argument("--target", type=int, help="migrate up to this version only")
+    parser.add_argument("--no-concurrently", action="store_true",
+                        help="build indexes inside the migration transaction (faster on an empty database)")
+    parser.add_argument("--rebuild-stats", action="store_true",
+                        help="recompute tableChapterStats from the expert, helpitem and chapter tables")
+    parser.add_argument("--check-stats", action="store_true",
+                        help="compare tableChapterStats with a fresh aggregate; exit 1 when they differ")
+    args = parser.parse_args()
+    if args.status:
+        migration_status()
+    elif args.rebuild_stats:
+        rebuild_chapter_stats()
+    elif args.check_stats:
+        if not check_chapter_stats():
+            raise SystemExit(1)
+    else:
+        try:
+            migrate(target=args.target, concurrently=not args.no_concurrently)
+        except Exception:
+            raise SystemExit(1)
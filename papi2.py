@@ -1,108 +1,1900 @@
+import asyncio
 import asyncpg
-from fastapi import FastAPI, Form, File, UploadFile, Request
-from pydantic import EmailStr
-from typing import Optional
+from contextlib import asynccontextmanager
+from fastapi import APIRouter, FastAPI, Form, File, UploadFile, Request, Query, HTTPException
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, ValidationError
+from typing import Literal, Optional
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pathlib import Path
-from datetime import datetime
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from decimal import Decimal
 from dotenv import load_dotenv
 import os
-import psycopg2
-from psycopg2 import sql
+import argparse
+import base64
+import bisect
+import hashlib
+import json
+import logging
+import threading
+import orjson
+import re
+import shutil
+import time
+import uuid
+from collections import OrderedDict, deque
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.requests import ClientDisconnect
+from urllib.parse import urlsplit, urlunsplit
 
 from termcolor import colored
 
+import DBbulk
 
+# Importing papi2 has no side effects: configuration is read from the environment,
+# and logging, database pools and background tasks are set up in the lifespan of the
+# app that create_app() builds. The .env file is loaded by main() (or by
+# `uvicorn --env-file .env papi2:create_app --factory`), before this module is imported.
 
 
-print('=== papi2 backend v0.02 =======================================================')
-# Load environment variables from .env file
-load_dotenv()
+# Rows go to the client as asyncpg Records. orjson has no encoder for them, so
+# json_default gives it each record as a dict when it gets there: one short-lived dict
+# at a time instead of dict copies of the whole result up front, and no jsonable_encoder
+# pass. NUMERIC columns (price, ranking, budget) come back as Decimal and are sent as
+# strings, which keep every digit; a float would round them.
+def json_default(obj):
+    if isinstance(obj, asyncpg.Record):
+        return dict(obj)
+    if isinstance(obj, Decimal):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
 
 
-app = FastAPI()
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+class RecordJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        with request_phase("serialize"):
+            return orjson.dumps(content, default=json_default)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    token = app_state.set(app.state)
+    configure_logging()
+    app.state.log_handler = start_file_logging()
+    print_status("HELPthing backend v0.02 started", "info")
+    print_status(f"Database {redact_dsn(DATABASE_URL)}", "info")
+    app.state.db_pool = await create_db_pool()
+    app.state.chapter_tree = ChapterTree()
+    async with app.state.db_pool.acquire() as conn:
+        await app.state.chapter_tree.load(conn)
+    app.state.read_cache = ReadCache()
+    app.state.versions = VersionMap()
+    app.state.single_flight = SingleFlight()
+    app.state.admission = Admission()
+    app.state.replicas = ReplicaSet(DATABASE_READ_URLS, app.state.db_pool, app.state.versions)
+    await app.state.replicas.start()
+    app.state.events = EventHub()
+    app.state.change_listener = ChangeListener(DATABASE_URL, app.state)
+    await app.state.change_listener.start()
+    app.state.vote_buffer = VoteBuffer(app.state.db_pool)
+    await app.state.vote_buffer.start()
+    app.state.upload_workers = UploadWorkers(app.state.db_pool, make_upload_host())
+    await app.state.upload_workers.start()
+    try:
+        yield
+    finally:
+        await app.state.upload_workers.stop()
+        await app.state.vote_buffer.stop()
+        await app.state.change_listener.stop()
+        await app.state.replicas.stop()
+        await close_db_pool(app.state.db_pool)
+        stop_file_logging(app.state.log_handler)
+        app_state.reset(token)
+
+
+# Endpoints register on the router; create_app() includes it. Handlers and the helpers
+# below reach the pools and caches of their own application through app_state, which
+# MetricsMiddleware sets from the ASGI scope for each request and lifespan for the
+# background tasks it starts.
+router = APIRouter()
+app_state = ContextVar("app_state")
+
+# Console logging. Startup and background messages go through print_status; the
+# per-request messages are logger.debug() with lazy %-args, so below LOG_LEVEL=DEBUG
+# they cost one level check and no formatting or terminal I/O.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+STATUS_LEVELS = {'success': logging.INFO, 'info': logging.INFO, 'error': logging.ERROR}
+
+logger = logging.getLogger("papi2")
+
+
+class StatusFormatter(logging.Formatter):
+    status_colors = {'success': 'green', 'error': 'red', 'info': 'blue'}
+    level_colors = {logging.DEBUG: 'white', logging.INFO: 'blue', logging.WARNING: 'yellow', logging.ERROR: 'red'}
+
+    def format(self, record):
+        color = self.status_colors.get(getattr(record, "status_type", None)) or self.level_colors.get(record.levelno)
+        return colored(super().format(record), color or 'white')
+
+
+console_handler = None
+
+
+def configure_logging():
+    global console_handler
+    if console_handler is None:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(StatusFormatter())
+        logger.addHandler(console_handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
 
-# add initital logging info
-LOG_FILE = '/var/log/helpthing.log'
-with open(LOG_FILE, 'a') as f:
-    f.write(f'{datetime.now()} - HELPthing backend v0.01 started\n')
 
 def print_status(message: str, status_type: str):
-    colors = {'success': 'green', 'error': 'red', 'info': 'blue'}
-    print(colored(message, colors.get(status_type, 'white')))
-
-def execute_query(query: str, params: tuple):
-    db_config = {
-        'dbname': 'help',
-        'user': 'helpthing',
-        'password': os.getenv('DB_PASSWORD'),
-        'host': os.getenv('DB_HOST'),
-        'port': 5432
+    logger.log(STATUS_LEVELS.get(status_type, logging.INFO), message, extra={"status_type": status_type})
+
+
+# Structured log file. Records are turned into small tuples and put on a bounded queue;
+# a writer thread encodes them as JSON lines and writes them in batches (LOG_BATCH_SIZE
+# records or LOG_FLUSH_INTERVAL seconds, whichever comes first), rotating the file at
+# LOG_MAX_BYTES. When the queue is full records are dropped and counted, never waited on.
+LOG_FILE = os.getenv("LOG_FILE", "/var/log/helpthing.log")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "500"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "1.0"))
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_ACCESS = os.getenv("LOG_ACCESS", "true").lower() in ("1", "true", "yes")
+
+# one record per request (method, route, status, timings), only to the log file
+access_logger = logging.getLogger("papi2.access")
+access_logger.propagate = False
+
+class BatchedJSONLogHandler(logging.Handler):
+    def __init__(self, path: str, queue_size: int = LOG_QUEUE_SIZE, batch_size: int = LOG_BATCH_SIZE,
+                 flush_interval: float = LOG_FLUSH_INTERVAL, max_bytes: int = LOG_MAX_BYTES,
+                 backup_count: int = LOG_BACKUP_COUNT):
+        super().__init__()
+        self.path = path
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.records = deque()  # append/popleft are thread-safe, no lock on the emit path
+        self.wake_at = max(1, min(batch_size, queue_size // 2))  # wake the writer early past this backlog
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.stream = None
+        self.thread = None
+        self.enqueued = self.dropped = self.written = self.batches = self.rotations = self.write_errors = 0
+
+    def start(self):
+        self.stream = open(self.path, "ab")
+        self.thread = threading.Thread(target=self._run, name="papi2-log-writer", daemon=True)
+        self.thread.start()
+
+    def handle(self, record):
+        # logging.Handler.handle() would take the handler lock around emit(); not needed here
+        if self.filter(record):
+            self.emit(record)
+        return True
+
+    def emit(self, record):
+        # runs on the caller's thread (usually the event loop): no encoding, no I/O
+        if len(self.records) >= self.queue_size:
+            self.dropped += 1
+            return
+        exc = self.formatException(record.exc_info) if record.exc_info else None
+        self.records.append((record.created, record.levelname, record.name, record.getMessage(),
+                             getattr(record, "fields", None), exc))
+        self.enqueued += 1
+        if len(self.records) >= self.wake_at and not self.wakeup.is_set():
+            self.wakeup.set()
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            stopping = self.stopping
+            while self.records:
+                count = min(self.batch_size, len(self.records))
+                self._write([self.records.popleft() for _ in range(count)])
+            if stopping:
+                return
+
+    def _write(self, batch: list):
+        lines = []
+        for created, level, name, message, fields, exc in batch:
+            entry = {"ts": datetime.fromtimestamp(created, timezone.utc).isoformat(), "level": level,
+                     "logger": name, "message": message}
+            if fields:
+                entry.update(fields)
+            if exc:
+                entry["exc"] = exc
+            lines.append(orjson.dumps(entry, default=str, option=orjson.OPT_APPEND_NEWLINE))
+        try:
+            self.stream.write(b"".join(lines))
+            self.stream.flush()
+            self.written += len(batch)
+            self.batches += 1
+            if self.max_bytes and self.stream.tell() >= self.max_bytes:
+                self._rotate()
+        except OSError:
+            self.write_errors += 1
+
+    def _rotate(self):
+        self.stream.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.stream = open(self.path, "ab")
+        self.rotations += 1
+
+    def close(self):
+        # drain what is queued, then stop the writer
+        if self.thread is not None and self.thread.is_alive():
+            self.stopping = True
+            self.wakeup.set()
+            self.thread.join(timeout=5)
+        if self.stream is not None:
+            self.stream.close()
+        super().close()
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self.records),
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "written": self.written,
+            "batches": self.batches,
+            "rotations": self.rotations,
+            "write_errors": self.write_errors,
+        }
+
+
+def start_file_logging():
+    handler = BatchedJSONLogHandler(LOG_FILE)
+    try:
+        handler.start()
+    except OSError as e:
+        print_status(f"Not logging to {LOG_FILE}: {str(e)}", "error")
+        return None
+    logger.addHandler(handler)
+    access_logger.addHandler(handler)
+    access_logger.setLevel(logging.INFO if LOG_ACCESS else logging.CRITICAL + 1)
+    return handler
+
+
+def stop_file_logging(handler):
+    if handler is None:
+        return
+    logger.removeHandler(handler)
+    access_logger.removeHandler(handler)
+    handler.close()
+
+
+# Database connection settings
+DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://user:pw@localhost/papi2")
+
+
+def redact_dsn(dsn: str) -> str:
+    parts = urlsplit(dsn)
+    if parts.password is None:
+        return dsn
+    return urlunsplit(parts._replace(netloc=parts.netloc.replace(f":{parts.password}@", ":***@", 1)))
+
+# Pool settings, all overridable from the environment / .env
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "5"))
+DB_POOL_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_POOL_MAX_INACTIVE_LIFETIME", "300"))
+DB_POOL_CLOSE_TIMEOUT = float(os.getenv("DB_POOL_CLOSE_TIMEOUT", "10"))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "30"))
+
+# Read replicas: DATABASE_READ_URL is a comma-separated list of standby DSNs, each with
+# its own pool. The GET endpoints for experts and chapters read from a healthy replica;
+# everything else, and every read that has to see a recent write, uses DATABASE_URL.
+DATABASE_READ_URLS = [url.strip() for url in os.getenv("DATABASE_READ_URL", "").split(",") if url.strip()]
+DB_READ_POOL_MIN_SIZE = int(os.getenv("DB_READ_POOL_MIN_SIZE", str(DB_POOL_MIN_SIZE)))
+DB_READ_POOL_MAX_SIZE = int(os.getenv("DB_READ_POOL_MAX_SIZE", str(DB_POOL_MAX_SIZE)))
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", "2"))  # seconds of replay lag before a replica is skipped
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", "1"))
+REPLICA_CHECK_TIMEOUT = float(os.getenv("REPLICA_CHECK_TIMEOUT", "1"))
+# after a successful write the client gets a cookie that sends its reads to the primary
+READ_YOUR_WRITES_WINDOW = float(os.getenv("READ_YOUR_WRITES_WINDOW", "5"))
+READ_YOUR_WRITES_COOKIE = "papi2_rw"
+
+# Per-connection hooks. init hooks run once when the pool opens a new connection,
+# setup hooks run every time a connection is handed out by acquire().
+db_init_hooks = []
+db_setup_hooks = []
+
+
+def on_db_connect(hook):
+    db_init_hooks.append(hook)
+    return hook
+
+
+def on_db_acquire(hook):
+    db_setup_hooks.append(hook)
+    return hook
+
+
+async def _run_init_hooks(conn):
+    for hook in db_init_hooks:
+        await hook(conn)
+
+
+async def _run_setup_hooks(conn):
+    for hook in db_setup_hooks:
+        await hook(conn)
+
+
+class PoolAcquireTimeout(Exception):
+    pass
+
+
+# number of requests currently waiting in acquire(), per pool
+db_pool_waiters = {}
+
+
+async def create_db_pool(dsn: str = DATABASE_URL, min_size: int = DB_POOL_MIN_SIZE,
+                         max_size: int = DB_POOL_MAX_SIZE, name: str = "DB pool"):
+    pool = await asyncpg.create_pool(
+        dsn,
+        min_size=min_size,
+        max_size=max_size,
+        max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE_LIFETIME,
+        command_timeout=DB_COMMAND_TIMEOUT,
+        server_settings={'application_name': 'papi2'},
+        init=_run_init_hooks,
+        setup=_run_setup_hooks,
+        connection_class=TimedConnection,
+    )
+    print_status(f"{name} ready (min {min_size}, max {max_size})", "info")
+    return pool
+
+
+async def close_db_pool(pool):
+    # let in-flight requests hand their connections back, then force the rest closed
+    try:
+        await asyncio.wait_for(pool.close(), timeout=DB_POOL_CLOSE_TIMEOUT)
+    except asyncio.TimeoutError:
+        print_status("DB pool did not drain in time, terminating connections", "error")
+        pool.terminate()
+
+
+def db_pool_stats(pool) -> dict:
+    size = pool.get_size()
+    idle = pool.get_idle_size()
+    return {
+        "min_size": pool.get_min_size(),
+        "max_size": pool.get_max_size(),
+        "size": size,
+        "in_use": size - idle,
+        "idle": idle,
+        "waiters": db_pool_waiters.get(pool, 0),
     }
 
-    connection = psycopg2.connect(**db_config)
-    cursor = connection.cursor()
+
+############################# Database Operations
+
+
+############################################### EXPERT
+async def acquire_db_connection(pool):
+    db_pool_waiters[pool] = db_pool_waiters.get(pool, 0) + 1
+    try:
+        with request_phase("pool_acquire"):
+            return await pool.acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        note_error("PoolAcquireTimeout")
+        raise PoolAcquireTimeout(f"no database connection available within {DB_POOL_ACQUIRE_TIMEOUT}s")
+    finally:
+        db_pool_waiters[pool] -= 1
+
+
+# Borrow a connection from the shared (primary) pool, returned automatically on exit
+@asynccontextmanager
+async def get_db_connection():
+    pool = app_state.get().db_pool
+    conn = await acquire_db_connection(pool)
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
+
+
+# Borrow a connection for a read of the given scopes (version scopes, see VersionMap):
+# from a healthy replica when one is allowed, otherwise from the primary. A replica that
+# cannot hand out a connection is marked down and the read goes to the primary.
+@asynccontextmanager
+async def get_read_connection(*scopes: str):
+    replica = app_state.get().replicas.choose(scopes)
+    conn = None
+    if replica is not None:
+        try:
+            conn = await acquire_db_connection(replica.pool)
+        except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+            replica.mark_down(e)
+            note_error("ReplicaUnavailable")
+            app_state.get().replicas.primary_reads += 1
+    if conn is None:
+        async with get_db_connection() as conn:
+            yield conn
+        return
+    replica.reads += 1
+    try:
+        yield conn
+    finally:
+        await replica.pool.release(conn)
+
+
+async def pool_acquire_timeout_handler(request: Request, exc: PoolAcquireTimeout):
+    return RecordJSONResponse(status_code=503, content={"status": "error", "message": str(exc)},
+                              headers={"Retry-After": "1"})
+
+
+# /v1/pool/stats - GET request for connection pool usage of this worker
+@router.get("/v1/pool/stats")
+async def pool_stats():
+    state = app_state.get()
+    stats = db_pool_stats(state.db_pool)
+    stats["replicas"] = state.replicas.stats()
+    return RecordJSONResponse(content=stats)
+
+
+############################# Read replicas
+# Each replica is checked every REPLICA_CHECK_INTERVAL seconds: it has to be a standby
+# and must have replayed the primary's WAL position from the start of the check, or
+# have replayed its last transaction at most REPLICA_MAX_LAG seconds ago. Replicas that
+# fail the check (or cannot be reached) get no reads until they pass again.
+#
+# Reads avoid the replicas when
+#   - the request carries the read-your-writes cookie (the client wrote recently), or
+#   - this worker saw the scope change within the last REPLICA_MAX_LAG +
+#     REPLICA_CHECK_INTERVAL seconds, so the read cache and ETags are never filled
+#     from a replica that has not replayed the change yet.
+read_from_primary = ContextVar("read_from_primary", default=False)
+
+
+class Replica:
+    def __init__(self, index: int, dsn: str):
+        self.index = index
+        self.dsn = dsn
+        self.pool = None
+        self.healthy = False
+        self.lag = None
+        self.error = None
+        self.reads = self.checks = self.failures = 0
+
+    def mark_down(self, error):
+        if self.healthy:
+            print_status(f"Replica {self.index} down: {error}", "error")
+        self.healthy = False
+        self.error = str(error)
+
+    async def check(self, primary_lsn: int):
+        self.checks += 1
+        try:
+            if self.pool is None:
+                self.pool = await create_db_pool(self.dsn, DB_READ_POOL_MIN_SIZE, DB_READ_POOL_MAX_SIZE,
+                                                 f"Replica {self.index} pool")
+            async with self.pool.acquire(timeout=REPLICA_CHECK_TIMEOUT) as conn:
+                row = await conn.fetchrow("""
+                    SELECT pg_is_in_recovery() AS standby,
+                           pg_last_wal_replay_lsn() >= $1::pg_lsn AS caught_up,
+                           EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())::float8 AS replay_age
+                """, primary_lsn, timeout=REPLICA_CHECK_TIMEOUT)
+        except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+            self.failures += 1
+            self.lag = None
+            return self.mark_down(e)
+        if not row["standby"]:
+            self.lag = None
+            return self.mark_down("not a standby (pg_is_in_recovery() is false)")
+        # an idle primary writes nothing, so the replay timestamp only counts while behind
+        self.lag = 0.0 if row["caught_up"] else row["replay_age"]
+        if self.lag is None or self.lag > REPLICA_MAX_LAG:
+            return self.mark_down(f"replication lag {self.lag}s")
+        if not self.healthy:
+            print_status(f"Replica {self.index} healthy (lag {self.lag:.3f}s)", "success")
+        self.healthy = True
+        self.error = None
+
+    def stats(self) -> dict:
+        stats = {"replica": self.index, "healthy": self.healthy, "lag_seconds": self.lag, "error": self.error,
+                 "reads": self.reads, "checks": self.checks, "check_failures": self.failures}
+        if self.pool is not None:
+            stats["pool"] = db_pool_stats(self.pool)
+        return stats
+
+
+class ReplicaSet:
+    def __init__(self, dsns: list, primary_pool, versions):
+        self.replicas = [Replica(index, dsn) for index, dsn in enumerate(dsns)]
+        self.primary_pool = primary_pool
+        self.versions = versions
+        self.next = 0
+        self.primary_reads = 0
+        self.task = None
+
+    async def start(self):
+        if not self.replicas:
+            return
+        if READ_YOUR_WRITES_WINDOW < REPLICA_MAX_LAG + REPLICA_CHECK_INTERVAL:
+            print_status("READ_YOUR_WRITES_WINDOW is shorter than REPLICA_MAX_LAG + REPLICA_CHECK_INTERVAL; "
+                         "clients may not see their own writes", "error")
+        await self.check()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        for replica in self.replicas:
+            if replica.pool is not None:
+                await close_db_pool(replica.pool)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(REPLICA_CHECK_INTERVAL)
+            try:
+                await self.check()
+            except Exception as e:
+                print_status(f"Replica check failed: {str(e)}", "error")
+
+    async def check(self):
+        try:
+            async with self.primary_pool.acquire(timeout=REPLICA_CHECK_TIMEOUT) as conn:
+                primary_lsn = await conn.fetchval("SELECT pg_current_wal_lsn()", timeout=REPLICA_CHECK_TIMEOUT)
+        except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+            # without the primary's position the lag cannot be judged
+            for replica in self.replicas:
+                replica.mark_down(f"primary unreachable: {e}")
+            return
+        await asyncio.gather(*(replica.check(primary_lsn) for replica in self.replicas))
+
+    def choose(self, scopes) -> Optional[Replica]:
+        if not self.replicas:
+            return None
+        window = REPLICA_MAX_LAG + REPLICA_CHECK_INTERVAL
+        if read_from_primary.get() or any(self.versions.changed_within(scope, window) for scope in scopes):
+            self.primary_reads += 1
+            return None
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[self.next % len(self.replicas)]
+            self.next += 1
+            if replica.healthy:
+                return replica
+        self.primary_reads += 1
+        return None
+
+    def stats(self) -> list:
+        return [replica.stats() for replica in self.replicas]
+
+
+# Pure ASGI like MetricsMiddleware, so read_from_primary is visible to the handler and
+# to a streaming body. Mutations that succeed set the read-your-writes cookie; it holds
+# its expiry time as well, for clients that ignore Max-Age.
+class ReadRoutingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not DATABASE_READ_URLS:
+            return await self.app(scope, receive, send)
+        if scope["method"] in ("GET", "HEAD"):
+            token = read_from_primary.set(self.wrote_recently(scope))
+            try:
+                return await self.app(scope, receive, send)
+            finally:
+                read_from_primary.reset(token)
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                cookie = (f"{READ_YOUR_WRITES_COOKIE}={time.time() + READ_YOUR_WRITES_WINDOW:.3f}; "
+                          f"Max-Age={int(READ_YOUR_WRITES_WINDOW + 0.999)}; Path=/; HttpOnly; SameSite=Lax")
+                message["headers"] = list(message.get("headers", [])) + [(b"set-cookie", cookie.encode())]
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
+
+    @staticmethod
+    def wrote_recently(scope) -> bool:
+        for name, value in scope["headers"]:
+            if name != b"cookie":
+                continue
+            for cookie in value.decode("latin-1").split(";"):
+                key, _, until = cookie.strip().partition("=")
+                if key == READ_YOUR_WRITES_COOKIE:
+                    try:
+                        return float(until) > time.time()
+                    except ValueError:
+                        return False
+        return False
+
+
+############################# Metrics
+# Per-route latency histograms, with the time of each request split into waiting for
+# a pool connection, running SQL and encoding the response, plus in-flight gauges and
+# error counts by type. Exposed in Prometheus text format on /metrics (per worker).
+METRIC_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+REQUEST_PHASES = ("pool_acquire", "db", "serialize")
+
+
+class RequestTimings:
+    __slots__ = ("phases", "errors")
+
+    def __init__(self):
+        self.phases = dict.fromkeys(REQUEST_PHASES, 0.0)
+        self.errors = []
+
+
+# timings of the request being handled; the middleware sets it, the phases add to it
+current_timings = ContextVar("current_timings", default=None)
+
+
+@contextmanager
+def request_phase(phase: str):
+    timings = current_timings.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings.phases[phase] += time.perf_counter() - start
+
+
+def note_error(error_type: str):
+    timings = current_timings.get()
+    if timings is not None:
+        timings.errors.append(error_type)
+
+
+# Pool connections time every query into the current request's "db" phase and note
+# the asyncpg error class, even when the handler turns the error into a 200 response.
+# Queries also get the statement timeout of the request's route class (see Admission
+# control) unless the caller passes its own; asyncpg cancels a query that runs over.
+class TimedConnection(asyncpg.Connection):
+    async def _timed(self, call):
+        timings = current_timings.get()
+        if timings is None:
+            return await call
+        start = time.perf_counter()
+        try:
+            return await call
+        except asyncio.TimeoutError:
+            timings.errors.append("StatementTimeout")
+            raise StatementTimeout("query cancelled, it ran longer than this endpoint allows") from None
+        except Exception as e:
+            timings.errors.append(type(e).__name__)
+            raise
+        finally:
+            timings.phases["db"] += time.perf_counter() - start
+
+    @staticmethod
+    def _timeout(kwargs: dict) -> dict:
+        timeout = statement_timeout.get()
+        if timeout is not None and kwargs.get("timeout") is None:
+            kwargs["timeout"] = timeout
+        return kwargs
+
+    def execute(self, *args, **kwargs):
+        return self._timed(super().execute(*args, **self._timeout(kwargs)))
+
+    def executemany(self, *args, **kwargs):
+        return self._timed(super().executemany(*args, **self._timeout(kwargs)))
+
+    def fetch(self, *args, **kwargs):
+        return self._timed(super().fetch(*args, **self._timeout(kwargs)))
+
+    def fetchrow(self, *args, **kwargs):
+        return self._timed(super().fetchrow(*args, **self._timeout(kwargs)))
+
+    def fetchval(self, *args, **kwargs):
+        return self._timed(super().fetchval(*args, **self._timeout(kwargs)))
+
+    def copy_records_to_table(self, *args, **kwargs):
+        return self._timed(super().copy_records_to_table(*args, **self._timeout(kwargs)))
+
+    def fetch_cursor(self, cursor, n: int):
+        # a cursor's fetch is a Cursor method, it would bypass the ones above
+        return self._timed(cursor.fetch(n, **self._timeout({})))
+
+    def is_prepared(self, sql: str) -> bool:
+        # asks asyncpg's statement cache without promoting the entry; the key is the one
+        # asyncpg builds for a plain execute/fetch (default record class, codecs on)
+        return self._stmt_cache.has((sql, self._protocol.get_record_class(), False))
+
+
+class Histogram:
+    def __init__(self, buckets=METRIC_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name: str, labels: str) -> list:
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class Metrics:
+    def __init__(self):
+        self.durations = {}   # (route, method) -> Histogram
+        self.phases = {}      # (route, phase) -> Histogram
+        self.requests = {}    # (route, method, status) -> count
+        self.errors = {}      # (route, error type) -> count
+        self.in_flight = {}   # route -> gauge
+        self.route_paths = None
+
+    def route_label(self, scope) -> str:
+        # label by route template, never by raw path, so unknown URLs cannot grow the series
+        route = scope.get("route")
+        if route is not None:
+            return route.path
+        if self.route_paths is None:
+            self.route_paths = {route.path for route in router.routes}
+        return scope["path"] if scope["path"] in self.route_paths else "unmatched"
+
+    def observe(self, route: str, method: str, status: int, elapsed: float, timings: RequestTimings):
+        self.durations.setdefault((route, method), Histogram()).observe(elapsed)
+        for phase, seconds in timings.phases.items():
+            self.phases.setdefault((route, phase), Histogram()).observe(seconds)
+        key = (route, method, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        errors = timings.errors or ([f"http_{status}"] if status >= 400 else [])
+        for error_type in errors:
+            self.errors[(route, error_type)] = self.errors.get((route, error_type), 0) + 1
+
+    def render(self, state) -> str:
+        lines = ["# TYPE papi2_request_duration_seconds histogram"]
+        for (route, method), histogram in sorted(self.durations.items()):
+            lines += histogram.lines("papi2_request_duration_seconds", f'route="{route}",method="{method}"')
+        lines.append("# TYPE papi2_request_phase_seconds histogram")
+        for (route, phase), histogram in sorted(self.phases.items()):
+            lines += histogram.lines("papi2_request_phase_seconds", f'route="{route}",phase="{phase}"')
+        lines.append("# TYPE papi2_requests_total counter")
+        for (route, method, status), count in sorted(self.requests.items()):
+            lines.append(f'papi2_requests_total{{route="{route}",method="{method}",status="{status}"}} {count}')
+        lines.append("# TYPE papi2_errors_total counter")
+        for (route, error_type), count in sorted(self.errors.items()):
+            lines.append(f'papi2_errors_total{{route="{route}",type="{error_type}"}} {count}')
+        lines.append("# TYPE papi2_requests_in_flight gauge")
+        for route, count in sorted(self.in_flight.items()):
+            lines.append(f'papi2_requests_in_flight{{route="{route}"}} {count}')
+        log_handler = getattr(state, "log_handler", None)
+        if log_handler is not None:
+            for name, value in log_handler.stats().items():
+                kind = "gauge" if name == "queued" else "counter"
+                suffix = "" if kind == "gauge" else "_total"
+                lines.append(f"# TYPE papi2_log_{name}{suffix} {kind}")
+                lines.append(f"papi2_log_{name}{suffix} {value}")
+        pool = getattr(state, "db_pool", None)
+        if pool is not None:
+            for name, value in db_pool_stats(pool).items():
+                lines.append(f"# TYPE papi2_db_pool_{name} gauge")
+                lines.append(f"papi2_db_pool_{name} {value}")
+        single_flight = getattr(state, "single_flight", None)
+        if single_flight is not None:
+            lines.append("# TYPE papi2_coalesce_requests_total counter")
+            lines.append(f'papi2_coalesce_requests_total{{role="leader"}} {single_flight.leaders}')
+            lines.append(f'papi2_coalesce_requests_total{{role="follower"}} {single_flight.followers}')
+            lines.append("# TYPE papi2_coalesce_in_flight gauge")
+            lines.append(f"papi2_coalesce_in_flight {len(single_flight.flights)}")
+            lines.append("# TYPE papi2_coalesce_errors_total counter")
+            lines.append(f"papi2_coalesce_errors_total {single_flight.errors}")
+        events = getattr(state, "events", None)
+        if events is not None:
+            for name, value in events.stats().items():
+                if name in ("subscribers", "chapters", "replay_size"):
+                    lines.append(f"# TYPE papi2_events_{name} gauge")
+                    lines.append(f"papi2_events_{name} {value}")
+                elif name != "epoch":
+                    lines.append(f"# TYPE papi2_events_{name}_total counter")
+                    lines.append(f"papi2_events_{name}_total {value}")
+        admission = getattr(state, "admission", None)
+        if admission is not None:
+            limits = sorted(admission.limits.values(), key=lambda limit: limit.name)
+            lines.append("# TYPE papi2_admission_active gauge")
+            lines += [f'papi2_admission_active{{limit="{limit.name}"}} {limit.active}' for limit in limits]
+            lines.append("# TYPE papi2_admission_queued gauge")
+            lines += [f'papi2_admission_queued{{limit="{limit.name}"}} {len(limit.waiters)}' for limit in limits]
+            lines.append("# TYPE papi2_admission_admitted_total counter")
+            lines += [f'papi2_admission_admitted_total{{limit="{limit.name}"}} {limit.admitted}' for limit in limits]
+            lines.append("# TYPE papi2_admission_rejected_total counter")
+            for limit in limits:
+                lines.append(f'papi2_admission_rejected_total{{limit="{limit.name}",reason="queue_full"}} '
+                             f'{limit.rejected_full}')
+                lines.append(f'papi2_admission_rejected_total{{limit="{limit.name}",reason="queue_timeout"}} '
+                             f'{limit.rejected_timeout}')
+            lines.append("# TYPE papi2_client_disconnects_total counter")
+            lines.append(f"papi2_client_disconnects_total {admission.cancelled}")
+        replicas = getattr(state, "replicas", None)
+        if replicas is not None and replicas.replicas:
+            lines.append("# TYPE papi2_db_replica_healthy gauge")
+            lines += [f'papi2_db_replica_healthy{{replica="{r.index}"}} {int(r.healthy)}' for r in replicas.replicas]
+            lines.append("# TYPE papi2_db_replica_lag_seconds gauge")
+            lines += [f'papi2_db_replica_lag_seconds{{replica="{r.index}"}} {r.lag if r.lag is not None else "NaN"}'
+                      for r in replicas.replicas]
+            lines.append("# TYPE papi2_db_replica_reads_total counter")
+            lines += [f'papi2_db_replica_reads_total{{replica="{r.index}"}} {r.reads}' for r in replicas.replicas]
+            lines.append("# TYPE papi2_db_primary_reads_total counter")
+            lines.append(f"papi2_db_primary_reads_total {replicas.primary_reads}")
+        return "\n".join(lines) + "\n"
+
+
+
+# Plain ASGI middleware (not BaseHTTPMiddleware) so the handler, its DB calls and a
+# streaming body all run in the context that carries current_timings.
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        state = scope["app"].state
+        token = app_state.set(state)
+        try:
+            if scope["type"] != "http":
+                return await self.app(scope, receive, send)
+            await self.call_http(state.metrics, scope, receive, send)
+        finally:
+            app_state.reset(token)
+
+    async def call_http(self, metrics: Metrics, scope, receive, send):
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        route = metrics.route_label(scope)
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        metrics.in_flight[route] = metrics.in_flight.get(route, 0) + 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception as e:
+            timings.errors.append(type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.in_flight[route] -= 1
+            current_timings.reset(token)
+            route = metrics.route_label(scope)
+            metrics.observe(route, scope["method"], status, elapsed, timings)
+            if access_logger.isEnabledFor(logging.INFO):
+                access_logger.info("%s %s %s", scope["method"], scope["path"], status, extra={"fields": {
+                    "method": scope["method"], "path": scope["path"], "route": route, "status": status,
+                    "duration_ms": round(elapsed * 1000, 3),
+                    **{f"{phase}_ms": round(seconds * 1000, 3) for phase, seconds in timings.phases.items()},
+                    "errors": timings.errors,
+                }})
+
+
+# /metrics - GET request for Prometheus metrics of this worker
+@router.get("/metrics")
+async def metrics_endpoint(request: Request):
+    state = request.app.state
+    return Response(content=state.metrics.render(state), media_type="text/plain; version=0.0.4")
+
+
+############################# Admission control
+# Every route belongs to a class: "read" (GET/HEAD), "write" (other methods), "bulk"
+# (the bulk endpoints) or "upload". Each class, and each route given a limit of its own,
+# runs at most `limit` requests at a time; up to `queue` more wait, in arrival order, for
+# ADMISSION_QUEUE_TIMEOUT seconds. A full queue is answered at once with 429, a wait
+# that times out with 503, both with Retry-After, so a burst of bulk writes queues or
+# bounces on its own limit while reads keep their slots (and pool connections).
+#
+#   ADMISSION_LIMITS="read=200:400,write=50:100,bulk=2:4,/v1/experts/search=20:40"
+#   STATEMENT_TIMEOUTS="read=5,write=15,bulk=120,/v1/chapters/stats=10"
+#
+# Queries of a request are cancelled after its class' statement timeout; the request
+# of a client that disconnects is cancelled, which cancels its running query.
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+ROUTE_CLASSES = {
+    "/v1/experts/bulk": "bulk",
+    "/v1/chapters/bulk": "bulk",
+    "/v1/helpitems/upload": "upload",
+    "/v1/experts/events": "events",
+}
+# long-lived streams that run no queries notice a disconnect themselves; they skip the
+# cancel-on-disconnect wrapper and its two tasks per open connection
+ADMISSION_STREAMS = {"events"}
+# monitoring endpoints are never limited, so they answer while the API is saturated
+ADMISSION_EXEMPT = {"/metrics", "/v1/pool/stats", "/v1/cache/stats", "/v1/statements/stats", "/v1/votes/stats",
+                    "/v1/uploads/stats", "/v1/admission/stats", "/v1/events/stats", "unmatched"}
+
+
+def parse_route_settings(value: Optional[str], default: str) -> dict:
+    # the environment's entries override the defaults one by one
+    settings = {}
+    for item in f"{default},{value or ''}".split(","):
+        name, _, setting = item.strip().rpartition("=")
+        if name:
+            settings[name] = setting
+    return settings
+
+
+ADMISSION_LIMITS = {name: tuple(int(part) for part in setting.split(":"))
+                    for name, setting in parse_route_settings(
+                        os.getenv("ADMISSION_LIMITS"), "read=200:400,write=50:100,bulk=2:4,upload=8:0,events=10000:0").items()}
+STATEMENT_TIMEOUTS = {name: float(setting)
+                      for name, setting in parse_route_settings(
+                          os.getenv("STATEMENT_TIMEOUTS"), "read=5,write=15,bulk=120,upload=30").items()}
+
+# statement timeout of the request being handled, applied by TimedConnection
+statement_timeout = ContextVar("statement_timeout", default=None)
+
+
+class StatementTimeout(Exception):
+    pass
+
+
+# The errors a handler answers with a {"status": "error ..."} body. Everything else,
+# StatementTimeout (504) and PoolAcquireTimeout (503) included, goes on to its exception
+# handler or to a 500.
+DB_ERRORS = (OSError, asyncpg.PostgresError, asyncpg.InterfaceError)
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class AdmissionLimit:
+    def __init__(self, name: str, limit: int, queue: int, queue_timeout: float = ADMISSION_QUEUE_TIMEOUT):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiters = deque()  # futures of queued requests, oldest first
+        self.admitted = self.queued = self.rejected_full = self.rejected_timeout = 0
+        self.max_queue_wait = 0.0
+
+    async def acquire(self):
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+        if len(self.waiters) >= self.queue:
+            self.rejected_full += 1
+            raise AdmissionRejected(429, f"too many concurrent {self.name} requests")
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        self.queued += 1
+        start = time.perf_counter()
+        try:
+            # release() hands the slot over by resolving the future, active stays counted
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            if waiter.done():
+                self.release()  # the slot arrived as the request went away, pass it on
+            else:
+                waiter.cancel()
+                self.waiters.remove(waiter)
+            raise
+        except asyncio.TimeoutError:
+            if not waiter.done():
+                waiter.cancel()
+                self.waiters.remove(waiter)
+                self.rejected_timeout += 1
+                raise AdmissionRejected(503, f"{self.name} requests are queued for longer than {self.queue_timeout}s")
+        self.max_queue_wait = max(self.max_queue_wait, time.perf_counter() - start)
+        self.admitted += 1
+
+    def release(self):
+        if self.waiters:
+            self.waiters.popleft().set_result(None)
+        else:
+            self.active -= 1
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "queue": self.queue,
+            "active": self.active,
+            "queued_now": len(self.waiters),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected_queue_full": self.rejected_full,
+            "rejected_queue_timeout": self.rejected_timeout,
+            "max_queue_wait_ms": round(self.max_queue_wait * 1000, 3),
+        }
+
+
+class Admission:
+    def __init__(self, limits: dict = ADMISSION_LIMITS, timeouts: dict = STATEMENT_TIMEOUTS):
+        self.limits = {name: AdmissionLimit(name, limit, queue) for name, (limit, queue) in limits.items()}
+        self.timeouts = timeouts
+        self.cancelled = 0
+
+    @staticmethod
+    def route_class(route: str, method: str) -> Optional[str]:
+        if route in ADMISSION_EXEMPT:
+            return None
+        return ROUTE_CLASSES.get(route) or ("read" if method in ("GET", "HEAD") else "write")
+
+    def limit_for(self, route: str, method: str) -> tuple:
+        # (AdmissionLimit or None, statement timeout or None, cancel on disconnect);
+        # a route's own settings win over its class'
+        route_class = self.route_class(route, method)
+        if route_class is None:
+            return None, None, False
+        limit = self.limits.get(route) or self.limits.get(route_class)
+        return limit, self.timeouts.get(route, self.timeouts.get(route_class)), route_class not in ADMISSION_STREAMS
+
+    def stats(self) -> dict:
+        return {
+            "limits": {name: limit.stats() for name, limit in self.limits.items()},
+            "statement_timeouts": self.timeouts,
+            "client_disconnects": self.cancelled,
+        }
+
+
+def admission_rejected_response(exc: AdmissionRejected):
+    return RecordJSONResponse(status_code=exc.status_code, content={"status": "error", "message": str(exc)},
+                              headers={"Retry-After": str(ADMISSION_RETRY_AFTER)})
+
+
+async def statement_timeout_handler(request: Request, exc: StatementTimeout):
+    return RecordJSONResponse(status_code=504, content={"status": "error", "message": str(exc)})
+
+
+# Runs inside MetricsMiddleware, so rejections show in the metrics and the access log.
+# The handler runs in a task of its own while the request body is passed through to it
+# one message at a time; an http.disconnect before the response is complete cancels
+# that task (asyncpg then cancels the running query) and is counted as status 499.
+class AdmissionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        state = app_state.get()
+        admission = getattr(state, "admission", None) if scope["type"] == "http" else None
+        if admission is None:
+            return await self.app(scope, receive, send)
+        limit, timeout, cancellable = admission.limit_for(state.metrics.route_label(scope), scope["method"])
+        if limit is None:
+            return await self.app(scope, receive, send)
+        try:
+            await limit.acquire()
+        except AdmissionRejected as e:
+            note_error("AdmissionRejected")
+            return await admission_rejected_response(e)(scope, receive, send)
+        token = statement_timeout.set(timeout)
+        try:
+            if cancellable:
+                await self.run_cancellable(admission, scope, receive, send)
+            else:
+                await self.app(scope, receive, send)
+        finally:
+            statement_timeout.reset(token)
+            limit.release()
+
+    async def run_cancellable(self, admission: Admission, scope, receive, send):
+        messages = asyncio.Queue(maxsize=1)  # keeps the body pull-driven, an upload is never buffered
+        state = {"started": False, "complete": False, "disconnected": False}
+
+        async def send_tracking(message):
+            if message["type"] == "http.response.start":
+                state["started"] = True
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                state["complete"] = True
+            await send(message)
+
+        async def receive_queued():
+            if state["disconnected"] and messages.empty():
+                return {"type": "http.disconnect"}
+            return await messages.get()
+
+        handler = asyncio.ensure_future(self.app(scope, receive_queued, send_tracking))
+
+        async def pump():
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    state["disconnected"] = True
+                    if not state["complete"]:
+                        handler.cancel()
+                    await messages.put(message)
+                    return
+                await messages.put(message)
+
+        pumping = asyncio.ensure_future(pump())
+        try:
+            await handler
+        except asyncio.CancelledError:
+            if not state["disconnected"]:
+                raise
+            admission.cancelled += 1
+            note_error("ClientDisconnected")
+            if not state["started"]:
+                await send({"type": "http.response.start", "status": 499, "headers": []})
+        finally:
+            pumping.cancel()
+
+
+# /v1/admission/stats - GET request for admission limits, queues and rejections of this worker
+@router.get("/v1/admission/stats")
+async def admission_stats():
+    return RecordJSONResponse(content=app_state.get().admission.stats())
+
+
+############################# Read cache
+# Bounded LRU + TTL cache in front of the expert/chapter reads. Write endpoints
+# invalidate locally; other workers hear about changes through LISTEN/NOTIFY.
+READ_CACHE_SIZE = int(os.getenv("READ_CACHE_SIZE", "10000"))
+READ_CACHE_TTL = float(os.getenv("READ_CACHE_TTL", "30"))
+CHANGE_CHANNEL = os.getenv("CHANGE_CHANNEL", "papi2_changes")
+
+MISSING = object()
+
+
+class ReadCache:
+    def __init__(self, maxsize: int = READ_CACHE_SIZE, ttl: float = READ_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, value, group)
+        self.groups = {}              # group -> set of keys, e.g. all cached list pages of a chapter
+        # bumped by every invalidation; a fill that started before an invalidation is dropped
+        self.generation = 0
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+        if entry[0] < time.monotonic():
+            self._drop(key)
+            self.expirations += 1
+            self.misses += 1
+            return MISSING
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value, group=None, generation: Optional[int] = None):
+        if self.maxsize <= 0 or (generation is not None and generation != self.generation):
+            return
+        if key in self.entries:
+            self._drop(key)
+        self.entries[key] = (time.monotonic() + self.ttl, value, group)
+        if group is not None:
+            self.groups.setdefault(group, set()).add(key)
+        while len(self.entries) > self.maxsize:
+            self._drop(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _drop(self, key):
+        _, _, group = self.entries.pop(key)
+        if group is not None:
+            keys = self.groups.get(group)
+            keys.discard(key)
+            if not keys:
+                del self.groups[group]
+
+    def invalidate(self, key):
+        self.generation += 1
+        if key in self.entries:
+            self._drop(key)
+            self.invalidations += 1
+
+    def invalidate_group(self, group):
+        self.generation += 1
+        for key in list(self.groups.get(group, ())):
+            self._drop(key)
+            self.invalidations += 1
+
+    def clear(self):
+        self.generation += 1
+        self.invalidations += len(self.entries)
+        self.entries.clear()
+        self.groups.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+def invalidate_expert(chapter_id: int, expert_id: Optional[int] = None):
+    cache = app_state.get().read_cache
+    if expert_id is not None:
+        cache.invalidate(("expert", chapter_id, expert_id))
+    cache.invalidate_group(("experts", chapter_id))
+    app_state.get().versions.forget(f"experts:{chapter_id}")
+
+
+def invalidate_chapter(chapter_id: int):
+    cache = app_state.get().read_cache
+    cache.invalidate(("chapter", chapter_id))
+    cache.invalidate_group(("chapters",))
+    app_state.get().versions.forget("chapters")
+
+
+# Handlers for change notifications, called with the decoded trigger payload.
+# createDB.py installs the triggers that publish on CHANGE_CHANNEL.
+change_handlers = []
+
+
+def on_change(handler):
+    change_handlers.append(handler)
+    return handler
+
+
+@on_change
+def invalidate_on_change(change: dict):
+    if change["table"] == "experts":
+        invalidate_expert(change["chapterid"], change["id"])
+        if change.get("old_chapterid") not in (None, change["chapterid"]):
+            invalidate_expert(change["old_chapterid"], change["id"])
+    elif change["table"] == "chapters":
+        invalidate_chapter(change["id"])
+
+
+@on_change
+def update_versions_on_change(change: dict):
+    if change["table"] == "versions":
+        app_state.get().versions.observe(change["scope"], change["version"])
+
+
+@on_change
+def patch_tree_on_change(change: dict):
+    if change["table"] != "chapters":
+        return
+    if change["op"] == "DELETE":
+        app_state.get().chapter_tree.remove(change["id"])
+    else:
+        app_state.get().chapter_tree.update(change["id"], change["parentid"], change["title"])
+
+
+# One dedicated (non-pooled) connection per worker that LISTENs for changes made
+# by other workers. If it drops, reconnect and start over from a clean cache.
+class ChangeListener:
+    def __init__(self, dsn: str, state, channel: str = CHANGE_CHANNEL, retry_delay: float = 2.0):
+        self.dsn = dsn
+        self.state = state  # the app's; asyncpg runs _notify outside any request
+        self.channel = channel
+        self.retry_delay = retry_delay
+        self.conn = None
+        self.task = None
+        self.received = 0
+        self.reconnects = 0
+
+    async def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        if self.conn and not self.conn.is_closed():
+            await self.conn.close()
+
+    async def _run(self):
+        while True:
+            lost = asyncio.Event()
+            try:
+                self.conn = await asyncpg.connect(self.dsn, server_settings={'application_name': 'papi2-listener'})
+                self.conn.add_termination_listener(lambda conn: lost.set())
+                await self.conn.add_listener(self.channel, self._notify)
+                if self.reconnects:
+                    await self._resync()
+                await lost.wait()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print_status(f"Change listener error: {str(e)}", "error")
+            self.reconnects += 1
+            await asyncio.sleep(self.retry_delay)
+
+    async def _resync(self):
+        # notifications sent while we were disconnected are gone
+        self.state.read_cache.clear()
+        self.state.versions.clear()
+        self.state.events.reset()
+        async with self.state.db_pool.acquire() as conn:
+            await self.state.chapter_tree.load(conn)
+
+    def _notify(self, conn, pid, channel, payload):
+        self.received += 1
+        token = app_state.set(self.state)
+        try:
+            change = json.loads(payload)
+            for handler in change_handlers:
+                handler(change)
+        except Exception as e:
+            print_status(f"Bad change notification {payload!r}: {str(e)}", "error")
+        finally:
+            app_state.reset(token)
+
+
+# /v1/cache/stats - GET request for read cache counters of this worker
+@router.get("/v1/cache/stats")
+async def cache_stats():
+    state = app_state.get()
+    stats = state.read_cache.stats()
+    stats["notifications"] = state.change_listener.received
+    stats["listener_reconnects"] = state.change_listener.reconnects
+    stats["versions"] = state.versions.stats()
+    stats["coalescing"] = state.single_flight.stats()
+    return RecordJSONResponse(content=stats)
+
+
+############################# Events
+# GET /v1/experts/events?chapterID= is a Server-Sent Events stream of the changes to the
+# experts of a chapter (with their online status) and to the chapter itself, fed by the
+# notifications ChangeListener already receives, so any number of open pages costs no
+# queries. Each event is encoded once and shared by all subscribers of the chapter.
+#
+# A client is slow when a write to it has been pending for EVENTS_WRITE_TIMEOUT seconds;
+# a slow client with EVENTS_CLIENT_BUFFER unsent events, or any client with more unsent
+# events than the replay keeps, is evicted: it stops receiving, its buffer is dropped and
+# the stream ends with an "evicted" event. (Buffers share the encoded events, so a burst,
+# e.g. one statement notifying hundreds of rows, costs a client a list of references.)
+#
+# Event ids are "<epoch>-<n>", numbered per worker; the last EVENTS_REPLAY_SIZE events
+# are kept, so a client that reconnects with Last-Event-ID gets what it missed. When
+# that is not possible (another worker, a restart, a listener reconnect, too far
+# behind) it gets a "reset" event instead and should reload the chapter with
+# /v1/experts/list.
+EVENTS_CLIENT_BUFFER = int(os.getenv("EVENTS_CLIENT_BUFFER", "256"))
+EVENTS_WRITE_TIMEOUT = float(os.getenv("EVENTS_WRITE_TIMEOUT", "2"))
+EVENTS_REPLAY_SIZE = int(os.getenv("EVENTS_REPLAY_SIZE", "10000"))
+EVENTS_HEARTBEAT = float(os.getenv("EVENTS_HEARTBEAT", "15"))
+EVENTS_RETRY_MS = int(os.getenv("EVENTS_RETRY_MS", "3000"))
+
+
+class Subscriber:
+    __slots__ = ("chapter_id", "buffer", "wakeup", "evicted", "write_started")
+
+    def __init__(self, chapter_id: int):
+        self.chapter_id = chapter_id
+        self.buffer = []
+        self.wakeup = asyncio.Event()
+        self.evicted = False
+        self.write_started = None  # monotonic time of the pending write to the client
+
+
+class EventHub:
+    def __init__(self, client_buffer: int = EVENTS_CLIENT_BUFFER, replay_size: int = EVENTS_REPLAY_SIZE):
+        self.client_buffer = client_buffer
+        self.replay = deque(maxlen=replay_size)  # (chapter ids, encoded event), oldest first
+        self.subscribers = {}                    # chapterID -> set of Subscriber
+        self.epoch = uuid.uuid4().hex[:8]
+        self.seq = 0
+        self.published = self.delivered = self.evicted = self.resumed = self.resets = 0
+
+    def publish(self, kind: str, chapter_ids: tuple, data: dict):
+        self.seq += 1
+        event = b"".join((b"id: ", f"{self.epoch}-{self.seq}".encode(), b"\nevent: ", kind.encode(),
+                          b"\ndata: ", orjson.dumps(data), b"\n\n"))
+        self.replay.append((chapter_ids, event))
+        self.published += 1
+        slow_since = time.monotonic() - EVENTS_WRITE_TIMEOUT
+        for chapter_id in chapter_ids:
+            for subscriber in list(self.subscribers.get(chapter_id, ())):
+                queued = len(subscriber.buffer)
+                if queued >= self.client_buffer and (queued >= self.replay.maxlen or (
+                        subscriber.write_started is not None and subscriber.write_started < slow_since)):
+                    self.evict(subscriber)
+                    continue
+                subscriber.buffer.append(event)
+                subscriber.wakeup.set()
+                self.delivered += 1
+
+    def subscribe(self, chapter_id: int, last_event_id: Optional[str]) -> Subscriber:
+        # the replay is queued and the subscriber registered without an await in between,
+        # so no event falls into the gap
+        subscriber = Subscriber(chapter_id)
+        if last_event_id:
+            missed = self.missed_since(last_event_id)
+            if missed is None:
+                subscriber.buffer.append(b"event: reset\ndata: {}\n\n")
+                self.resets += 1
+            else:
+                subscriber.buffer += [event for chapter_ids, event in missed if chapter_id in chapter_ids]
+                self.resumed += 1
+        self.subscribers.setdefault(chapter_id, set()).add(subscriber)
+        return subscriber
+
+    def missed_since(self, last_event_id: str) -> Optional[list]:
+        epoch, _, seq = last_event_id.partition("-")
+        if epoch != self.epoch or not seq.isdigit() or int(seq) > self.seq:
+            return None
+        missed = self.seq - int(seq)
+        if missed > len(self.replay):
+            return None
+        return list(self.replay)[len(self.replay) - missed:]
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscribers = self.subscribers.get(subscriber.chapter_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.subscribers[subscriber.chapter_id]
+
+    def evict(self, subscriber: Subscriber):
+        self.unsubscribe(subscriber)
+        subscriber.buffer.clear()
+        subscriber.evicted = True
+        subscriber.wakeup.set()
+        self.evicted += 1
+
+    def reset(self):
+        # notifications were lost (listener reconnect): old ids cannot be resumed, tell everyone
+        self.epoch = uuid.uuid4().hex[:8]
+        self.seq = 0
+        self.replay.clear()
+        for subscribers in self.subscribers.values():
+            for subscriber in subscribers:
+                subscriber.buffer.append(b"event: reset\ndata: {}\n\n")
+                subscriber.wakeup.set()
+        self.resets += 1
+
+    async def stream(self, subscriber: Subscriber):
+        try:
+            yield f"retry: {EVENTS_RETRY_MS}\n\n".encode()
+            while True:
+                if subscriber.buffer:
+                    chunk = b"".join(subscriber.buffer)
+                    subscriber.buffer.clear()
+                    subscriber.write_started = time.monotonic()
+                    yield chunk
+                    subscriber.write_started = None
+                    continue
+                if subscriber.evicted:
+                    yield b"event: evicted\ndata: {}\n\n"
+                    return
+                subscriber.wakeup.clear()
+                try:
+                    await asyncio.wait_for(subscriber.wakeup.wait(), timeout=EVENTS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": sum(len(subscribers) for subscribers in self.subscribers.values()),
+            "chapters": len(self.subscribers),
+            "published": self.published,
+            "delivered": self.delivered,
+            "evicted": self.evicted,
+            "resumed": self.resumed,
+            "resets": self.resets,
+            "replay_size": len(self.replay),
+            "epoch": self.epoch,
+        }
+
+
+@on_change
+def publish_change(change: dict):
+    events = app_state.get().events
+    if change["table"] == "experts":
+        chapter_ids = (change["chapterid"],)
+        if change.get("old_chapterid") not in (None, change["chapterid"]):
+            chapter_ids += (change["old_chapterid"],)
+        events.publish("expert", chapter_ids, {key: value for key, value in change.items() if key != "table"})
+    elif change["table"] == "chapters":
+        events.publish("chapter", (change["id"],), {key: value for key, value in change.items() if key != "table"})
+
+
+# /v1/experts/events - GET request for a Server-Sent Events stream of expert and chapter changes in a chapter
+@router.get("/v1/experts/events")
+async def expert_events(request: Request, chapterID: int, last_event_id: Optional[str] = None):
+    # last_event_id is for clients that cannot set the Last-Event-ID header
+    events = app_state.get().events
+    subscriber = events.subscribe(chapterID, request.headers.get("last-event-id") or last_event_id)
+    return StreamingResponse(events.stream(subscriber), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# /v1/events/stats - GET request for event stream subscribers and counters of this worker
+@router.get("/v1/events/stats")
+async def event_stats():
+    return RecordJSONResponse(content=app_state.get().events.stats())
+
+
+############################# Conditional GET
+# The read/list endpoints send a strong ETag built from the version counter of what
+# they return (tableVersions, bumped by triggers, createDB.py migration 10) plus the
+# request parameters, and answer If-None-Match with 304 before touching the rows.
+# Versions are fetched once per scope and then kept current from the notifications;
+# a local write forgets its scope so the next read re-fetches it.
+HTTP_CACHE_CONTROL = os.getenv("HTTP_CACHE_CONTROL", "private, no-cache")
+ETAG_SALT = os.getenv("ETAG_SALT", "2")  # change when the JSON format of these endpoints changes
+
+
+class VersionMap:
+    def __init__(self):
+        self.versions = {}  # scope -> version
+        self.changed = {}   # scope -> time.monotonic() of the last change this worker saw
+        self.hits = self.loads = self.updates = 0
+
+    async def get(self, scope: str) -> int:
+        version = self.versions.get(scope)
+        if version is not None:
+            self.hits += 1
+            return version
+        self.loads += 1
+        async with get_db_connection() as conn:
+            version = await conn.fetchval("SELECT version FROM tableVersions WHERE scope = $1", scope) or 0
+        # a notification may have brought a newer version in the meantime
+        version = max(version, self.versions.get(scope, 0))
+        self.versions[scope] = version
+        return version
+
+    def observe(self, scope: str, version: int):
+        self.updates += 1
+        self.changed[scope] = time.monotonic()
+        if version > self.versions.get(scope, -1):
+            self.versions[scope] = version
+
+    def forget(self, scope: str):
+        self.changed[scope] = time.monotonic()
+        self.versions.pop(scope, None)
+
+    def changed_within(self, scope: str, seconds: float) -> bool:
+        changed = self.changed.get(scope)
+        return changed is not None and time.monotonic() - changed < seconds
+
+    def clear(self):
+        self.versions.clear()
+        # changes may have been missed: treat everything as just changed for a while
+        self.changed = {scope: time.monotonic() for scope in self.changed}
+
+    def stats(self) -> dict:
+        return {"scopes": len(self.versions), "hits": self.hits, "loads": self.loads, "updates": self.updates}
+
+
+def make_etag(scope: str, version: int, *parts) -> str:
+    return '"' + "-".join(str(part) for part in (ETAG_SALT, scope, version) + parts) + '"'
+
+
+def conditional_headers(etag: str, headers: Optional[dict] = None) -> dict:
+    return {**(headers or {}), "ETag": etag, "Cache-Control": HTTP_CACHE_CONTROL}
+
+
+def not_modified(request: Request, etag: str, headers: Optional[dict] = None) -> Optional[Response]:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return None
+    # If-None-Match uses weak comparison: W/"x" matches "x"
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    if etag in tags or "*" in tags:
+        return Response(status_code=304, headers=conditional_headers(etag, headers))
+    return None
+
+
+############################# Request coalescing
+# Identical reads that arrive while the first one is still running share its work:
+# the first request of a key runs the query and encodes the response (the leader),
+# later ones (followers) wait for it and get the same status, headers and body bytes,
+# or the same exception. A flight takes at most COALESCE_MAX_WAITERS followers; the
+# next request starts a new flight. COALESCE_MAX_WAITERS=0 turns coalescing off.
+# Keys carry the ETag, so a request that starts after a write's version change never
+# joins a flight that read the rows before it.
+COALESCE_MAX_WAITERS = int(os.getenv("COALESCE_MAX_WAITERS", "1000"))
+
+
+class Flight:
+    def __init__(self, task):
+        self.task = task
+        self.followers = 0
+        self.waiting = 0
+
+
+class SingleFlight:
+    def __init__(self, max_waiters: int = COALESCE_MAX_WAITERS):
+        self.max_waiters = max_waiters
+        self.flights = {}  # key -> Flight
+        self.leaders = self.followers = self.full = self.errors = 0
+
+    async def do(self, key, fn):
+        if self.max_waiters <= 0:
+            self.leaders += 1
+            return await fn()
+        flight = self.flights.get(key)
+        if flight is not None and flight.followers < self.max_waiters:
+            flight.followers += 1
+            self.followers += 1
+        else:
+            if flight is not None:
+                self.full += 1
+            # a task of its own, so a leader whose client goes away does not cancel the followers
+            flight = Flight(asyncio.ensure_future(fn()))
+            flight.task.add_done_callback(lambda task: self._done(key, flight))
+            self.flights[key] = flight
+            self.leaders += 1
+        flight.waiting += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiting -= 1
+            # every client of the flight has gone away (cancelled): stop its query as well.
+            # The flight leaves the table first: the cancel waits for asyncpg's round trip,
+            # and a request arriving meanwhile must start a new flight, not join this one.
+            if flight.waiting == 0 and not flight.task.done():
+                if self.flights.get(key) is flight:
+                    del self.flights[key]
+                flight.task.cancel()
+
+    def _done(self, key, flight):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+        if not flight.task.cancelled() and flight.task.exception() is not None:
+            self.errors += 1
+
+    def stats(self) -> dict:
+        requests = self.leaders + self.followers
+        return {
+            "in_flight": len(self.flights),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "coalesced_ratio": round(self.followers / requests, 4) if requests else 0.0,
+            "full_flights": self.full,
+            "errors": self.errors,
+            "max_waiters": self.max_waiters,
+        }
+
+
+async def coalesce(key: tuple, build) -> Response:
+    # build() returns a rendered response; every request gets its own Response around the shared body
+    async def run():
+        response = await build()
+        headers = {name: value for name, value in response.headers.items() if name != "content-length"}
+        return response.status_code, response.body, headers
+
+    status, body, headers = await app_state.get().single_flight.do(key + (read_from_primary.get(),), run)
+    return Response(content=body, status_code=status, headers=headers)
+
+
+############################# Statement shapes
+# Every write endpoint runs exactly one SQL text per operation, no matter which
+# optional fields the caller sent. Fields left out are passed as NULL and the
+# statement keeps the current value (UPDATE) or the column default (INSERT), so
+# asyncpg's per-connection statement cache stays warm and Postgres plans once. A hit
+# means asyncpg's cache on the borrowed connection already held the shape; it is read
+# from that cache, so evictions and closed connections count as misses without any
+# bookkeeping here.
+class StatementShapes:
+    def __init__(self):
+        self.sql = {}
+        self.executions = {}
+        self.hits = self.misses = 0
+
+    def register(self, name: str, sql: str) -> str:
+        self.sql[name] = sql
+        self.executions[name] = 0
+        return sql
+
+    def get(self, name: str, conn) -> str:
+        self.executions[name] += 1
+        if conn.is_prepared(self.sql[name]):
+            self.hits += 1
+        else:
+            self.misses += 1
+        return self.sql[name]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "shapes": len(self.sql),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "executions": dict(self.executions),
+        }
+
+
+def coalesce_update_sql(table: str, columns: list, key_columns: list, returning: str = "") -> str:
+    set_clause = ", ".join(f"{column} = COALESCE(${idx + 1}, {column})" for idx, column in enumerate(columns))
+    where_clause = " AND ".join(f"{column} = ${len(columns) + idx + 1}" for idx, column in enumerate(key_columns))
+    query = f"UPDATE {table} SET {set_clause} WHERE {where_clause}"
+    return f"{query} RETURNING {returning}" if returning else query
+
+
+def coalesce_insert_sql(table: str, columns: list, defaults: dict, returning: str = "") -> str:
+    values = [
+        f"COALESCE(${idx + 1}, {defaults[column]})" if column in defaults else f"${idx + 1}"
+        for idx, column in enumerate(columns)
+    ]
+    query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(values)})"
+    return f"{query} RETURNING {returning}" if returning else query
+
+
+# what expert and helpitem reads return: the rows without the columns kept for search,
+# ranking and uploads (search_vector, language_list, score, sha256, uploadclaimed)
+EXPERT_COLUMNS = ("id, chapterID, userID, name, description, schedule, languages, online, price, ranking, jobs, type, "
+                  "url_image, url_video, _active, enabled, _cdt")
+HELPITEM_COLUMNS = ("itemID, creatorID, ownerID, chapterID, kind, state, voteup, votedown, uploadstate, QR, title, "
+                    "description, language, imagefn, imageid, videofn, videoid, host, content, price, budget")
+EXPERT_FIELDS = ['name', 'description', 'languages', 'online', 'price', 'ranking', 'jobs', 'type', 'url_image',
+                 'url_video', 'enabled']
+EXPERT_INSERT_FIELDS = ['chapterID', 'name', 'description', 'languages', 'online', 'price', 'ranking', 'jobs', 'type',
+                        'url_image', 'url_video', '_active', 'enabled']
+EXPERT_DEFAULTS = {'jobs': '0', '_active': 'TRUE', 'enabled': 'TRUE'}
+CHAPTER_FIELDS = ['domainID', 'parentID', 'title', 'enableVideo', 'enableImage', 'enableWiki', 'enableChat',
+                  'enableExpert', 'enableAdd', 'playlist', 'budget']
+CHAPTER_DEFAULTS = {'enableVideo': '0', 'enableImage': '0', 'enableWiki': '0', 'enableChat': '0',
+                    'enableExpert': '0', 'enableAdd': '0'}
+# the same defaults as python values, for COPY which cannot evaluate SQL expressions
+EXPERT_BULK_DEFAULTS = {'jobs': 0, '_active': True, 'enabled': True}
+CHAPTER_BULK_DEFAULTS = {column: 0 for column in CHAPTER_DEFAULTS}
+
+statements = StatementShapes()
+statements.register("expert_update", coalesce_update_sql("tableExperts", EXPERT_FIELDS, ["chapterID", "id"]))
+statements.register("expert_insert", coalesce_insert_sql("tableExperts", EXPERT_INSERT_FIELDS, EXPERT_DEFAULTS))
+statements.register("chapter_update", coalesce_update_sql("tableChapters", CHAPTER_FIELDS, ["chapterID"],
+                                                          returning="chapterID, parentID, title"))
+statements.register("chapter_insert", coalesce_insert_sql("tableChapters", CHAPTER_FIELDS, CHAPTER_DEFAULTS,
+                                                          returning="chapterID, parentID, title"))
+
+
+# /v1/statements/stats - GET request for statement shape usage of this worker
+@router.get("/v1/statements/stats")
+async def statement_stats():
+    return RecordJSONResponse(content=statements.stats())
+
+
+############################# Pagination / streaming
+# List endpoints page by primary key (keyset): each page asks for rows after the
+# last key of the previous page, so deep pages cost the same as the first one.
+PAGE_LIMIT_DEFAULT = int(os.getenv("PAGE_LIMIT_DEFAULT", "100"))
+PAGE_LIMIT_MAX = int(os.getenv("PAGE_LIMIT_MAX", "1000"))
+STREAM_PREFETCH = int(os.getenv("STREAM_PREFETCH", "500"))
+
+
+# continuation tokens are opaque to clients: urlsafe base64 of a small json doc
+def encode_cursor(after) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"after": after}).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> int:
+    if not cursor:
+        return 0
     try:
-        cursor.execute(query, params)
-        return cursor.fetchone()
-    except Exception as e:
-        print_status(f"Database error: {str(e)}", "error")
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return int(json.loads(base64.urlsafe_b64decode(padded))["after"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="invalid cursor")
+
+
+# cursors of sorted listings carry the (sort value, id) of the last row; the sort
+# value travels as a string so NUMERIC keys round-trip exactly
+def decode_keyset_cursor(cursor: Optional[str], kind) -> Optional[tuple]:
+    if not cursor:
         return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, row_id = json.loads(base64.urlsafe_b64decode(padded))["after"]
+        return kind(value), int(row_id)
+    except (ValueError, KeyError, TypeError, ArithmeticError):
+        raise HTTPException(status_code=400, detail="invalid cursor")
 
 
-print('*** Setting up postgres database ***')
-# Database connection settings
-DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://user:pw@localhost/papi2")
-print("database url: ", DATABASE_URL)
+def next_cursor_headers(rows, limit: int, key: str) -> dict:
+    # callers fetch limit + 1 rows; the extra row only signals that another page exists
+    if len(rows) > limit:
+        return {"X-Next-Cursor": encode_cursor(rows[limit - 1][key])}
+    return {}
 
-# comment pooling method
-# async def get_db_connection():
-#     return await app.state.db_pool.acquire()
-############################# Database Operations
 
+def ndjson_line(row) -> bytes:
+    return orjson.dumps(row, default=json_default, option=orjson.OPT_APPEND_NEWLINE)
 
-############################################### EXPERT
-# Function to get the database connection
-async def get_db_connection():
-    return await asyncpg.connect(DATABASE_URL)
+
+# Stream query results as NDJSON from a server-side cursor. The connection is held
+# for the lifetime of the response and only STREAM_PREFETCH rows are in memory.
+async def stream_ndjson(scope: str, query: str, *params):
+    async with get_read_connection(scope) as conn:
+        async with conn.transaction(readonly=True):
+            cursor = await conn.cursor(query, *params)
+            while True:
+                rows = await conn.fetch_cursor(cursor, STREAM_PREFETCH)  # timed into "db" by TimedConnection
+                if rows:
+                    with request_phase("serialize"):
+                        chunk = b"".join([ndjson_line(row) for row in rows])
+                    yield chunk
+                if len(rows) < STREAM_PREFETCH:
+                    break
 
 
 # /v1/experts/list - GET request to list all experts in a chapter
-@app.get("/v1/experts/list")
-async def list_experts(chapterID: int):
-    print(1)
-    query = """
-        SELECT * FROM tableExperts WHERE chapterID = $1
+@router.get("/v1/experts/list")
+async def list_experts(request: Request, chapterID: int,
+                       limit: int = Query(PAGE_LIMIT_DEFAULT, ge=1, le=PAGE_LIMIT_MAX),
+                       cursor: Optional[str] = None, stream: bool = False):
+    after = decode_cursor(cursor)
+    if stream:
+        query = f"""
+            SELECT {EXPERT_COLUMNS} FROM tableExperts WHERE chapterID = $1 AND id > $2 ORDER BY id
+        """
+        return StreamingResponse(stream_ndjson(f"experts:{chapterID}", query, chapterID, after),
+                                 media_type="application/x-ndjson")
+
+    query = f"""
+        SELECT {EXPERT_COLUMNS} FROM tableExperts WHERE chapterID = $1 AND id > $2 ORDER BY id LIMIT $3
     """
-    print(2)
-    conn = await get_db_connection()
-    print(3)
-    try:
-        print(f"Getting experts for chapter {chapterID}")
-        rows = await conn.fetch(query, chapterID)
-        print(4)
-        if not rows:
-            return {"status": "No experts found for the given chapter"}
-
-        print(5)
-        experts = [dict(row) for row in rows]
-        return JSONResponse(content=experts)
-    except Exception as e:
-        return JSONResponse(content={"status": f"error {str(e)}"})
-    finally:
-        await conn.close()
+    # the version is read before the rows, so the ETag is never newer than the data
+    scope = f"experts:{chapterID}"
+    etag = make_etag(scope, await app_state.get().versions.get(scope), after, limit)
+    cache = app_state.get().read_cache
+    key = ("experts", chapterID, after, limit)
+    cached = cache.get(key)
+    if cached is not MISSING:
+        experts, headers = cached
+        return not_modified(request, etag, headers) or RecordJSONResponse(
+            content=experts, headers=conditional_headers(etag, headers))
+    if (response := not_modified(request, etag)) is not None:
+        return response
+
+    async def fetch():
+        generation = cache.generation
+        async with get_read_connection(scope) as conn:
+            try:
+                logger.debug("Getting experts for chapter %s", chapterID)
+                rows = await conn.fetch(query, chapterID, after, limit + 1)
+                if not rows:
+                    return RecordJSONResponse(content={"status": "No experts found for the given chapter"},
+                                              headers=conditional_headers(etag))
+
+                experts = rows[:limit]
+                headers = next_cursor_headers(rows, limit, "id")
+                cache.set(key, (experts, headers), group=("experts", chapterID), generation=generation)
+                return RecordJSONResponse(content=experts, headers=conditional_headers(etag, headers))
+            except DB_ERRORS as e:
+                return RecordJSONResponse(content={"status": f"error {str(e)}"})
+
+    return await coalesce(("experts/list", etag), fetch)
 
 
 # /v1/experts/update - POST request to update an expert record
-@app.post("/v1/experts/update")
+@router.post("/v1/experts/update")
 async def update_expert(chapterID: int, recno: int, name: Optional[str] = None, description: Optional[str] = None,
                         languages: Optional[str] = None, online: Optional[str] = None, price: Optional[float] = None,
                         ranking: Optional[float] = None, jobs: Optional[int] = None, type: Optional[str] = None,
@@ -111,36 +1903,24 @@ async def update_expert(chapterID: int, recno: int, name: Optional[str] = None,
     params = [
         name, description, languages, online, price, ranking, jobs, type, url_image, url_video, enabled
     ]
-    set_clauses = [
-        f"{key} = ${idx + 1}" for idx, key in enumerate([
-            'name', 'description', 'languages', 'online', 'price', 'ranking', 'jobs', 'type', 'url_image', 'url_video',
-            'enabled'
-        ]) if params[idx] is not None
-    ]
-    if not set_clauses:
-        return JSONResponse(content={"status": "No fields to update"})
+    if all(param is None for param in params):
+        return RecordJSONResponse(content={"status": "No fields to update"})
 
-    query = f"""
-        UPDATE tableExperts
-        SET {', '.join(set_clauses)}
-        WHERE chapterID = ${len(set_clauses) + 1} AND id = ${len(set_clauses) + 2};
-    """
-    params = [param for param in params if param is not None] + [chapterID, recno]
+    params = params + [chapterID, recno]
 
-    conn = await get_db_connection()
-    try:
-        result = await conn.execute(query, *params)
-        if result == "UPDATE 0":
-            return JSONResponse(content={"status": "failed"})
-        return JSONResponse(content={"status": "ok"})
-    except Exception as e:
-        return JSONResponse(content={"status": f"error {str(e)}"})
-    finally:
-        await conn.close()
+    async with get_db_connection() as conn:
+        try:
+            result = await conn.execute(statements.get("expert_update", conn), *params)
+            invalidate_expert(chapterID, recno)
+            if result == "UPDATE 0":
+                return RecordJSONResponse(content={"status": "failed"})
+            return RecordJSONResponse(content={"status": "ok"})
+        except DB_ERRORS as e:
+            return RecordJSONResponse(content={"status": f"error {str(e)}"})
 
 
 # /v1/experts/create - POST request to create a new expert record
-@app.post("/v1/experts/create")
+@router.post("/v1/experts/create")
 async def create_expert(chapterID: int, name: Optional[str] = None, description: Optional[str] = None,
                         languages: Optional[str] = None,
                         online: Optional[str] = None, price: Optional[float] = None, ranking: Optional[float] = None,
@@ -151,64 +1931,535 @@ async def create_expert(chapterID: int, name: Optional[str] = None, description:
         chapterID, name, description, languages, online, price, ranking, jobs, type, url_image, url_video, _active,
         enabled
     ]
-    columns = [
-        key for key, value in zip([
-            'chapterID', 'name', 'description', 'languages', 'online', 'price', 'ranking', 'jobs', 'type', 'url_image',
-            'url_video', '_active', 'enabled'
-        ], params) if value is not None
-    ]
-    placeholders = [f"${idx + 1}" for idx in range(len(columns))]
 
-    query = f"""
-        INSERT INTO tableExperts ({', '.join(columns)})
-        VALUES ({', '.join(placeholders)})
-    """
-    params = [param for param in params if param is not None]
-
-    conn = await get_db_connection()
-    try:
-        await conn.execute(query, *params)
-        return JSONResponse(content={"status": "ok"})
-    except Exception as e:
-        return JSONResponse(content={"status": f"error {str(e)}"})
-    finally:
-        await conn.close()
+    async with get_db_connection() as conn:
+        try:
+            await conn.execute(statements.get("expert_insert", conn), *params)
+            invalidate_expert(chapterID)
+            return RecordJSONResponse(content={"status": "ok"})
+        except DB_ERRORS as e:
+            return RecordJSONResponse(content={"status": f"error {str(e)}"})
 
 
 # /v1/experts/delete - POST request to delete an expert record
-@app.post("/v1/experts/delete")
+@router.post("/v1/experts/delete")
 async def delete_expert(chapterID: int, recno: int):
     query = """
         DELETE FROM tableExperts WHERE chapterID = $1 AND id = $2
     """
-    conn = await get_db_connection()
-    try:
-        result = await conn.execute(query, chapterID, recno)
-        if result == "DELETE 0":
-            return JSONResponse(content={"status": "failed"})
-        return JSONResponse(content={"status": "ok"})
-    except Exception as e:
-        return JSONResponse(content={"status": f"error {str(e)}"})
-    finally:
-        await conn.close()
+    async with get_db_connection() as conn:
+        try:
+            result = await conn.execute(query, chapterID, recno)
+            invalidate_expert(chapterID, recno)
+            if result == "DELETE 0":
+                return RecordJSONResponse(content={"status": "failed"})
+            return RecordJSONResponse(content={"status": "ok"})
+        except DB_ERRORS as e:
+            return RecordJSONResponse(content={"status": f"error {str(e)}"})
 
 
 # /v1/experts/read - GET request to read an expert record
-@app.get("/v1/experts/read")
-async def read_expert(chapterID: int, recno: int):
-    query = """
-        SELECT * FROM tableExperts WHERE chapterID = $1 AND id = $2
+@router.get("/v1/experts/read")
+async def read_expert(request: Request, chapterID: int, recno: int):
+    query = f"""
+        SELECT {EXPERT_COLUMNS} FROM tableExperts WHERE chapterID = $1 AND id = $2
     """
-    conn = await get_db_connection()
+    scope = f"experts:{chapterID}"
+    etag = make_etag(scope, await app_state.get().versions.get(scope), recno)
+    if (response := not_modified(request, etag)) is not None:
+        return response
+    cache = app_state.get().read_cache
+    key = ("expert", chapterID, recno)
+    expert = cache.get(key)
+    if expert is not MISSING:
+        return RecordJSONResponse(content=expert, headers=conditional_headers(etag))
+
+    async def fetch():
+        generation = cache.generation
+        async with get_read_connection(scope) as conn:
+            try:
+                row = await conn.fetchrow(query, chapterID, recno)
+                if not row:
+                    return RecordJSONResponse(content={"status": "No expert found"},
+                                              headers=conditional_headers(etag))
+                cache.set(key, row, generation=generation)
+                return RecordJSONResponse(content=row, headers=conditional_headers(etag))
+            except DB_ERRORS as e:
+                return RecordJSONResponse(content={"status": f"error {str(e)}"})
+
+    return await coalesce(("experts/read", etag), fetch)
+
+
+############################# Batch reads
+# /v1/experts/read_many and /v1/chapters/read_many resolve up to READ_MANY_MAX records
+# per request. Each record is looked up in the read cache under the same key as the
+# single-record endpoint; only the misses are fetched, in one `= ANY($1)` query.
+# Results are keyed by the requested ID, and records that do not exist are null and
+# listed in "not_found".
+READ_MANY_MAX = int(os.getenv("READ_MANY_MAX", "100"))
+
+
+def parse_read_many_ids(ids: list, pairs: bool) -> list:
+    # ?ids=1&ids=2 or ?ids=1,2; pairs are chapterID:id
+    keys = []
+    for value in ids:
+        for part in value.split(","):
+            part = part.strip()
+            if not part:
+                continue
+            try:
+                key = tuple(int(number) for number in part.split(":")) if pairs else int(part)
+            except ValueError:
+                key = None
+            if key is None or (pairs and len(key) != 2):
+                raise HTTPException(status_code=400, detail=f"invalid id {part!r}")
+            keys.append(key)
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        raise HTTPException(status_code=400, detail="no ids given")
+    if len(keys) > READ_MANY_MAX:
+        raise HTTPException(status_code=400, detail=f"at most {READ_MANY_MAX} ids per request")
+    return keys
+
+
+async def read_many(keys: list, cache_key, row_key, query: str, ids, scopes) -> dict:
+    cache = app_state.get().read_cache
+    found, misses = {}, set()
+    for key in keys:
+        row = cache.get(cache_key(key))
+        if row is MISSING:
+            misses.add(key)
+        else:
+            found[key] = row
+    if not misses:
+        return found
+    generation = cache.generation
+    async with get_read_connection(*scopes(misses)) as conn:
+        rows = await conn.fetch(query, ids(misses))
+    for row in rows:
+        key = row_key(row)
+        if key in misses:
+            found[key] = row
+            cache.set(cache_key(key), row, generation=generation)
+    return found
+
+
+def read_many_response(keys: list, found: dict, label) -> RecordJSONResponse:
+    data = {label(key): found.get(key) for key in keys}
+    not_found = [label(key) for key in keys if key not in found]
+    return RecordJSONResponse(content={"status": "success", "data": data, "not_found": not_found})
+
+
+# /v1/experts/read_many - GET request to read experts by chapterID:id pairs, e.g. ?ids=11:74,12:3
+@router.get("/v1/experts/read_many")
+async def read_experts_many(ids: list[str] = Query(...)):
+    keys = parse_read_many_ids(ids, pairs=True)
     try:
-        row = await conn.fetchrow(query, chapterID, recno)
-        if not row:
-            return JSONResponse(content={"status": "No expert found"})
-        return JSONResponse(content=dict(row))
-    except Exception as e:
-        return JSONResponse(content={"status": f"error {str(e)}"})
-    finally:
-        await conn.close()
+        found = await read_many(
+            keys,
+            cache_key=lambda key: ("expert",) + key,
+            # id is the primary key; an expert in another chapter than requested counts as not found
+            row_key=lambda row: (row["chapterid"], row["id"]),
+            query=f"SELECT {EXPERT_COLUMNS} FROM tableExperts WHERE id = ANY($1::int[])",
+            ids=lambda misses: [expert_id for _, expert_id in misses],
+            scopes=lambda misses: {f"experts:{chapter_id}" for chapter_id, _ in misses},
+        )
+    except DB_ERRORS as e:
+        logger.error("Error reading experts: %s", e)
+        return RecordJSONResponse(content={"status": f"error {str(e)}"})
+    return read_many_response(keys, found, lambda key: f"{key[0]}:{key[1]}")
+
+
+############################# Search
+# /v1/experts/search returns the top `limit` active, enabled experts for the chosen
+# sort and filters, paged with a keyset cursor on (sort key, id). Languages are
+# matched against language_list, the lower-cased languages column as a generated
+# TEXT[] with a GIN index; each sort has a partial btree (createDB.py migrations 6, 7).
+SEARCH_LIMIT_DEFAULT = int(os.getenv("SEARCH_LIMIT_DEFAULT", "20"))
+SEARCH_LIMIT_MAX = int(os.getenv("SEARCH_LIMIT_MAX", "100"))
+
+# sort -> (column, direction, python type of the key in cursors); NULL keys sort as 0
+EXPERT_SEARCH_SORTS = {
+    "ranking": ("ranking", "DESC", Decimal),
+    "jobs": ("jobs", "DESC", int),
+    "price": ("price", "ASC", Decimal),
+    "price_desc": ("price", "DESC", Decimal),
+    "newest": ("id", "DESC", int),
+}
+
+
+def expert_search_query(sort: str, after: Optional[tuple], limit: int, chapterID: Optional[int] = None,
+                        languages: Optional[list] = None, match_all: bool = True, online: Optional[str] = None,
+                        type: Optional[str] = None, min_price: Optional[float] = None,
+                        max_price: Optional[float] = None, min_ranking: Optional[float] = None):
+    # Only the filters that were given end up in the WHERE clause, always in the same
+    # order, so there is one SQL text per filter combination and sort (a bounded set
+    # that stays in asyncpg's statement cache) and the planner sees plain predicates.
+    column, direction, _ = EXPERT_SEARCH_SORTS[sort]
+    key = "id" if column == "id" else f"COALESCE({column}, 0)"
+    conditions = ["_active AND enabled"]
+    params = []
+
+    def param(value) -> str:
+        params.append(value)
+        return f"${len(params)}"
+
+    if chapterID is not None:
+        conditions.append(f"chapterID = {param(chapterID)}")
+    if languages:
+        conditions.append(f"language_list {'@>' if match_all else '&&'} {param(languages)}::text[]")
+    if online is not None:
+        conditions.append(f"online = {param(online)}")
+    if type is not None:
+        conditions.append(f"type = {param(type)}")
+    # range filters use the same COALESCE expressions as the sort indexes, so sorting
+    # by price (or ranking) within a range is an index range scan, not a filter
+    if min_price is not None:
+        conditions.append(f"COALESCE(price, 0) >= {param(min_price)}")
+    if max_price is not None:
+        conditions.append(f"COALESCE(price, 0) <= {param(max_price)}")
+    if min_ranking is not None:
+        conditions.append(f"COALESCE(ranking, 0) >= {param(min_ranking)}")
+    if after is not None:
+        op = "<" if direction == "DESC" else ">"
+        if column == "id":
+            conditions.append(f"id {op} {param(after[1])}")
+        else:
+            conditions.append(f"({key}, id) {op} ({param(after[0])}, {param(after[1])})")
+    order = f"id {direction}" if column == "id" else f"{key} {direction}, id {direction}"
+    query = f"""
+        SELECT {EXPERT_COLUMNS} FROM tableExperts
+        WHERE {' AND '.join(conditions)}
+        ORDER BY {order}
+        LIMIT {param(limit + 1)}
+    """
+    return query, params
+
+
+def search_cursor_headers(rows, limit: int, sort: str) -> dict:
+    if len(rows) <= limit:
+        return {}
+    column = EXPERT_SEARCH_SORTS[sort][0]
+    last = rows[limit - 1]
+    value = last[column] if last[column] is not None else 0
+    return {"X-Next-Cursor": encode_cursor([str(value), last["id"]])}
+
+
+# /v1/experts/search - GET request to find experts by language, status, type, price and ranking
+@router.get("/v1/experts/search")
+async def search_experts(language: Optional[list[str]] = Query(None),
+                         language_match: Literal["all", "any"] = "all",
+                         online: Optional[str] = None, type: Optional[str] = None,
+                         min_price: Optional[float] = None, max_price: Optional[float] = None,
+                         min_ranking: Optional[float] = None, chapterID: Optional[int] = None,
+                         sort: Literal["ranking", "jobs", "price", "price_desc", "newest"] = "ranking",
+                         limit: int = Query(SEARCH_LIMIT_DEFAULT, ge=1, le=SEARCH_LIMIT_MAX),
+                         cursor: Optional[str] = None):
+    after = decode_keyset_cursor(cursor, EXPERT_SEARCH_SORTS[sort][2])
+    # ?language=English&language=French or ?language=English,French
+    languages = sorted({part.strip().lower() for value in language or () for part in value.split(",")} - {""})
+    query, params = expert_search_query(sort, after, limit, chapterID=chapterID, languages=languages,
+                                        match_all=language_match == "all", online=online, type=type,
+                                        min_price=min_price, max_price=max_price, min_ranking=min_ranking)
+    async with get_db_connection() as conn:
+        try:
+            rows = await conn.fetch(query, *params)
+        except DB_ERRORS as e:
+            return RecordJSONResponse(content={"status": f"error {str(e)}"})
+    return RecordJSONResponse(content=rows[:limit], headers=search_cursor_headers(rows, limit, sort))
+
+
+# /v1/search is full-text search over helpitems and experts. Every row carries a
+# weighted tsvector built with the text search config of its own language, in a
+# generated column with a GIN index (createDB.py migrations 15, 16). The query is
+# parsed with websearch_to_tsquery ("quoted phrases", or, -not) in the requested
+# language, or in every configured language at once (papi2_ts_query), then matches
+# are ordered by ts_rank and paged with a keyset cursor on (rank, type, id).
+# Ranking reads every match's vector from the heap, so a page costs about as much
+# as the query's match count: a word in half of 2M items takes seconds. With
+# SEARCH_RANK_LIMIT > 0 only the newest SEARCH_RANK_LIMIT matches of each type (by
+# id, the same set on every page) are ranked. That saves the ts_rank work of broad
+# queries (about 4x on 1M matches; picking the sample still reads every match's id)
+# at the price of missing better matches outside the sample, and such responses
+# carry X-Search-Sampled: true. The default 0 ranks every match.
+# Snippets (ts_headline) are only made for the rows of the page. Searches are always
+# planned for their parameters: a cached generic plan guesses that any chapter scope
+# is narrow and ANDs the chapter index into the bitmap, which for a large subtree
+# reads index entries for most of the table (0.6 s instead of 25 ms on 2M items).
+SEARCH_QUERY_MAX = int(os.getenv("SEARCH_QUERY_MAX", "200"))
+SEARCH_RANK_LIMIT = int(os.getenv("SEARCH_RANK_LIMIT", "0"))
+SEARCH_HEADLINE_OPTIONS = os.getenv("SEARCH_HEADLINE_OPTIONS",
+                                    "MaxWords=35, MinWords=15, MaxFragments=2, StartSel=<b>, StopSel=</b>")
+
+# type -> matches of one table as (id, chapterID, search_vector); search.q is the query's tsquery
+TEXT_SEARCH_SOURCES = {
+    "helpitem": """
+        SELECT itemID AS id, chapterID, search_vector
+        FROM tableHelpitems, search
+        WHERE search_vector @@ search.q{filters}
+    """,
+    "expert": """
+        SELECT id, chapterID, search_vector
+        FROM tableExperts, search
+        WHERE search_vector @@ search.q AND _active AND enabled{filters}
+    """,
+}
+
+
+def text_search_query(q: str, types: list, after: Optional[tuple], limit: int,
+                      chapter_ids: Optional[list] = None, language: Optional[str] = None):
+    params = [q, language]
+
+    def param(value) -> str:
+        params.append(value)
+        return f"${len(params)}"
+
+    filters = {"helpitem": "", "expert": ""}
+    if chapter_ids is not None:
+        chapters = param(chapter_ids)
+        for kind in filters:
+            filters[kind] += f" AND chapterID = ANY({chapters}::int[])"
+    if language is not None:
+        # the query was stemmed for this language only: helpitems written in it, experts who speak it
+        filters["helpitem"] += " AND papi2_ts_config(language) = papi2_ts_config($2)"
+        filters["expert"] += (" AND EXISTS (SELECT 1 FROM unnest(language_list) AS spoken"
+                              " WHERE papi2_ts_config(spoken) = papi2_ts_config($2))")
+    if SEARCH_RANK_LIMIT > 0:
+        rank_limit = param(SEARCH_RANK_LIMIT)
+        sample, capped = f"ORDER BY id DESC LIMIT {rank_limit}", f"count(*) OVER () >= {rank_limit}"
+    else:
+        sample, capped = "", "false"
+    # ts_rank sits above the LIMIT so that only the ranked matches are scored; sampled is
+    # worked out before the keyset condition, so later pages report it as well
+    matches = " UNION ALL ".join(f"""
+        SELECT '{kind}' AS type, id, chapterID, ts_rank(search_vector, search.q) AS rank, {capped} AS capped
+        FROM ({TEXT_SEARCH_SOURCES[kind].format(filters=filters[kind])} {sample}) AS {kind}, search
+    """ for kind in types)
+    keyset = ""
+    if after is not None:
+        keyset = f"WHERE (rank, type, id) < ({param(after[0])}::real, {param(after[1])}, {param(after[2])})"
+    options, page_size = param(SEARCH_HEADLINE_OPTIONS), param(limit + 1)
+    # search is referenced by every source and the outer query, so it is computed once
+    query = f"""
+        WITH search AS (SELECT papi2_ts_query($1, $2) AS q)
+        SELECT page.type, page.id, page.chapterID, page.rank, page.sampled,
+               COALESCE(h.title, e.name) AS title, COALESCE(h.language, e.languages) AS language,
+               CASE page.type
+                   WHEN 'helpitem' THEN ts_headline(papi2_ts_config(h.language),
+                                                    concat_ws(' ', h.description, h.content), search.q, {options})
+                   ELSE ts_headline(papi2_ts_config((e.language_list)[1]), COALESCE(e.description, ''),
+                                    search.q, {options})
+               END AS snippet
+        FROM (
+            SELECT * FROM (SELECT *, bool_or(capped) OVER () AS sampled FROM ({matches}) AS matches) AS matches
+            {keyset}
+            ORDER BY rank DESC, type DESC, id DESC
+            LIMIT {page_size}
+        ) AS page
+        CROSS JOIN search
+        LEFT JOIN tableHelpitems h ON page.type = 'helpitem' AND h.itemID = page.id
+        LEFT JOIN tableExperts e ON page.type = 'expert' AND e.id = page.id
+        ORDER BY page.rank DESC, page.type DESC, page.id DESC
+    """
+    return query, params
+
+
+async def fetch_text_search(conn, query: str, params: list) -> list:
+    async with conn.transaction(readonly=True):
+        await conn.execute("SET LOCAL plan_cache_mode = force_custom_plan")
+        return await conn.fetch(query, *params)
+
+
+def decode_text_search_cursor(cursor: Optional[str]) -> Optional[tuple]:
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        rank, kind, row_id = json.loads(base64.urlsafe_b64decode(padded))["after"]
+        if kind not in TEXT_SEARCH_SOURCES:
+            raise ValueError(kind)
+        return float(rank), kind, int(row_id)
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="invalid cursor")
+
+
+# /v1/search - GET request for ranked full-text matches among helpitems and experts, with snippets
+@router.get("/v1/search")
+async def text_search(q: str = Query(..., min_length=1, max_length=SEARCH_QUERY_MAX),
+                      type: Literal["all", "helpitems", "experts"] = "all",
+                      chapterID: Optional[int] = None, subtree: bool = False, language: Optional[str] = None,
+                      limit: int = Query(SEARCH_LIMIT_DEFAULT, ge=1, le=SEARCH_LIMIT_MAX),
+                      cursor: Optional[str] = None):
+    after = decode_text_search_cursor(cursor)
+    types = ["helpitem", "expert"] if type == "all" else [type[:-1]]
+    chapter_ids = None
+    if chapterID is not None:
+        tree = app_state.get().chapter_tree
+        if chapterID not in tree:
+            return chapter_not_found()
+        chapter_ids = tree.subtree_ids(chapterID) if subtree else [chapterID]
+    query, params = text_search_query(q, types, after, limit, chapter_ids=chapter_ids, language=language)
+    async with get_db_connection() as conn:
+        try:
+            rows = await fetch_text_search(conn, query, params)
+        except DB_ERRORS as e:
+            logger.error("Error searching for %r: %s", q, e)
+            return RecordJSONResponse(content={"status": f"error {str(e)}"})
+    headers = {}
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        headers["X-Next-Cursor"] = encode_cursor([repr(last["rank"]), last["type"], last["id"]])
+    if rows and rows[0]["sampled"]:
+        headers["X-Search-Sampled"] = "true"
+    return RecordJSONResponse(content=[{key: value for key, value in row.items() if key != "sampled"}
+                                       for row in rows[:limit]], headers=headers)
+
+
+############################# Bulk
+# /v1/experts/bulk and /v1/chapters/bulk take a JSON array or an NDJSON body of rows,
+# each {"op": "create" | "update" | "delete", ...fields}. All valid rows are applied
+# in one transaction through DBbulk (COPY for creates, unnest() for updates/deletes).
+BULK_MAX_ROWS = int(os.getenv("BULK_MAX_ROWS", "10000"))
+
+
+class ExpertBulkRow(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    op: Literal["create", "update", "delete"] = "create"
+    chapterID: Optional[int] = None
+    id: Optional[int] = None
+    name: Optional[str] = None
+    description: Optional[str] = None
+    languages: Optional[str] = None
+    online: Optional[str] = None
+    price: Optional[float] = None
+    ranking: Optional[float] = None
+    jobs: Optional[int] = None
+    type: Optional[str] = None
+    url_image: Optional[str] = None
+    url_video: Optional[str] = None
+    active: Optional[bool] = Field(None, alias="_active")
+    enabled: Optional[bool] = None
+
+
+class ChapterBulkRow(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    op: Literal["create", "update", "delete"] = "create"
+    chapterID: Optional[int] = None
+    domainID: Optional[int] = None
+    parentID: Optional[int] = None
+    title: Optional[str] = None
+    enableVideo: Optional[int] = None
+    enableImage: Optional[int] = None
+    enableWiki: Optional[int] = None
+    enableChat: Optional[int] = None
+    enableExpert: Optional[int] = None
+    enableAdd: Optional[int] = None
+    playlist: Optional[str] = None
+    budget: Optional[Decimal] = None  # exact, see create_chapter
+
+
+async def read_bulk_rows(request: Request) -> list:
+    content_type = request.headers.get("content-type", "")
+    try:
+        if "ndjson" in content_type or "jsonlines" in content_type:
+            rows, pending = [], b""
+            async for chunk in request.stream():
+                *lines, pending = (pending + chunk).split(b"\n")
+                rows.extend(json.loads(line) for line in lines if line.strip())
+                if len(rows) > BULK_MAX_ROWS:
+                    break
+            if pending.strip():
+                rows.append(json.loads(pending))
+        else:
+            rows = json.loads(await request.body())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"invalid JSON: {str(e)}")
+    if not isinstance(rows, list):
+        raise HTTPException(status_code=400, detail="expected a JSON array or NDJSON rows")
+    if len(rows) > BULK_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"at most {BULK_MAX_ROWS} rows per request")
+    return rows
+
+
+def validate_bulk_rows(model, raw_rows: list, key_fields: list, results: list) -> dict:
+    """Validate raw rows into {"create": [...], "update": [...], "delete": [...]} of (index, row)."""
+    ops = {"create": [], "update": [], "delete": []}
+    seen_keys = set()
+    for index, raw in enumerate(raw_rows):
+        try:
+            row = model.model_validate(raw)
+        except ValidationError as e:
+            results[index] = {"index": index, "status": "error", "message": str(e.errors()[0]["msg"])}
+            continue
+        if row.op != "create":
+            key = tuple(getattr(row, field) for field in key_fields)
+            if None in key:
+                results[index] = {"index": index, "status": "error", "message": f"{row.op} needs {', '.join(key_fields)}"}
+                continue
+            if key in seen_keys:
+                results[index] = {"index": index, "status": "error", "message": "duplicate key in batch"}
+                continue
+            seen_keys.add(key)
+        ops[row.op].append((index, row))
+    return ops
+
+
+def bulk_response(results: list, error: Optional[str] = None) -> RecordJSONResponse:
+    if error is not None:
+        # the transaction rolled back, nothing from this batch was written
+        results = [result if result and result["status"] == "error" else
+                   {"index": index, "status": "error", "message": "rolled back"}
+                   for index, result in enumerate(results)]
+    counts = {status: sum(1 for result in results if result["status"] == status)
+              for status in ("created", "updated", "deleted", "not_found", "error")}
+    content = {"status": "error" if error is not None else "ok", **counts, "results": results}
+    if error is not None:
+        content["message"] = error
+    return RecordJSONResponse(content=content)
+
+
+# /v1/experts/bulk - POST create/update/delete many experts in one transaction
+@router.post("/v1/experts/bulk")
+async def bulk_experts(request: Request):
+    raw_rows = await read_bulk_rows(request)
+    results = [None] * len(raw_rows)
+    ops = validate_bulk_rows(ExpertBulkRow, raw_rows, ["chapterID", "id"], results)
+    for index, row in ops["create"]:
+        if row.chapterID is None or row.name is None:
+            results[index] = {"index": index, "status": "error", "message": "create needs chapterID and name"}
+    ops["create"] = [(index, row) for index, row in ops["create"] if results[index] is None]
+
+    def values(row, fields, defaults=None):
+        defaults = defaults or {}
+        data = row.model_dump(by_alias=True)
+        return tuple(data[field] if data[field] is not None else defaults.get(field) for field in fields)
+
+    async with get_db_connection() as conn:
+        try:
+            async with conn.transaction():
+                ids = await DBbulk.copy_rows(
+                    conn, 'tableExperts', EXPERT_INSERT_FIELDS,
+                    [values(row, EXPERT_INSERT_FIELDS, EXPERT_BULK_DEFAULTS) for _, row in ops["create"]],
+                    id_column='id')
+                updated = await DBbulk.update_rows(
+                    conn, 'tableExperts', EXPERT_FIELDS, ['chapterID', 'id'],
+                    [values(row, EXPERT_FIELDS) + (row.chapterID, row.id) for _, row in ops["update"]])
+                deleted = await DBbulk.delete_rows(
+                    conn, 'tableExperts', ['chapterID', 'id'], [(row.chapterID, row.id) for _, row in ops["delete"]])
+        except DB_ERRORS as e:
+            return bulk_response(results, error=str(e))
+
+    for (index, row), expert_id in zip(ops["create"], ids):
+        results[index] = {"index": index, "status": "created", "id": expert_id}
+        invalidate_expert(row.chapterID)
+    for op, matched, status in (("update", updated, "updated"), ("delete", deleted, "deleted")):
+        matched = {(record["chapterid"], record["id"]) for record in matched}
+        for index, row in ops[op]:
+            found = (row.chapterID, row.id) in matched
+            results[index] = {"index": index, "status": status if found else "not_found", "id": row.id}
+            if found:
+                invalidate_expert(row.chapterID, row.id)
+    return bulk_response(results)
 
 
 
@@ -221,8 +2472,174 @@ async def read_expert(chapterID: int, recno: int):
 ########################## chapter
 
 
+############################# Chapter tree
+# In-process index of the tableChapters.parentID hierarchy. Loaded once at startup
+# and patched by the chapter write endpoints, so tree walks never touch the DB.
+CHAPTER_TREE_MAX_DEPTH = int(os.getenv("CHAPTER_TREE_MAX_DEPTH", "32"))
+
+
+class ChapterTreeError(Exception):
+    pass
+
+
+class ChapterTree:
+    def __init__(self, max_depth: int = CHAPTER_TREE_MAX_DEPTH):
+        self.max_depth = max_depth
+        self.parent = {}    # chapterID -> parentID (may point at a chapter that no longer exists)
+        self.title = {}     # chapterID -> title
+        self.children = {}  # chapterID -> set of child chapterIDs
+
+    async def load(self, conn):
+        # walk down from the roots; the path array stops cycles, depth stops runaway chains
+        rows = await conn.fetch("""
+            WITH RECURSIVE tree AS (
+                SELECT c.chapterID, c.parentID, c.title, 0 AS depth, ARRAY[c.chapterID] AS path
+                FROM tableChapters c
+                WHERE c.parentID IS NULL
+                   OR NOT EXISTS (SELECT 1 FROM tableChapters p WHERE p.chapterID = c.parentID)
+              UNION ALL
+                SELECT c.chapterID, c.parentID, c.title, t.depth + 1, t.path || c.chapterID
+                FROM tableChapters c
+                JOIN tree t ON c.parentID = t.chapterID
+                WHERE c.chapterID <> ALL(t.path) AND t.depth < $1
+            )
+            SELECT chapterID, parentID, title FROM tree
+        """, self.max_depth)
+        self.parent, self.title, self.children = {}, {}, {}
+        for row in rows:
+            self.add(row["chapterid"], row["parentid"], row["title"])
+
+        # chapters not reachable from a root sit on a parentID cycle (or below the depth limit);
+        # index them anyway so reads work, the walks below guard against looping
+        orphans = await conn.fetch("""
+            SELECT chapterID, parentID, title FROM tableChapters WHERE chapterID <> ALL($1::int[])
+        """, list(self.parent))
+        for row in orphans:
+            self.add(row["chapterid"], row["parentid"], row["title"])
+        if orphans:
+            print_status(f"Chapter tree: {len(orphans)} chapters not reachable from a root "
+                         f"(parentID cycle or deeper than {self.max_depth})", "error")
+        print_status(f"Chapter tree loaded ({len(self.parent)} chapters)", "info")
+
+    def __contains__(self, chapter_id) -> bool:
+        return chapter_id in self.parent
+
+    def copy(self) -> "ChapterTree":
+        tree = ChapterTree(self.max_depth)
+        tree.parent, tree.title = dict(self.parent), dict(self.title)
+        tree.children = {chapter_id: set(children) for chapter_id, children in self.children.items()}
+        return tree
+
+    def add(self, chapter_id: int, parent_id: Optional[int], title: Optional[str]):
+        self.parent[chapter_id] = parent_id
+        self.title[chapter_id] = title
+        self.children.setdefault(chapter_id, set())
+        if parent_id is not None:
+            self.children.setdefault(parent_id, set()).add(chapter_id)
+
+    def move(self, chapter_id: int, parent_id: Optional[int]):
+        old_parent = self.parent.get(chapter_id)
+        if old_parent is not None:
+            self.children.get(old_parent, set()).discard(chapter_id)
+        self.parent[chapter_id] = parent_id
+        if parent_id is not None:
+            self.children.setdefault(parent_id, set()).add(chapter_id)
+
+    def update(self, chapter_id: int, parent_id: Optional[int], title: Optional[str]):
+        if chapter_id not in self.parent:
+            self.add(chapter_id, parent_id, title)
+            return
+        self.move(chapter_id, parent_id)
+        self.title[chapter_id] = title
+
+    def remove(self, chapter_id: int):
+        # children become roots, as fk_chapters_parent sets their parentID to NULL
+        self.move(chapter_id, None)
+        for child in self.children.pop(chapter_id, set()):
+            if child in self.parent:
+                self.parent[child] = None
+        self.parent.pop(chapter_id, None)
+        self.title.pop(chapter_id, None)
+
+    def is_root(self, chapter_id: int) -> bool:
+        return self.parent.get(chapter_id) not in self.parent
+
+    def node(self, chapter_id: int) -> dict:
+        return {"chapterID": chapter_id, "parentID": self.parent[chapter_id], "title": self.title[chapter_id]}
+
+    def roots(self) -> list:
+        return sorted(chapter_id for chapter_id in self.parent if self.is_root(chapter_id))
+
+    def child_ids(self, chapter_id: int) -> list:
+        return sorted(child for child in self.children.get(chapter_id, ()) if child in self.parent)
+
+    def ancestor_ids(self, chapter_id: int) -> list:
+        """chapterIDs from the root down to chapter_id (inclusive)."""
+        path, seen = [], set()
+        current = chapter_id
+        while current in self.parent and current not in seen and len(path) <= self.max_depth:
+            seen.add(current)
+            path.append(current)
+            current = self.parent[current]
+        path.reverse()
+        return path
+
+    def depth(self, chapter_id: int) -> int:
+        return len(self.ancestor_ids(chapter_id)) - 1
+
+    def height(self, chapter_id: int) -> int:
+        level, frontier, seen = 0, [chapter_id], {chapter_id}
+        while level < self.max_depth:
+            frontier = [child for node in frontier for child in self.child_ids(node) if child not in seen]
+            if not frontier:
+                break
+            seen.update(frontier)
+            level += 1
+        return level
+
+    def subtree(self, chapter_id: int, depth: Optional[int] = None) -> dict:
+        depth = self.max_depth if depth is None else min(depth, self.max_depth)
+        root = self.node(chapter_id)
+        frontier, seen = [root], {chapter_id}
+        for _ in range(depth):
+            next_frontier = []
+            for node in frontier:
+                node["children"] = []
+                for child in self.child_ids(node["chapterID"]):
+                    if child in seen:
+                        continue
+                    seen.add(child)
+                    child_node = self.node(child)
+                    node["children"].append(child_node)
+                    next_frontier.append(child_node)
+            frontier = next_frontier
+            if not frontier:
+                break
+        return root
+
+    def subtree_ids(self, chapter_id: int) -> list:
+        ids, frontier, seen = [chapter_id], [chapter_id], {chapter_id}
+        for _ in range(self.max_depth):
+            frontier = [child for node in frontier for child in self.child_ids(node) if child not in seen]
+            if not frontier:
+                break
+            seen.update(frontier)
+            ids.extend(frontier)
+        return ids
+
+    def check_parent(self, chapter_id: Optional[int], parent_id: Optional[int]):
+        """Raise ChapterTreeError if hanging chapter_id under parent_id makes a cycle or breaks the depth limit."""
+        if parent_id is None:
+            return
+        if chapter_id is not None and chapter_id in self.ancestor_ids(parent_id):
+            raise ChapterTreeError(f"chapter {parent_id} is a descendant of {chapter_id}, parentID would create a cycle")
+        height = self.height(chapter_id) if chapter_id in self.parent else 0
+        if self.depth(parent_id) + 1 + height > self.max_depth:
+            raise ChapterTreeError(f"chapter tree would exceed the depth limit of {self.max_depth}")
+
+
 # Create chapter
-@app.put("/v1/chapters/create")
+@router.put("/v1/chapters/create")
 async def create_chapter(
         domainID: Optional[int] = None,
         parentID: Optional[int] = None,
@@ -234,78 +2651,145 @@ async def create_chapter(
         enableExpert: Optional[int] = 0,
         enableAdd: Optional[int] = 0,
         playlist: Optional[str] = None,
-        budget: Optional[float] = None
+        budget: Optional[Decimal] = None  # parsed exactly; a float would reach NUMERIC as its binary expansion
 ):
     params = [
         domainID, parentID, title, enableVideo, enableImage, enableWiki, enableChat, enableExpert, enableAdd, playlist,
         budget
     ]
-    columns = [
-        key for key, value in zip([
-            'domainID', 'parentID', 'title', 'enableVideo', 'enableImage', 'enableWiki', 'enableChat', 'enableExpert',
-            'enableAdd', 'playlist', 'budget'
-        ], params) if value is not None
-    ]
-    placeholders = [f"%s" for _ in columns]
 
-    query = f"""
-        INSERT INTO tableChapters ({', '.join(columns)})
-        VALUES ({', '.join(placeholders)})
-        RETURNING chapterID;
-    """
-    params = [param for param in params if param is not None]
+    tree = app_state.get().chapter_tree
+    try:
+        tree.check_parent(None, parentID)
+    except ChapterTreeError as e:
+        return RecordJSONResponse(content={"status": "error", "message": str(e)})
 
-    result = execute_query(query, tuple(params))
-    if result:
-        chapter_id = result["chapterid"]
-        print_status(f"Chapter {chapter_id} created successfully.", "success")
-        return JSONResponse(content={"status": f"error {str(e)}"})
-    return JSONResponse(content={"status": "error", "message": "Failed to create chapter"})
+    async with get_db_connection() as conn:
+        try:
+            async with conn.transaction():
+                row = await conn.fetchrow(statements.get("chapter_insert", conn), *params)
+        except DB_ERRORS as e:
+            logger.error("Error creating chapter: %s", e)
+            return RecordJSONResponse(content={"status": f"error {str(e)}"})
+    chapter_id = row["chapterid"]
+    tree.add(chapter_id, row["parentid"], row["title"])
+    invalidate_chapter(chapter_id)
+    logger.debug("Chapter %s created successfully.", chapter_id)
+    return {"status": "success", "chapterID": chapter_id}
 
 
 # Read chapter by ID
-@app.get("/v1/chapters/read")
-async def get_chapter(chapter_id: int):
+@router.get("/v1/chapters/read")
+async def get_chapter(request: Request, chapter_id: int):
     query = """
-        SELECT * FROM tableChapters WHERE chapterID = %s;
+        SELECT * FROM tableChapters WHERE chapterID = $1;
     """
-    result = execute_query(query, (chapter_id,))
-    if result:
-        print_status(f"Chapter {chapter_id} retrieved successfully.", "success")
-        return {"status": "success", "data": result}
-    print_status(f"Chapter {chapter_id} not found.", "info")
-    return JSONResponse(content={"status": "error", "message": "Chapter not found"})
+    etag = make_etag("chapters", await app_state.get().versions.get("chapters"), chapter_id)
+    if (response := not_modified(request, etag)) is not None:
+        return response
+    cache = app_state.get().read_cache
+    key = ("chapter", chapter_id)
+    chapter = cache.get(key)
+    if chapter is not MISSING:
+        return RecordJSONResponse(content={"status": "success", "data": chapter}, headers=conditional_headers(etag))
+
+    async def fetch():
+        generation = cache.generation
+        async with get_read_connection("chapters") as conn:
+            try:
+                row = await conn.fetchrow(query, chapter_id)
+            except DB_ERRORS as e:
+                logger.error("Error reading chapter %s: %s", chapter_id, e)
+                return RecordJSONResponse(content={"status": f"error {str(e)}"})
+        if row:
+            logger.debug("Chapter %s retrieved successfully.", chapter_id)
+            cache.set(key, row, generation=generation)
+            return RecordJSONResponse(content={"status": "success", "data": row}, headers=conditional_headers(etag))
+        logger.debug("Chapter %s not found.", chapter_id)
+        return RecordJSONResponse(content={"status": "error", "message": "Chapter not found"},
+                                  headers=conditional_headers(etag))
+
+    return await coalesce(("chapters/read", etag), fetch)
+
+
+# Read many chapters by ID, e.g. ?ids=1,2,3
+@router.get("/v1/chapters/read_many")
+async def read_chapters_many(ids: list[str] = Query(...)):
+    keys = parse_read_many_ids(ids, pairs=False)
+    try:
+        found = await read_many(
+            keys,
+            cache_key=lambda key: ("chapter", key),
+            row_key=lambda row: row["chapterid"],
+            query="SELECT * FROM tableChapters WHERE chapterID = ANY($1::int[])",
+            ids=list,
+            scopes=lambda misses: ("chapters",),
+        )
+    except DB_ERRORS as e:
+        logger.error("Error reading chapters: %s", e)
+        return RecordJSONResponse(content={"status": f"error {str(e)}"})
+    return read_many_response(keys, found, str)
 
 
 # List chapters by ID
-@app.get("/v1/chapters/list")
-async def list_chapters(chapter_id: Optional[int] = None):
+@router.get("/v1/chapters/list")
+async def list_chapters(request: Request, chapter_id: Optional[int] = None,
+                        limit: int = Query(PAGE_LIMIT_DEFAULT, ge=1, le=PAGE_LIMIT_MAX),
+                        cursor: Optional[str] = None, stream: bool = False):
     if chapter_id is not None:
         query = """
-            SELECT * FROM tableChapters WHERE chapterID = %s;
+            SELECT * FROM tableChapters WHERE chapterID = $1;
         """
         params = (chapter_id,)
+    elif stream:
+        query = """
+            SELECT * FROM tableChapters WHERE chapterID > $1 ORDER BY chapterID;
+        """
+        params = (decode_cursor(cursor),)
     else:
         query = """
-            SELECT * FROM tableChapters;
+            SELECT * FROM tableChapters WHERE chapterID > $1 ORDER BY chapterID LIMIT $2;
         """
-        params = ()
+        params = (decode_cursor(cursor), limit + 1)
 
-    try:
-        cursor.execute(query, params)
-        chapters = cursor.fetchall()
-        if chapters:
-            print_status("Chapters retrieved successfully.", "success")
-            return {"status": "success", "data": chapters}
-        print_status("No chapters found.", "info")
-        return JSONResponse(content={"status": "error", "message": "No chapters found"})
-    except Exception as e:
-        print_status(f"Error retrieving chapters: {str(e)}", "error")
-        return JSONResponse(content={"status": f"error {str(e)}"})
+    if stream:
+        return StreamingResponse(stream_ndjson("chapters", query, *params), media_type="application/x-ndjson")
+
+    etag = make_etag("chapters", await app_state.get().versions.get("chapters"), *params)
+    cache = app_state.get().read_cache
+    key = ("chapters",) + params
+    cached = cache.get(key)
+    if cached is not MISSING:
+        chapters, headers = cached
+        return not_modified(request, etag, headers) or RecordJSONResponse(
+            content={"status": "success", "data": chapters}, headers=conditional_headers(etag, headers))
+    if (response := not_modified(request, etag)) is not None:
+        return response
+
+    async def fetch():
+        generation = cache.generation
+        async with get_read_connection("chapters") as conn:
+            try:
+                rows = await conn.fetch(query, *params)
+            except DB_ERRORS as e:
+                logger.error("Error retrieving chapters: %s", e)
+                return RecordJSONResponse(content={"status": f"error {str(e)}"})
+        if rows:
+            logger.debug("Chapters retrieved successfully.")
+            chapters = rows[:limit]
+            headers = next_cursor_headers(rows, limit, "chapterid")
+            cache.set(key, (chapters, headers), group=("chapters",), generation=generation)
+            return RecordJSONResponse(content={"status": "success", "data": chapters},
+                                      headers=conditional_headers(etag, headers))
+        logger.debug("No chapters found.")
+        return RecordJSONResponse(content={"status": "error", "message": "No chapters found"},
+                                  headers=conditional_headers(etag))
+
+    return await coalesce(("chapters/list", etag), fetch)
 
 
 # Update chapter
-@app.put("/v1/chapters/update")
+@router.put("/v1/chapters/update")
 async def update_chapter(
         chapter_id: int,
         domainID: Optional[int] = None,
@@ -318,54 +2802,847 @@ async def update_chapter(
         enableExpert: Optional[int] = None,
         enableAdd: Optional[int] = None,
         playlist: Optional[str] = None,
-        budget: Optional[float] = None
+        budget: Optional[Decimal] = None  # parsed exactly; a float would reach NUMERIC as its binary expansion
 ):
     params = [
         domainID, parentID, title, enableVideo, enableImage, enableWiki, enableChat, enableExpert, enableAdd, playlist,
         budget
     ]
-    fields_to_update = {
-        key: value for key, value in zip([
-            'domainID', 'parentID', 'title', 'enableVideo', 'enableImage', 'enableWiki', 'enableChat', 'enableExpert',
-            'enableAdd', 'playlist', 'budget'
-        ], params) if value is not None
-    }
+    if all(param is None for param in params):
+        return RecordJSONResponse(content={"status": "error", "message": "No fields to update"})
 
-    if not fields_to_update:
-        return JSONResponse(content={"status": "error", "message": "No fields to update"})
+    params = params + [chapter_id]
 
-    set_clause = ", ".join([f"{key} = %s" for key in fields_to_update.keys()])
-    query = f"""
-        UPDATE tableChapters
-        SET {set_clause}
-        WHERE chapterID = %s
-        RETURNING chapterID;
-    """
-    params = list(fields_to_update.values()) + [chapter_id]
+    tree = app_state.get().chapter_tree
+    try:
+        tree.check_parent(chapter_id, parentID)
+    except ChapterTreeError as e:
+        return RecordJSONResponse(content={"status": "error", "message": str(e)})
 
-    result = execute_query(query, tuple(params))
-    if result:
-        updated_chapter_id = result["chapterid"]
-        print_status(f"Chapter {updated_chapter_id} updated successfully.", "success")
+    async with get_db_connection() as conn:
+        try:
+            async with conn.transaction():
+                row = await conn.fetchrow(statements.get("chapter_update", conn), *params)
+        except DB_ERRORS as e:
+            logger.error("Error updating chapter %s: %s", chapter_id, e)
+            return RecordJSONResponse(content={"status": f"error {str(e)}"})
+    if row is not None:
+        updated_chapter_id = row["chapterid"]
+        tree.update(updated_chapter_id, row["parentid"], row["title"])
+        invalidate_chapter(updated_chapter_id)
+        logger.debug("Chapter %s updated successfully.", updated_chapter_id)
         return {"status": "success", "chapterID": updated_chapter_id}
-    return JSONResponse(content={"status": "error", "message": "Failed to update chapter"})
+    return RecordJSONResponse(content={"status": "error", "message": "Failed to update chapter"})
 
 
 # Delete chapter
-@app.delete("/v1/chapters/delete")
+@router.delete("/v1/chapters/delete")
 async def delete_chapter(chapter_id: int):
     query = """
-        DELETE FROM tableChapters WHERE chapterID = %s RETURNING chapterID;
+        DELETE FROM tableChapters WHERE chapterID = $1 RETURNING chapterID;
     """
-    result = execute_query(query, (chapter_id,))
-    if result:
-        deleted_chapter_id = result["chapterid"]
-        print_status(f"Chapter {deleted_chapter_id} deleted successfully.", "success")
+    async with get_db_connection() as conn:
+        try:
+            async with conn.transaction():
+                deleted_chapter_id = await conn.fetchval(query, chapter_id)
+        except asyncpg.ForeignKeyViolationError:
+            return RecordJSONResponse(content={
+                "status": "error", "message": "Chapter still has experts or helpitems; move or delete them first"})
+        except DB_ERRORS as e:
+            logger.error("Error deleting chapter %s: %s", chapter_id, e)
+            return RecordJSONResponse(content={"status": f"error {str(e)}"})
+    if deleted_chapter_id is not None:
+        app_state.get().chapter_tree.remove(deleted_chapter_id)
+        invalidate_chapter(deleted_chapter_id)
+        logger.debug("Chapter %s deleted successfully.", deleted_chapter_id)
         return {"status": "success", "chapterID": deleted_chapter_id}
-    print_status(f"Chapter {chapter_id} not found.", "info")
-    return JSONResponse(content={"status": "error", "message": "Chapter not found or failed to delete"})
+    logger.debug("Chapter %s not found.", chapter_id)
+    return RecordJSONResponse(content={"status": "error", "message": "Chapter not found or failed to delete"})
+
+
+# /v1/chapters/bulk - POST create/update/delete many chapters in one transaction
+@router.post("/v1/chapters/bulk")
+async def bulk_chapters(request: Request):
+    raw_rows = await read_bulk_rows(request)
+    results = [None] * len(raw_rows)
+    ops = validate_bulk_rows(ChapterBulkRow, raw_rows, ["chapterID"], results)
+    tree = app_state.get().chapter_tree
+    # rows are checked in order against a copy of the tree with the earlier accepted rows
+    # applied, so two moves that are fine one by one cannot make a cycle or a too-deep
+    # branch together; new chapters stand in under negative ids until they get theirs
+    working = tree.copy()
+    for index, op, row in sorted((index, op, row) for op in ("create", "update") for index, row in ops[op]):
+        chapter_id = row.chapterID if op == "update" else -1 - index
+        try:
+            working.check_parent(chapter_id if op == "update" else None, row.parentID)
+        except ChapterTreeError as e:
+            results[index] = {"index": index, "status": "error", "message": str(e)}
+            continue
+        if op == "create":
+            working.add(chapter_id, row.parentID, row.title)
+        elif row.parentID is not None:
+            working.move(chapter_id, row.parentID)
+    for op in ("create", "update"):
+        ops[op] = [(index, row) for index, row in ops[op] if results[index] is None]
+
+    def values(row, defaults=None):
+        defaults = defaults or {}
+        data = row.model_dump()
+        return tuple(data[field] if data[field] is not None else defaults.get(field) for field in CHAPTER_FIELDS)
+
+    async with get_db_connection() as conn:
+        try:
+            async with conn.transaction():
+                ids = await DBbulk.copy_rows(
+                    conn, 'tableChapters', CHAPTER_FIELDS,
+                    [values(row, CHAPTER_BULK_DEFAULTS) for _, row in ops["create"]], id_column='chapterID')
+                updated = await DBbulk.update_rows(
+                    conn, 'tableChapters', CHAPTER_FIELDS, ['chapterID'],
+                    [values(row) + (row.chapterID,) for _, row in ops["update"]], returning=['parentID', 'title'])
+                deleted = await DBbulk.delete_rows(
+                    conn, 'tableChapters', ['chapterID'], [(row.chapterID,) for _, row in ops["delete"]])
+        except DB_ERRORS as e:
+            logger.error("Error in chapter bulk: %s", e)
+            return bulk_response(results, error=str(e))
+
+    for (index, row), chapter_id in zip(ops["create"], ids):
+        results[index] = {"index": index, "status": "created", "chapterID": chapter_id}
+        tree.add(chapter_id, row.parentID, row.title)
+        invalidate_chapter(chapter_id)
+    updated = {record["chapterid"]: record for record in updated}
+    for index, row in ops["update"]:
+        record = updated.get(row.chapterID)
+        results[index] = {"index": index, "status": "updated" if record else "not_found", "chapterID": row.chapterID}
+        if record:
+            tree.update(row.chapterID, record["parentid"], record["title"])
+            invalidate_chapter(row.chapterID)
+    deleted = {record["chapterid"] for record in deleted}
+    for index, row in ops["delete"]:
+        found = row.chapterID in deleted
+        results[index] = {"index": index, "status": "deleted" if found else "not_found", "chapterID": row.chapterID}
+        if found:
+            tree.remove(row.chapterID)
+            invalidate_chapter(row.chapterID)
+    return bulk_response(results)
+
+
+def chapter_not_found():
+    return RecordJSONResponse(content={"status": "error", "message": "Chapter not found"})
+
+
+# /v1/chapters/children - GET direct children of a chapter, or the root chapters if no chapter_id
+@router.get("/v1/chapters/children")
+async def chapter_children(chapter_id: Optional[int] = None):
+    tree = app_state.get().chapter_tree
+    if chapter_id is None:
+        return {"status": "success", "data": [tree.node(root) for root in tree.roots()]}
+    if chapter_id not in tree:
+        return chapter_not_found()
+    return {"status": "success", "data": [tree.node(child) for child in tree.child_ids(chapter_id)]}
+
+
+# /v1/chapters/ancestors - GET breadcrumb from the root down to the chapter
+@router.get("/v1/chapters/ancestors")
+async def chapter_ancestors(chapter_id: int):
+    tree = app_state.get().chapter_tree
+    if chapter_id not in tree:
+        return chapter_not_found()
+    return {"status": "success", "data": [tree.node(node) for node in tree.ancestor_ids(chapter_id)]}
+
+
+# /v1/chapters/subtree - GET nested chapter tree below a chapter, optionally limited in depth
+@router.get("/v1/chapters/subtree")
+async def chapter_subtree(chapter_id: int, depth: Optional[int] = Query(None, ge=0)):
+    tree = app_state.get().chapter_tree
+    if chapter_id not in tree:
+        return chapter_not_found()
+    return {"status": "success", "data": tree.subtree(chapter_id, depth)}
+
+
+# Chapter stats come from tableChapterStats, one row per (chapterID, metric) kept up to
+# date by triggers on the expert, helpitem and chapter tables (createDB.py migration 11).
+# A subtree is summed over the chapter IDs the in-memory tree lists below the chapter.
+CHAPTER_STAT_FIELDS = {
+    "experts": ("experts", "total"),
+    "experts_online": ("experts", "online"),
+    "experts_type": ("experts", "type"),
+    "helpitems": ("helpitems", "total"),
+    "helpitems_kind": ("helpitems", "kind"),
+    "votes_up": ("votes", "up"),
+    "votes_down": ("votes", "down"),
+    "chapter_budget": ("budget", "chapter"),
+    "helpitems_budget": ("budget", "helpitems"),
+}
+
+
+def chapter_stats_body(rows) -> dict:
+    body = {"experts": {"total": 0, "online": {}, "type": {}}, "helpitems": {"total": 0, "kind": {}},
+            "votes": {"up": 0, "down": 0}, "budget": {"chapter": Decimal(0), "helpitems": Decimal(0)}}
+    for metric, value in rows:
+        name, labelled, label = metric.partition(":")
+        field = CHAPTER_STAT_FIELDS.get(name)
+        if field is None or value == 0:
+            continue
+        group, key = field
+        # budgets stay Decimal, sent as exact strings like every NUMERIC value
+        value = value if group == "budget" else int(value)
+        if labelled:
+            body[group][key][label] = value
+        else:
+            body[group][key] = value
+    body["budget"]["total"] = body["budget"]["chapter"] + body["budget"]["helpitems"]
+    return body
+
+
+# /v1/chapters/stats - GET expert/helpitem counts, votes and budgets of a chapter, and of its subtree with subtree=true
+@router.get("/v1/chapters/stats")
+async def chapter_stats(chapter_id: int, subtree: bool = False):
+    tree = app_state.get().chapter_tree
+    if chapter_id not in tree:
+        return chapter_not_found()
+    async with get_read_connection("chapters", f"experts:{chapter_id}") as conn:
+        try:
+            rows = await conn.fetch("SELECT metric, value FROM tableChapterStats WHERE chapterID = $1", chapter_id)
+            if subtree:
+                chapter_ids = tree.subtree_ids(chapter_id)
+                subtree_rows = await conn.fetch("""
+                    SELECT metric, sum(value) FROM tableChapterStats
+                    WHERE chapterID = ANY($1::int[]) GROUP BY metric
+                """, chapter_ids)
+        except DB_ERRORS as e:
+            logger.error("Error reading stats of chapter %s: %s", chapter_id, e)
+            return RecordJSONResponse(content={"status": f"error {str(e)}"})
+    body = {"status": "success", "chapterID": chapter_id, "data": chapter_stats_body(rows)}
+    if subtree:
+        body["subtree"] = {"chapters": len(chapter_ids), **chapter_stats_body(subtree_rows)}
+    # not returned as a dict: FastAPI's jsonable_encoder would turn the Decimals into floats
+    return RecordJSONResponse(content=body)
+
+
+########################## helpitems
+# /v1/helpitems/feed pages through a chapter's items by score, the Wilson lower
+# bound of voteup/votedown kept in a generated column (createDB.py migration 8) and
+# indexed as (chapterID, score DESC, itemID DESC), so every page is an index range
+# scan from the cursor. kind/language/state are checked on the rows as they come.
+FEED_LIMIT_DEFAULT = int(os.getenv("FEED_LIMIT_DEFAULT", "20"))
+FEED_LIMIT_MAX = int(os.getenv("FEED_LIMIT_MAX", "100"))
+
+
+def helpitem_feed_query(chapterID: int, after: Optional[tuple], limit: int, kind: Optional[int] = None,
+                        language: Optional[str] = None, state: Optional[int] = None):
+    conditions = ["chapterID = $1"]
+    params = [chapterID]
+
+    def param(value) -> str:
+        params.append(value)
+        return f"${len(params)}"
+
+    if kind is not None:
+        conditions.append(f"kind = {param(kind)}")
+    if language is not None:
+        conditions.append(f"language = {param(language)}")
+    if state is not None:
+        conditions.append(f"state = {param(state)}")
+    if after is not None:
+        conditions.append(f"(score, itemID) < ({param(after[0])}, {param(after[1])})")
+    query = f"""
+        SELECT {HELPITEM_COLUMNS}, score FROM tableHelpitems
+        WHERE {' AND '.join(conditions)}
+        ORDER BY score DESC, itemID DESC
+        LIMIT {param(limit + 1)}
+    """
+    return query, params
+
+
+# /v1/helpitems/feed - GET request for a chapter's helpitems, best voted first
+@router.get("/v1/helpitems/feed")
+async def helpitem_feed(chapterID: int, kind: Optional[int] = None, language: Optional[str] = None,
+                        state: Optional[int] = None,
+                        limit: int = Query(FEED_LIMIT_DEFAULT, ge=1, le=FEED_LIMIT_MAX),
+                        cursor: Optional[str] = None):
+    after = decode_keyset_cursor(cursor, float)
+    query, params = helpitem_feed_query(chapterID, after, limit, kind=kind, language=language, state=state)
+    async with get_db_connection() as conn:
+        try:
+            rows = await conn.fetch(query, *params)
+        except DB_ERRORS as e:
+            return RecordJSONResponse(content={"status": f"error {str(e)}"})
+    headers = {}
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        headers["X-Next-Cursor"] = encode_cursor([repr(last["score"]), last["itemid"]])
+    # score is only read for the cursor
+    items = [{key: value for key, value in row.items() if key != "score"} for row in rows[:limit]]
+    return RecordJSONResponse(content=items, headers=headers)
+
+
+############################# Votes
+# Votes are added up per item in memory and written by one batched UPDATE every
+# VOTE_FLUSH_INTERVAL seconds (sooner once half of VOTE_MAX_BUFFERED votes are
+# waiting), instead of one row-locking UPDATE and WAL record per click. Shutdown
+# flushes what is left; a crash loses at most the votes of the current interval.
+VOTE_FLUSH_INTERVAL = float(os.getenv("VOTE_FLUSH_INTERVAL", "1.0"))
+VOTE_MAX_BUFFERED = int(os.getenv("VOTE_MAX_BUFFERED", "100000"))
+VOTE_SHUTDOWN_ATTEMPTS = 3
+
+
+class VoteBufferFull(Exception):
+    pass
+
+
+class VoteBuffer:
+    def __init__(self, pool, flush_interval: float = VOTE_FLUSH_INTERVAL, max_buffered: int = VOTE_MAX_BUFFERED):
+        self.pool = pool
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self.pending = {}   # itemID -> [voteup delta, votedown delta]
+        self.buffered = 0   # votes in pending
+        self.wakeup = asyncio.Event()
+        self.stopping = False
+        self.task = None
+        self.accepted = self.rejected = self.flushes = self.flushed_votes = self.unknown_items = 0
+        self.flush_errors = 0
+
+    def add(self, item_id: int, up: int, down: int):
+        if self.buffered >= self.max_buffered:
+            # the database is not keeping up (or is down): push back instead of growing
+            self.rejected += 1
+            raise VoteBufferFull(f"{self.buffered} votes waiting to be written")
+        deltas = self.pending.get(item_id)
+        if deltas is None:
+            self.pending[item_id] = [up, down]
+        else:
+            deltas[0] += up
+            deltas[1] += down
+        self.buffered += 1
+        self.accepted += 1
+        if self.buffered >= self.max_buffered // 2:
+            self.wakeup.set()
+
+    async def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self.stopping = True
+        self.wakeup.set()
+        if self.task:
+            await self.task
+        # votes that came in during the last flush, or that a failed flush put back
+        for _ in range(VOTE_SHUTDOWN_ATTEMPTS):
+            if await self.flush():
+                break
+        if self.buffered:
+            print_status(f"Vote buffer: {self.buffered} votes could not be written before shutdown", "error")
+
+    async def _run(self):
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> bool:
+        if not self.pending:
+            return True
+        pending, self.pending = self.pending, {}
+        buffered, self.buffered = self.buffered, 0
+        item_ids = sorted(pending)
+        try:
+            async with self.pool.acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT) as conn:
+                async with conn.transaction():
+                    # lock in itemID order, so workers flushing overlapping items cannot deadlock
+                    await conn.execute("""
+                        SELECT 1 FROM tableHelpitems WHERE itemID = ANY($1::int[]) ORDER BY itemID FOR UPDATE
+                    """, item_ids)
+                    updated = await DBbulk.increment_rows(
+                        conn, 'tableHelpitems', ['voteup', 'votedown'], ['itemID'],
+                        [(pending[item_id][0], pending[item_id][1], item_id) for item_id in item_ids])
+        except Exception as e:
+            # keep the deltas; they go out with the next flush
+            for item_id, (up, down) in pending.items():
+                deltas = self.pending.setdefault(item_id, [0, 0])
+                deltas[0] += up
+                deltas[1] += down
+            self.buffered += buffered
+            self.flush_errors += 1
+            print_status(f"Vote flush failed, {self.buffered} votes kept for retry: {str(e)}", "error")
+            return False
+        self.flushes += 1
+        self.flushed_votes += buffered
+        self.unknown_items += len(item_ids) - len(updated)
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "pending_items": len(self.pending),
+            "pending_votes": self.buffered,
+            "max_buffered": self.max_buffered,
+            "flush_interval": self.flush_interval,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "flushes": self.flushes,
+            "flushed_votes": self.flushed_votes,
+            "flush_errors": self.flush_errors,
+            "unknown_items": self.unknown_items,
+        }
+
+
+async def vote_buffer_full_handler(request: Request, exc: VoteBufferFull):
+    note_error("VoteBufferFull")
+    return RecordJSONResponse(status_code=503, content={"status": "error", "message": str(exc)},
+                              headers={"Retry-After": str(max(1, round(VOTE_FLUSH_INTERVAL)))})
+
+
+# /v1/helpitems/vote - POST request to vote a helpitem up or down, written within VOTE_FLUSH_INTERVAL
+@router.post("/v1/helpitems/vote")
+async def vote_helpitem(itemID: int, vote: Literal["up", "down"]):
+    app_state.get().vote_buffer.add(itemID, 1 if vote == "up" else 0, 1 if vote == "down" else 0)
+    return {"status": "ok"}
+
+
+# /v1/votes/stats - GET request for vote buffer counters of this worker
+@router.get("/v1/votes/stats")
+async def vote_stats():
+    return RecordJSONResponse(content=app_state.get().vote_buffer.stats())
+
+
+############################# Uploads
+# POST /v1/helpitems/upload streams the file part of a multipart body to UPLOAD_DIR:
+# the body is parsed as it arrives and written out in UPLOAD_CHUNK_SIZE pieces (from a
+# thread, hashed on the way), so memory per upload stays around one chunk whatever the
+# file size. Files are stored by sha256; a file that is already there is not stored
+# twice. The item is saved with uploadstate pending and an UploadWorkers pool moves it
+# to the media host in the background.
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(10 * 1024 ** 3)))
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "2"))
+UPLOAD_POLL_INTERVAL = float(os.getenv("UPLOAD_POLL_INTERVAL", "5"))
+# an item still processing this long after its claim is taken back (its server died)
+UPLOAD_CLAIM_TIMEOUT = float(os.getenv("UPLOAD_CLAIM_TIMEOUT", "3600"))
+UPLOAD_HOST = os.getenv("UPLOAD_HOST", "local")
+UPLOAD_HOST_DIR = os.getenv("UPLOAD_HOST_DIR", "media-host")
+UPLOAD_HOST_NAME = os.getenv("UPLOAD_HOST_NAME", "localhost")
+
+# tableHelpitems.uploadstate; 1 is the older "requires upload" flag for items without a local file
+UPLOAD_NONE, UPLOAD_REQUIRED, UPLOAD_PENDING, UPLOAD_PROCESSING, UPLOAD_DONE, UPLOAD_FAILED = range(6)
+UPLOAD_KINDS = {1: ("videofn", "videoid"), 2: ("imagefn", "imageid")}  # kind -> (file column, host id column)
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class MultipartFileWriter:
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+        self.hasher = hashlib.sha256()
+        self.buffer = bytearray()
+        self.size = 0
+        self.filename = None
+        self.found = False
+        self.in_file = False
+        self.headers = {}
+        self.header_field = self.header_value = b""
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self):
+        self.headers = {}
+
+    def on_header_field(self, data, start, end):
+        self.header_field += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self.header_value += data[start:end]
+
+    def on_header_end(self):
+        self.headers[self.header_field.lower()] = self.header_value
+        self.header_field = self.header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self.headers.get(b"content-disposition", b""))
+        # the first part named "file" that carries a filename is the upload; other parts are skipped
+        if options.get(b"name") == b"file" and b"filename" in options and not self.found:
+            self.found = self.in_file = True
+            self.filename = options[b"filename"].decode("utf-8", "replace")
+
+    def on_part_data(self, data, start, end):
+        if self.in_file:
+            self.buffer += data[start:end]
+            self.size += end - start
+            if self.size > UPLOAD_MAX_BYTES:
+                raise UploadTooLarge(f"uploads are limited to {UPLOAD_MAX_BYTES} bytes")
+
+    def on_part_end(self):
+        self.in_file = False
+
+    def _write(self, data: bytes):
+        if self.file is None:
+            self.file = open(self.path, "wb")
+        self.hasher.update(data)
+        self.file.write(data)
+
+    async def flush(self, force: bool = False):
+        if self.buffer and (force or len(self.buffer) >= UPLOAD_CHUNK_SIZE):
+            data = bytes(self.buffer)
+            self.buffer.clear()
+            await asyncio.to_thread(self._write, data)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+async def receive_upload(request: Request) -> MultipartFileWriter:
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise HTTPException(status_code=400, detail="expected a multipart/form-data body")
+    os.makedirs(os.path.join(UPLOAD_DIR, "tmp"), exist_ok=True)
+    writer = MultipartFileWriter(os.path.join(UPLOAD_DIR, "tmp", f"{uuid.uuid4().hex}.part"))
+    parser = MultipartParser(options[b"boundary"], writer.callbacks())
+    done = False
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            await writer.flush()
+        parser.finalize()
+        await writer.flush(force=True)
+        done = True
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ClientDisconnect:
+        raise HTTPException(status_code=400, detail="upload interrupted")
+    finally:
+        writer.close()
+        if not done and os.path.exists(writer.path):
+            os.remove(writer.path)
+    if not writer.found:
+        raise HTTPException(status_code=400, detail='no file part named "file"')
+    if not os.path.exists(writer.path):
+        open(writer.path, "wb").close()  # empty file
+    return writer
+
+
+def store_upload(writer: MultipartFileWriter) -> tuple:
+    # content-addressed: <UPLOAD_DIR>/ab/abcd...<ext>; returns (relative path, already stored)
+    sha = writer.hasher.hexdigest()
+    ext = os.path.splitext(writer.filename or "")[1].lower()
+    ext = ext if re.fullmatch(r"\.[a-z0-9]{1,10}", ext) else ""
+    relative = os.path.join(sha[:2], sha + ext)
+    path = os.path.join(UPLOAD_DIR, relative)
+    if os.path.exists(path):
+        os.remove(writer.path)
+        return relative, True
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(writer.path, path)
+    return relative, False
+
+
+def discard_upload(relative: str):
+    # a file store_upload just added that no helpitem ended up pointing to
+    try:
+        os.remove(os.path.join(UPLOAD_DIR, relative))
+    except FileNotFoundError:
+        pass
+
+
+# Media hosts the upload workers hand files to, selected by UPLOAD_HOST. store() returns
+# the id the host knows the file by (imageid / videoid).
+upload_hosts = {}
+
+
+def upload_host(name: str):
+    def register(cls):
+        upload_hosts[name] = cls
+        return cls
+    return register
+
+
+def make_upload_host():
+    if UPLOAD_HOST not in upload_hosts:
+        raise RuntimeError(f"unknown UPLOAD_HOST {UPLOAD_HOST!r}, known: {', '.join(sorted(upload_hosts))}")
+    return upload_hosts[UPLOAD_HOST]()
+
+
+@upload_host("local")
+class LocalUploadHost:
+    """Stand-in for the real media host: copies the file into UPLOAD_HOST_DIR."""
+
+    name = UPLOAD_HOST_NAME
+
+    async def store(self, path: str, kind: int, sha256: str) -> str:
+        target = os.path.join(UPLOAD_HOST_DIR, sha256 + os.path.splitext(path)[1])
+        os.makedirs(UPLOAD_HOST_DIR, exist_ok=True)
+        await asyncio.to_thread(shutil.copyfile, path, target)
+        return sha256
+
+
+# UPLOAD_WORKERS tasks take items from a queue that never holds more than they can start
+# on; a poller claims pending items (FOR UPDATE SKIP LOCKED, so several papi2 processes
+# share the work) when woken by an upload or every UPLOAD_POLL_INTERVAL seconds. Items
+# still claimed at shutdown go back to pending.
+class UploadWorkers:
+    def __init__(self, pool, host, workers: int = UPLOAD_WORKERS, poll_interval: float = UPLOAD_POLL_INTERVAL):
+        self.pool = pool
+        self.host = host
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.queue = asyncio.Queue(maxsize=workers)
+        self.wakeup = asyncio.Event()
+        self.claimed = set()
+        self.tasks = []
+        self.busy = 0
+        self.received = self.received_bytes = self.deduplicated = 0
+        self.processed = self.reused = self.failed = 0
+
+    async def start(self):
+        self.tasks = [asyncio.create_task(self._poll())] + [
+            asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.claimed:
+            async with self.pool.acquire() as conn:
+                await conn.execute(
+                    "UPDATE tableHelpitems SET uploadstate = $2 WHERE itemID = ANY($1::int[]) AND uploadstate = $3",
+                    list(self.claimed), UPLOAD_PENDING, UPLOAD_PROCESSING)
+            print_status(f"Returned {len(self.claimed)} claimed uploads to pending", "info")
+
+    def wake(self):
+        self.wakeup.set()
+
+    async def _poll(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                while (free := self.workers - self.busy - self.queue.qsize()) > 0:
+                    rows = await self.claim(free)
+                    for row in rows:
+                        await self.queue.put(row)
+                    if len(rows) < free:
+                        break
+            except Exception as e:
+                print_status(f"Claiming uploads failed: {str(e)}", "error")
+
+    async def claim(self, limit: int) -> list:
+        async with self.pool.acquire() as conn:
+            # claimed lives in memory, so a server that died leaves its items processing
+            await conn.execute("""
+                UPDATE tableHelpitems SET uploadstate = $1
+                WHERE uploadstate = $2 AND (uploadclaimed IS NULL OR uploadclaimed < now() - make_interval(secs => $3))
+            """, UPLOAD_PENDING, UPLOAD_PROCESSING, UPLOAD_CLAIM_TIMEOUT)
+            rows = await conn.fetch("""
+                UPDATE tableHelpitems SET uploadstate = $2, uploadclaimed = now()
+                WHERE itemID IN (
+                    SELECT itemID FROM tableHelpitems WHERE uploadstate = $3
+                    ORDER BY itemID LIMIT $1 FOR UPDATE SKIP LOCKED)
+                RETURNING itemID, kind, imagefn, videofn, sha256
+            """, limit, UPLOAD_PROCESSING, UPLOAD_PENDING)
+        self.claimed.update(row["itemid"] for row in rows)
+        return rows
+
+    async def _work(self):
+        while True:
+            row = await self.queue.get()
+            self.busy += 1
+            try:
+                await self.process(row)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # the item stays processing until its claim times out
+                print_status(f"Upload worker failed on helpitem {row['itemid']}: {str(e)}", "error")
+            finally:
+                self.busy -= 1
+                self.claimed.discard(row["itemid"])
+
+    async def process(self, row):
+        file_column, id_column = UPLOAD_KINDS.get(row["kind"], UPLOAD_KINDS[1])
+        try:
+            async with self.pool.acquire() as conn:
+                # the same file is already on the host for another item: reuse its id
+                done = await conn.fetchrow(f"""
+                    SELECT host, {id_column} AS media_id FROM tableHelpitems
+                    WHERE sha256 = $1 AND uploadstate = $2 AND {id_column} IS NOT NULL LIMIT 1
+                """, row["sha256"], UPLOAD_DONE)
+            if done is not None:
+                host, media_id = done["host"], done["media_id"]
+                self.reused += 1
+            else:
+                host = self.host.name
+                media_id = await self.host.store(os.path.join(UPLOAD_DIR, row[file_column]), row["kind"],
+                                                 row["sha256"].strip())
+            async with self.pool.acquire() as conn:
+                await conn.execute(f"""
+                    UPDATE tableHelpitems SET uploadstate = $2, host = $3, {id_column} = $4
+                    WHERE itemID = $1 AND uploadstate = $5
+                """, row["itemid"], UPLOAD_DONE, host, media_id, UPLOAD_PROCESSING)
+            self.processed += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed += 1
+            print_status(f"Upload of helpitem {row['itemid']} failed: {str(e)}", "error")
+            async with self.pool.acquire() as conn:
+                await conn.execute("UPDATE tableHelpitems SET uploadstate = $2 WHERE itemID = $1",
+                                   row["itemid"], UPLOAD_FAILED)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "busy": self.busy,
+            "queued": self.queue.qsize(),
+            "received": self.received,
+            "received_bytes": self.received_bytes,
+            "deduplicated": self.deduplicated,
+            "processed": self.processed,
+            "reused_host_files": self.reused,
+            "failed": self.failed,
+        }
+
+
+# /v1/helpitems/upload - POST multipart body with a "file" part; creates a helpitem, or replaces the media of itemID
+@router.post("/v1/helpitems/upload")
+async def upload_helpitem(request: Request, chapterID: Optional[int] = None, itemID: Optional[int] = None,
+                          kind: int = 1, title: Optional[str] = None, language: Optional[str] = None,
+                          creatorID: Optional[int] = None):
+    if chapterID is None and itemID is None:
+        raise HTTPException(status_code=400, detail="chapterID or itemID is required")
+    if kind not in UPLOAD_KINDS:
+        raise HTTPException(status_code=400, detail="kind must be 1 (video) or 2 (image)")
+    # checked before the body is read so a bad target costs no upload; the write below
+    # can still fail, and then a file stored for this request only is removed again
+    async with get_db_connection() as conn:
+        if itemID is not None:
+            exists = await conn.fetchval("SELECT EXISTS (SELECT 1 FROM tableHelpitems WHERE itemID = $1)", itemID)
+        else:
+            exists = await conn.fetchval("SELECT EXISTS (SELECT 1 FROM tableChapters WHERE chapterID = $1)", chapterID)
+    if not exists:
+        return {"status": "error", "message": "Helpitem not found" if itemID is not None else "Chapter not found"}
+    writer = await receive_upload(request)
+    relative, deduplicated = await asyncio.to_thread(store_upload, writer)
+    sha = writer.hasher.hexdigest()
+    file_column, id_column = UPLOAD_KINDS[kind]
+    item_id = None
+    async with get_db_connection() as conn:
+        try:
+            if itemID is not None:
+                item_id = await conn.fetchval(f"""
+                    UPDATE tableHelpitems SET kind = $2, {file_column} = $3, sha256 = $4, uploadstate = $5,
+                                              {id_column} = NULL, host = NULL
+                    WHERE itemID = $1 RETURNING itemID
+                """, itemID, kind, relative, sha, UPLOAD_PENDING)
+                if item_id is None:
+                    return {"status": "error", "message": "Helpitem not found"}
+            else:
+                item_id = await conn.fetchval(f"""
+                    INSERT INTO tableHelpitems (chapterID, creatorID, ownerID, kind, title, language,
+                                                {file_column}, sha256, uploadstate)
+                    VALUES ($1, $2, $2, $3, $4, $5, $6, $7, $8) RETURNING itemID
+                """, chapterID, creatorID, kind, title, language, relative, sha, UPLOAD_PENDING)
+        except DB_ERRORS as e:
+            logger.error("Error saving upload: %s", e)
+            return RecordJSONResponse(content={"status": f"error {str(e)}"})
+        finally:
+            if item_id is None and not deduplicated:
+                # another request may have deduplicated against the file meanwhile; when
+                # that can't be checked the file is left in place
+                try:
+                    referenced = await conn.fetchval(
+                        "SELECT EXISTS (SELECT 1 FROM tableHelpitems WHERE sha256 = $1)", sha)
+                except Exception:
+                    referenced = True
+                if not referenced:
+                    await asyncio.to_thread(discard_upload, relative)
+    workers = app_state.get().upload_workers
+    workers.received += 1
+    workers.received_bytes += writer.size
+    workers.deduplicated += deduplicated
+    workers.wake()
+    return {"status": "success", "itemID": item_id, "sha256": sha, "bytes": writer.size,
+            "deduplicated": deduplicated}
+
+
+# /v1/uploads/stats - GET request for upload and upload worker counters of this worker
+@router.get("/v1/uploads/stats")
+async def upload_stats():
+    return RecordJSONResponse(content=app_state.get().upload_workers.stats())
+
+
+############################# App
+def create_app() -> FastAPI:
+    app = FastAPI(lifespan=lifespan, default_response_class=RecordJSONResponse)
+    app.state.metrics = Metrics()
+    app.include_router(router)
+    app.add_exception_handler(PoolAcquireTimeout, pool_acquire_timeout_handler)
+    app.add_exception_handler(VoteBufferFull, vote_buffer_full_handler)
+    app.add_exception_handler(StatementTimeout, statement_timeout_handler)
+    # the last middleware added runs first
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.add_middleware(ReadRoutingMiddleware)
+    app.add_middleware(AdmissionMiddleware)
+    app.add_middleware(MetricsMiddleware)
+    return app
+
+
+# for `uvicorn papi2:app`; python papi2.py has uvicorn call create_app in every worker
+app = create_app()
+
+
+# python papi2.py --workers 4 --db-connections 80
+# Every worker has its own pools. With --db-connections the primary budget is split
+# between the workers (one connection each is kept for the change listener), and the
+# same for --db-read-connections on every replica.
+def main():
+    parser = argparse.ArgumentParser(description="HELPthing API server")
+    parser.add_argument("--host", default=os.getenv("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")))
+    parser.add_argument("--db-connections", type=int, help="primary connections for all workers together")
+    parser.add_argument("--db-read-connections", type=int, help="connections per replica for all workers together")
+    parser.add_argument("--env-file", default=".env")
+    args = parser.parse_args()
+
+    # the workers import papi2 afresh and read their settings from the environment
+    load_dotenv(args.env_file)
+    if args.db_connections:
+        per_worker = max(1, args.db_connections // args.workers - 1)
+        os.environ["DB_POOL_MAX_SIZE"] = str(per_worker)
+        os.environ["DB_POOL_MIN_SIZE"] = str(min(int(os.getenv("DB_POOL_MIN_SIZE", "2")), per_worker))
+    if args.db_read_connections:
+        per_worker = max(1, args.db_read_connections // args.workers)
+        os.environ["DB_READ_POOL_MAX_SIZE"] = str(per_worker)
+        os.environ["DB_READ_POOL_MIN_SIZE"] = str(min(int(os.getenv("DB_READ_POOL_MIN_SIZE", "2")), per_worker))
+
+    import uvicorn
+    uvicorn.run("papi2:create_app", factory=True, host=args.host, port=args.port, workers=args.workers)
 
 
 if __name__ == '__main__':
-    uvicorn.run(app, port=8000)
+    main()
 
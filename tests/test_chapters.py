@@ -0,0 +1,60 @@
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def read_budget(client, chapter_id: int):
+    response = await client.get("/v1/chapters/read", params={"chapter_id": chapter_id})
+    return response.json()["data"]["budget"]
+
+
+async def test_budget_is_stored_exactly(client):
+    response = await client.put("/v1/chapters/create", params={"title": "budget test", "budget": "12.3"})
+    chapter_id = response.json()["chapterID"]
+    try:
+        assert await read_budget(client, chapter_id) == "12.3"
+        await client.put("/v1/chapters/update", params={"chapter_id": chapter_id, "budget": "0.1"})
+        assert await read_budget(client, chapter_id) == "0.1"
+    finally:
+        await client.delete("/v1/chapters/delete", params={"chapter_id": chapter_id})
+
+
+async def test_bulk_budget_is_stored_exactly(client):
+    response = await client.post("/v1/chapters/bulk", json=[{"title": "bulk budget test", "budget": 0.1}])
+    chapter_id = response.json()["results"][0]["chapterID"]
+    try:
+        assert await read_budget(client, chapter_id) == "0.1"
+        await client.post("/v1/chapters/bulk", json=[{"op": "update", "chapterID": chapter_id, "budget": "12.3"}])
+        assert await read_budget(client, chapter_id) == "12.3"
+    finally:
+        await client.delete("/v1/chapters/delete", params={"chapter_id": chapter_id})
+
+
+async def test_stats_budget_is_exact(client):
+    response = await client.put("/v1/chapters/create", params={"title": "stats budget test", "budget": "0.1"})
+    chapter_id = response.json()["chapterID"]
+    try:
+        await client.put("/v1/chapters/create", params={"title": "stats budget test", "budget": "0.2",
+                                                        "parentID": chapter_id})
+        stats = (await client.get("/v1/chapters/stats", params={"chapter_id": chapter_id, "subtree": "true"})).json()
+        assert stats["data"]["budget"]["chapter"] == "0.1"
+        assert stats["subtree"]["budget"]["total"] == "0.3"
+    finally:
+        children = (await client.get("/v1/chapters/children", params={"chapter_id": chapter_id})).json()["data"]
+        for child in children:
+            await client.delete("/v1/chapters/delete", params={"chapter_id": child["chapterID"]})
+        await client.delete("/v1/chapters/delete", params={"chapter_id": chapter_id})
+
+
+async def test_repeated_update_hits_the_statement_cache(client):
+    response = await client.put("/v1/chapters/create", params={"title": "statement cache test"})
+    chapter_id = response.json()["chapterID"]
+    try:
+        before = (await client.get("/v1/statements/stats")).json()
+        for budget in ("1", "2", "3"):
+            await client.put("/v1/chapters/update", params={"chapter_id": chapter_id, "budget": budget})
+        after = (await client.get("/v1/statements/stats")).json()
+        assert after["hits"] + after["misses"] - before["hits"] - before["misses"] == 3
+        assert after["hits"] > before["hits"]  # the pool hands back the same idle connection
+    finally:
+        await client.delete("/v1/chapters/delete", params={"chapter_id": chapter_id})
@@ -0,0 +1,35 @@
+import os
+
+import asyncpg
+import pytest
+
+import papi2
+
+pytestmark = pytest.mark.anyio
+
+INTERNAL_COLUMNS = {"search_vector", "language_list", "score", "sha256", "uploadclaimed"}
+
+
+def column_names(columns: str) -> set:
+    return {column.strip().lower() for column in columns.split(",")}
+
+
+async def test_reads_leave_out_internal_columns(client):
+    chapter_id = (await client.put("/v1/chapters/create", params={"title": "response test"})).json()["chapterID"]
+    conn = await asyncpg.connect(os.environ["DATABASE_URL"])
+    try:
+        await client.post("/v1/experts/create", params={"chapterID": chapter_id, "name": "response test"})
+        await conn.execute("INSERT INTO tableHelpitems (chapterID, title) VALUES ($1, 'response test')", chapter_id)
+        experts = (await client.get("/v1/experts/list", params={"chapterID": chapter_id})).json()
+        assert set(experts[0]) == column_names(papi2.EXPERT_COLUMNS)
+        expert = (await client.get("/v1/experts/read", params={"chapterID": chapter_id, "recno": experts[0]["id"]}))
+        assert set(expert.json()) == column_names(papi2.EXPERT_COLUMNS)
+        stream = await client.get("/v1/experts/list", params={"chapterID": chapter_id, "stream": "true"})
+        assert not any(column in stream.text for column in INTERNAL_COLUMNS)
+        items = (await client.get("/v1/helpitems/feed", params={"chapterID": chapter_id})).json()
+        assert set(items[0]) == column_names(papi2.HELPITEM_COLUMNS)
+    finally:
+        await conn.execute("DELETE FROM tableExperts WHERE chapterID = $1", chapter_id)
+        await conn.execute("DELETE FROM tableHelpitems WHERE chapterID = $1", chapter_id)
+        await conn.close()
+        await client.delete("/v1/chapters/delete", params={"chapter_id": chapter_id})
@@ -0,0 +1,18 @@
+import os
+import statistics
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench"))
+import startup  # noqa: E402
+
+RUNS = 3
+
+
+def test_import_and_create_app_stay_within_budget_without_side_effects(tmp_path):
+    log_file = tmp_path / "helpthing.log"
+    env = dict(os.environ, LOG_FILE=str(log_file), PYTHONDONTWRITEBYTECODE="1")
+    runs = [startup.run_once(False, env) for _ in range(RUNS)]
+    assert statistics.median(run["import"] for run in runs) <= startup.IMPORT_BUDGET
+    assert statistics.median(run["create_app"] for run in runs) <= startup.CREATE_BUDGET
+    assert [run["output"] for run in runs] == [""] * RUNS
+    assert not log_file.exists()